@@ -1,6 +1,13 @@
-import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-import random
+import os
+import sys
+
+# The shared recommender package lives in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from recommender import Recommender
+from recommender.instrumentation import timed
+
+# Ratings are loaded on first use, and sklearn is only imported once recommendations are generated
+movielens = Recommender(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ml-latest-small'))
 
 
 """
@@ -8,8 +15,8 @@ import random
 The method proposed for generating sequential group recommendations
 leverages a diverse approach in generating movie recommendations
 for a user group. It utilizes a sequential process,
-employing a separate kNN model for each recommendation sequence.
-Within each sequence, the model dynamically selects varying
+fitting one kNN model and reusing its neighbours for every recommendation sequence.
+Within each sequence, the method dynamically selects varying
 neighboring users and explores their unrated movies, 
 opting for random selections instead of consistently
 favoring top-rated choices. This multi-stage diversity 
@@ -20,53 +27,37 @@ recommendations for the user group to explore together.
 
 # Function to generate recommendations for the user group in 3 sequences with diversified aggregation
 # Input:  user_group - list of user ids
-# Input:  ratings_matrix - user-item matrix
+# Input:  ratings_matrix - user-item matrix (RatingMatrix or pivoted DataFrame)
 # Input:  top_n - number of recommendations to generate for each user
 # Input:  num_sequences - number of sequences to generate
+# Input:  seed - seed of the random choices, None for different sequences on every run
 # Output: group_recommendations - list of sequences
-def generate_group_recommendations(user_group, ratings_matrix, top_n=10, num_sequences=3):
-    group_recommendations = [] # List to store the sequences
-    for sequence in range(num_sequences): # For each sequence
-        # Instantiate and fit a new kNN model for each sequence
-        k = min(10, len(user_group) - 1)  # Number of neighbors for kNN
-        knn_model = NearestNeighbors(metric='cosine', algorithm='brute') # Instantiate kNN model
-        knn_model.fit(ratings_matrix) # Fit the model
+@timed('assignment3.generate_group_recommendations')
+def generate_group_recommendations(user_group, ratings_matrix, top_n=10, num_sequences=3, seed=None):
+    # The kNN model is fitted once and the neighbours of the group are cached across sequences; sklearn is
+    # imported on the first call
+    from recommender.sequential import SequentialRecommender
+    recommender = SequentialRecommender(ratings_matrix, metric='cosine', seed=seed)
+    return recommender.diversified_sequences(user_group, top_n=top_n, num_sequences=num_sequences)
 
-        sequence_recommendations = []
-        for user_id in user_group: # For each user in the group
-            user_idx = ratings_matrix.index.get_loc(user_id) # Index of the user
-            distances, indices = knn_model.kneighbors(ratings_matrix.iloc[user_idx, :].values.reshape(1, -1),
-                                                      n_neighbors=k + 1) # Find k nearest neighbors
-            random_indices = random.sample(range(1, len(indices.squeeze())), k)  # Randomly select k neighbors
-            similar_users_indices = indices.squeeze()[random_indices]   # Indices of similar users
-            similar_users_ratings = ratings_matrix.iloc[similar_users_indices] # Ratings of similar users
-            user_movies = ratings_matrix.iloc[user_idx] # Ratings of the user
-            unrated_movies = user_movies[user_movies == 0].index  # Filter unrated movies
-            avg_ratings = similar_users_ratings.mean(axis=0) # Average ratings of similar users
-            avg_unrated_ratings = avg_ratings[unrated_movies]  # Consider only unrated movies
-            random_movies = random.sample(avg_unrated_ratings.index.tolist(), top_n)  # Randomly select movies from similar users
-            sequence_recommendations.extend(random_movies) # Add movies to the sequence
-        group_recommendations.append(sequence_recommendations) # Add sequence to the list of sequences
-    return group_recommendations # Return list of sequences
 
-# Ratings dataset
-ratings = pd.read_csv('ml-latest-small/ratings.csv')
+def main():
+    # Test user group
+    user_group = [1, 2, 3]
 
-# Test user group
-user_group = [1, 2, 3]
+    # Sparse user-item matrix of the ratings of the selected user group
+    ratings_matrix = movielens.group_matrix(user_group)
 
-# Filter ratings for the selected user group
-group_ratings = ratings[ratings['userId'].isin(user_group)]
+    # Generate recommendations for the user group in 3 sequences with diversified aggregation
+    group_top_movies = generate_group_recommendations(user_group, ratings_matrix, num_sequences=3, seed=1)
 
-# Pivot the ratings to create a user-item matrix
-ratings_matrix = group_ratings.pivot(index='userId', columns='movieId', values='rating').fillna(0)
+    print('Assignment 3')
 
-# Generate recommendations for the user group in 3 sequences with diversified aggregation
-group_top_movies = generate_group_recommendations(user_group, ratings_matrix, num_sequences=3)
+    # Display top-10 recommendations for the user group in 3 sequences
+    for sequence, movies_sequence in enumerate(group_top_movies, start=1):
+        print(f"Sequence {sequence} Top 10 movies for the user group to watch together:")
+        print(movies_sequence[:10])
 
-print('Assignment 3')
 
-# Display top-10 recommendations for the user group in 3 sequences
-for sequence, movies_sequence in enumerate(group_top_movies, start=1):
-    print(f"Sequence {sequence} Top 10 movies for the user group to watch together:")
-    print(movies_sequence[:10])
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Recall and latency of the approximate nearest-neighbour backends against brute-force search.
+
+Runs two workloads: the user rating rows of MovieLens (sparse, Pearson or cosine) and synthetic dense
+embeddings of the kind MatrixFactorization learns, at a configurable number of rows. For every backend
+setting it prints the build time, the mean latency per query and recall@k against the exact result.
+
+    python benchmarks/ann_recall.py --data-dir assignment1/ml-latest-small --rows 200000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from recommender.ann import BACKENDS, HNSW_MAX_DENSE_BYTES, build_index, hnswlib, recall_at_k  # noqa: E402
+from recommender.data import load_rating_matrix  # noqa: E402
+
+# (backend, options) pairs from low recall / low latency to high recall / high latency
+SETTINGS = [
+    ('lsh', {'num_tables': 4, 'num_bits': 8, 'probes': 0}),
+    ('lsh', {'num_tables': 8, 'num_bits': 8, 'probes': 2}),
+    ('lsh', {'num_tables': 16, 'num_bits': 6, 'probes': 3}),
+    ('lsh', {'num_tables': 32, 'num_bits': 6, 'probes': 4}),
+    # Smaller buckets for large collections
+    ('lsh', {'num_tables': 8, 'num_bits': 14, 'probes': 4}),
+    ('lsh', {'num_tables': 16, 'num_bits': 14, 'probes': 6}),
+    ('hnsw', {'ef': 16}),
+    ('hnsw', {'ef': 64}),
+    ('hnsw', {'ef': 256}),
+]
+
+
+def run_workload(name, vectors, metric, k, num_queries, seed):
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(vectors.shape[0], size=min(num_queries, vectors.shape[0]), replace=False)
+
+    started = time.perf_counter()
+    exact_index = build_index(vectors, 'brute', metric=metric)
+    build_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    exact, _ = exact_index.query_rows(positions, k)
+    query_seconds = time.perf_counter() - started
+    print(f"\n{name}: {vectors.shape[0]} rows x {vectors.shape[1]} columns, metric={metric}, k={k}, "
+          f"{len(positions)} queries")
+    print(f"{'backend':<8}{'options':<48}{'build s':>10}{'ms/query':>10}{'recall':>8}")
+    print(f"{'brute':<8}{'':<48}{build_seconds:>10.3f}{1000 * query_seconds / len(positions):>10.3f}{1.0:>8.3f}")
+
+    for backend, options in SETTINGS:
+        if backend == 'hnsw' and (hnswlib is None or metric == 'pearson'
+                                  or 4 * vectors.shape[0] * vectors.shape[1] > HNSW_MAX_DENSE_BYTES):
+            continue
+        started = time.perf_counter()
+        index = build_index(vectors, backend, metric=metric, **options)
+        build_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        approximate, _ = index.query_rows(positions, k)
+        query_seconds = time.perf_counter() - started
+        print(f"{backend:<8}{str(options):<48}{build_seconds:>10.3f}"
+              f"{1000 * query_seconds / len(positions):>10.3f}{recall_at_k(approximate, exact):>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', default='assignment1/ml-latest-small', help='MovieLens directory')
+    parser.add_argument('--rows', type=int, default=100000, help='number of synthetic embeddings')
+    parser.add_argument('--dim', type=int, default=32, help='dimension of the synthetic embeddings')
+    parser.add_argument('--k', type=int, default=10, help='neighbours per query')
+    parser.add_argument('--queries', type=int, default=200, help='number of queries per workload')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"Backends: {', '.join(BACKENDS)}" + ('' if hnswlib else " (hnswlib not installed, skipping 'hnsw')"))
+    if os.path.exists(os.path.join(args.data_dir, 'ratings.csv')):
+        matrix = load_rating_matrix(args.data_dir)
+        for metric in ('pearson', 'cosine'):
+            run_workload('MovieLens user rows', matrix.csr, metric, args.k, args.queries, args.seed)
+
+    # Clustered embeddings, so that neighbourhoods are meaningful as they are for learned factors
+    rng = np.random.default_rng(args.seed)
+    centres = rng.standard_normal((max(args.rows // 100, 1), args.dim))
+    embeddings = centres[rng.integers(len(centres), size=args.rows)] + 0.5 * rng.standard_normal((args.rows, args.dim))
+    for metric in ('cosine', 'inner'):
+        run_workload('Synthetic embeddings', embeddings, metric, args.k, args.queries, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Load test for the HTTP service (python -m recommender serve).
+
+Opens --connections keep-alive connections that send requests back to back for --duration seconds, drawn
+from a mix of the endpoints, and reports the throughput and the client side p50 / p99 latency per endpoint,
+followed by the service's own latency percentiles and batch sizes from /metrics.
+
+    python -m recommender --data-dir assignment1/ml-latest-small serve --port 8000 &
+    python benchmarks/load_test.py --port 8000 --connections 32 --duration 20
+
+With --start-server, a local instance is started for the run and stopped afterwards.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from recommender.service import percentile  # noqa: E402
+
+DEFAULT_DATA_DIR = os.path.join(ROOT, 'assignment1', 'ml-latest-small')
+DEFAULT_MIX = 'user=70,group=20,sequential=2,explain=8'
+GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Romance', 'Thriller']
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ('user', 'similar', 'group', 'sequential', 'explain'):
+            raise ValueError(f"Unknown request kind '{name}'")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def make_request(kind, rng, users, group_size):
+    """
+    (method, path, body) of one random request of the given kind.
+    """
+    if kind == 'user':
+        return 'GET', f'/users/{rng.choice(users)}/recommendations?n=10', None
+    if kind == 'similar':
+        return 'GET', f'/users/{rng.choice(users)}/similar?n=10', None
+    group = rng.sample(users, group_size)
+    if kind == 'group':
+        strategy = rng.choice(['average', 'least_misery', 'borda', 'fairness'])
+        return 'POST', '/groups/recommendations', {'users': group, 'strategy': strategy, 'n': 10}
+    if kind == 'sequential':
+        return 'POST', '/groups/sequential', {'users': group, 'n': 10, 'sequences': 3, 'seed': rng.randrange(1000)}
+    case = rng.choice(['atomic', 'group', 'position'])
+    body = {'users': group, 'case': case}
+    if case == 'group':
+        body['genre'] = rng.choice(GENRES)
+    else:
+        body['movie'] = rng.choice([1, 318, 858, 2571, 7991])
+    return 'POST', '/groups/explanations', body
+
+
+async def send(reader, writer, host, method, path, body=None):
+    payload = json.dumps(body).encode() if body is not None else b''
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def worker(host, port, deadline, kinds, weights, options, seed, results):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            method, path, body = make_request(kind, rng, options['users'], options['group_size'])
+            started = time.perf_counter()
+            status, _ = await send(reader, writer, host, method, path, body)
+            results.append((kind, time.perf_counter() - started, status))
+    finally:
+        writer.close()
+
+
+async def fetch_json(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        _, body = await send(reader, writer, host, 'GET', path)
+        return json.loads(body)
+    finally:
+        writer.close()
+
+
+async def wait_for_server(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await fetch_json(host, port, '/health')
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    options = {'users': list(range(1, args.max_user + 1)), 'group_size': args.group_size}
+    await wait_for_server(args.host, args.port, args.startup_timeout)
+    results = []
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(worker(args.host, args.port, deadline, kinds, weights, options, args.seed + i, results)
+                           for i in range(args.connections)))
+    elapsed = time.perf_counter() - started
+    return results, elapsed, await fetch_json(args.host, args.port, '/metrics')
+
+
+def report(results, elapsed, metrics):
+    print(f"{len(results)} requests in {elapsed:.1f} s: {len(results) / elapsed:.1f} requests/s")
+    print(f"{'kind':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for kind in sorted({kind for kind, _, _ in results}):
+        latencies = sorted(seconds for other, seconds, _ in results if other == kind)
+        errors = sum(1 for other, _, status in results if other == kind and status >= 400)
+        print(f"{kind:<12}{len(latencies):>10}{errors:>8}{len(latencies) / elapsed:>10.1f}"
+              f"{1000 * percentile(latencies, 50):>10.2f}{1000 * percentile(latencies, 99):>10.2f}")
+    print("Service side:")
+    for endpoint, stats in metrics['latency'].items():
+        print(f"  {endpoint:<28} p50 {stats['p50_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  ({stats['count']} requests)")
+    for name, stats in metrics['batching'].items():
+        print(f"  {name} batches: {stats['batches']}, mean batch size {stats['mean_batch_size']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--connections', type=int, default=32, help='concurrent keep-alive connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='request kinds and their weights')
+    parser.add_argument('--max-user', type=int, default=610, help='requests use user ids 1..max-user')
+    parser.add_argument('--group-size', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start-server', action='store_true', help='start a local instance for the run')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='data of the started instance')
+    parser.add_argument('--server-args', default='', help='extra arguments of the started serve command')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='write the per-request results and the metrics as JSON')
+    args = parser.parse_args()
+
+    server = None
+    if args.start_server:
+        command = [sys.executable, '-m', 'recommender', '--data-dir', args.data_dir, 'serve', '--host', args.host,
+                   '--port', str(args.port)] + args.server_args.split()
+        server = subprocess.Popen(command, cwd=ROOT)
+    try:
+        results, elapsed, metrics = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    report(results, elapsed, metrics)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'elapsed_seconds': elapsed, 'results': results, 'metrics': metrics}, f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
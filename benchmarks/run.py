@@ -0,0 +1,255 @@
+"""
+Benchmark harness for the recommendation entry points.
+
+Times similarity, neighbour search, single-user and batched recommendation, the group recommendation
+methods of assignments 2-4 and the explanation functions of assignment 4, on ml-latest-small and on
+synthetic datasets of 1M / 10M / 25M ratings (see synthetic.py). Every scale runs in a fresh process, so the
+recorded peak RSS belongs to that scale. Results are written as JSON; with --baseline, cases slower than the
+baseline by more than --tolerance are reported as regressions and the exit status is 1.
+
+    python benchmarks/run.py --scales small,1m --output results.json
+    python benchmarks/run.py --scales small,1m --baseline results.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from recommender import NeighbourIndex, RatingMatrix, SimilarityEngine  # noqa: E402
+from recommender.aggregation import GroupScores  # noqa: E402
+from recommender.data import load_movies, load_rating_matrix, build_movies_data  # noqa: E402
+from recommender.ingest import peak_rss_bytes  # noqa: E402
+from recommender.scoring import recommend_movies, recommend_movies_batch  # noqa: E402
+from synthetic import SCALES, load_scale, synthetic_movies  # noqa: E402
+
+SMALL = 'small'
+DEFAULT_DATA_DIR = os.path.join(ROOT, 'assignment1', 'ml-latest-small')
+DEFAULT_SYNTHETIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+
+
+def load_assignment(number):
+    """
+    Imports assignment<number>/assignment.py as a module. Importing it loads no data and prints nothing.
+    """
+    path = os.path.join(ROOT, f'assignment{number}', 'assignment.py')
+    spec = importlib.util.spec_from_file_location(f'assignment{number}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, items, repeats):
+    """
+    Calls func(item) for the first repeats items (cycling) and returns the duration of every call.
+    """
+    durations = []
+    for call in range(repeats):
+        item = items[call % len(items)]
+        started = time.perf_counter()
+        func(item)
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def summarize(scale, case, durations, units=1, unit='calls'):
+    median = statistics.median(durations)
+    return {
+        'scale': scale,
+        'case': case,
+        'repeats': len(durations),
+        'seconds_median': median,
+        'seconds_min': min(durations),
+        'seconds_max': max(durations),
+        'throughput': units / median if median > 0 else float('inf'),
+        'throughput_unit': f'{unit}/s',
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def load_dataset(scale, data_dir, synthetic_dir, seed):
+    if scale == SMALL:
+        matrix = load_rating_matrix(data_dir)
+        movies = load_movies(data_dir)
+        arrays = (np.repeat(matrix.user_ids, np.diff(matrix.csr.indptr)), matrix.movie_ids[matrix.csr.indices],
+                  matrix.csr.data)
+        return arrays, movies
+    arrays = load_scale(scale, synthetic_dir, seed)
+    return arrays, synthetic_movies(np.unique(arrays[1]), seed)
+
+
+def run_scale(scale, options):
+    """
+    Runs every case at one scale and returns the list of result records.
+    """
+    repeats, seed = options['repeats'], options['seed']
+    rng = np.random.default_rng(seed)
+    (user_ids, movie_ids, ratings), movies = load_dataset(scale, options['data_dir'], options['synthetic_dir'], seed)
+    results = []
+
+    durations = measure(lambda _: RatingMatrix.from_arrays(user_ids, movie_ids, ratings), [None], max(1, repeats // 5))
+    results.append(summarize(scale, 'build_matrix', durations, len(ratings), 'ratings'))
+    matrix = RatingMatrix.from_arrays(user_ids, movie_ids, ratings)
+
+    sample = rng.choice(matrix.user_ids, size=min(repeats, len(matrix)), replace=False).tolist()
+    pairs = [(user, sample[(i + 1) % len(sample)]) for i, user in enumerate(sample)]
+    groups = [rng.choice(matrix.user_ids, size=options['group_size'], replace=False).tolist() for _ in range(repeats)]
+
+    engine = SimilarityEngine(matrix)
+    if len(matrix) <= options['max_index_users']:
+        durations = measure(lambda _: NeighbourIndex(engine, k=10), [None], 1)
+        results.append(summarize(scale, 'build_neighbour_index', durations, len(matrix), 'users'))
+        source = NeighbourIndex(engine, k=10)
+    else:
+        # All-vs-all neighbour lists are too expensive here; neighbours come from one-vs-all queries instead
+        source = engine
+
+    results.append(summarize(scale, 'pearson_similarity',
+                             measure(lambda pair: engine.similarity(*pair, metric='pearson'), pairs, repeats)))
+    results.append(summarize(scale, 'find_similar_users', measure(lambda user: source.top_k(user, 5), sample, repeats)))
+    results.append(summarize(scale, 'recommend_movies', measure(lambda user: recommend_movies(source, user), sample, repeats)))
+    batch = sample[:options['batch_size']]
+    durations = measure(lambda _: recommend_movies_batch(source, batch, k=5, top_n=10), [None], max(1, repeats // 5))
+    results.append(summarize(scale, 'recommend_movies_batch', durations, len(batch), 'users'))
+
+    def group_average(group):
+        scores = GroupScores.from_engine(source, group)
+        return scores.top_movies(scores.aggregate('average'), 10)
+
+    results.append(summarize(scale, 'generate_group_recommendations[a2]', measure(group_average, groups, repeats)))
+
+    assignment3, assignment4 = options.get('assignment3'), options.get('assignment4')
+    if assignment3 is not None:
+        results.append(summarize(scale, 'generate_group_recommendations[a3]', measure(
+            lambda group: assignment3.generate_group_recommendations(group, matrix, seed=seed), groups, repeats)))
+    if assignment4 is not None:
+        results.append(summarize(scale, 'generate_group_recommendations_with_info[a4]', measure(
+            lambda group: assignment4.generate_group_recommendations_with_info(group, matrix), groups, repeats)))
+        _, info = assignment4.generate_group_recommendations_with_info(groups[0], matrix)
+        movies_data = build_movies_data(movies)
+        movie_sample = rng.choice(matrix.movie_ids, size=min(repeats, matrix.shape[1]), replace=False).tolist()
+        results.append(summarize(scale, 'explain_atomic_case', measure(
+            lambda movie: assignment4.explain_atomic_case(movie, info, matrix, movies_data), movie_sample, repeats)))
+        results.append(summarize(scale, 'explain_group_case', measure(
+            lambda genre: assignment4.explain_group_case(genre, movies_data, info), ['Action', 'Comedy', 'Horror'],
+            repeats)))
+        results.append(summarize(scale, 'explain_position_absenteeism', measure(
+            lambda movie: assignment4.explain_position_absenteeism(movie, info, matrix, movies_data), movie_sample,
+            repeats)))
+    return results
+
+
+def _run_scale_in_child(scale, options):
+    options = dict(options)
+    if options.pop('assignments'):
+        options['assignment3'] = load_assignment(3)
+        options['assignment4'] = load_assignment(4)
+    return run_scale(scale, options)
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """
+    Cases whose median time exceeds the baseline's by more than tolerance (relative) and min_seconds (absolute).
+    """
+    previous = {(record['scale'], record['case']): record for record in baseline['results']}
+    regressions = []
+    for record in results:
+        before = previous.get((record['scale'], record['case']))
+        if before is None:
+            continue
+        slower = record['seconds_median'] - before['seconds_median']
+        if slower > min_seconds and record['seconds_median'] > before['seconds_median'] * (1 + tolerance):
+            regressions.append({**record, 'baseline_seconds_median': before['seconds_median'],
+                                'ratio': record['seconds_median'] / before['seconds_median']})
+    return regressions
+
+
+def print_results(results):
+    print(f"{'scale':<7}{'case':<46}{'median ms':>11}{'min ms':>10}{'throughput':>22}{'peak RSS MB':>13}")
+    for record in results:
+        rss = record['peak_rss_bytes']
+        print(f"{record['scale']:<7}{record['case']:<46}{1000 * record['seconds_median']:>11.3f}"
+              f"{1000 * record['seconds_min']:>10.3f}{record['throughput']:>14.1f} {record['throughput_unit']:<7}"
+              f"{(rss or 0) / 2 ** 20:>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', default=SMALL, help=f"comma-separated scales: {SMALL}, {', '.join(SCALES)}")
+    parser.add_argument('--repeats', type=int, default=20, help='calls per case')
+    parser.add_argument('--group-size', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=64, help='users per recommend_movies_batch call')
+    parser.add_argument('--max-index-users', type=int, default=20000,
+                        help='largest number of users for which the all-vs-all neighbour index is built')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='ml-latest-small directory')
+    parser.add_argument('--synthetic-dir', default=DEFAULT_SYNTHETIC_DIR, help='where synthetic datasets are kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-assignments', action='store_true',
+                        help='skip the cases that call the assignment 3 and 4 functions')
+    parser.add_argument('--in-process', action='store_true', help='run every scale in this process')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--min-seconds', type=float, default=0.0005, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    for scale in scales:
+        if scale != SMALL and scale not in SCALES:
+            parser.error(f"unknown scale '{scale}'")
+    options = {
+        'repeats': args.repeats, 'group_size': args.group_size, 'batch_size': args.batch_size,
+        'max_index_users': args.max_index_users, 'data_dir': args.data_dir, 'synthetic_dir': args.synthetic_dir,
+        'seed': args.seed, 'assignments': not args.skip_assignments,
+    }
+
+    results = []
+    for scale in scales:
+        if args.in_process:
+            results.extend(_run_scale_in_child(scale, options))
+        else:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                results.extend(executor.submit(_run_scale_in_child, scale, options).result())
+        print_results([record for record in results if record['scale'] == scale])
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': {key: value for key, value in options.items()},
+        },
+        'results': results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_seconds)
+        report['regressions'] = regressions
+        for record in regressions:
+            print(f"REGRESSION {record['scale']} {record['case']}: {1000 * record['seconds_median']:.3f} ms vs "
+                  f"{1000 * record['baseline_seconds_median']:.3f} ms baseline ({record['ratio']:.2f}x)")
+        if not regressions:
+            print(f"No regressions against {args.baseline}")
+        status = 1 if regressions else 0
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Synthetic MovieLens-like rating datasets for benchmarking at scales the bundled ml-latest-small cannot reach.
+
+Users and movies follow Zipf-like activity and popularity, and ratings come from a small latent-factor model
+rounded to MovieLens' half-star scale, so the sparsity pattern and rating distribution resemble the real data.
+Generated datasets are kept as .npz files so every run at a scale uses the same ratings.
+"""
+import os
+
+import numpy as np
+
+# (users, movies, ratings), shaped after MovieLens 1M, 10M and 25M
+SCALES = {
+    '100k': (610, 9724, 100_836),
+    '1m': (6_040, 3_706, 1_000_209),
+    '10m': (69_878, 10_677, 10_000_054),
+    '25m': (162_541, 59_047, 25_000_095),
+}
+
+
+def _zipf_weights(size, exponent, rng):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def generate_ratings(num_users, num_movies, num_ratings, factors=8, seed=0, chunk_size=5_000_000):
+    """
+    (user_ids, movie_ids, ratings) arrays with about num_ratings distinct (user, movie) pairs. Ids start at 1.
+    """
+    rng = np.random.default_rng(seed)
+    user_weights = _zipf_weights(num_users, 0.8, rng)
+    movie_weights = _zipf_weights(num_movies, 1.0, rng)
+    user_factors = rng.normal(0, 0.5, (num_users, factors)).astype(np.float32)
+    movie_factors = rng.normal(0, 0.5, (num_movies, factors)).astype(np.float32)
+    user_bias = rng.normal(0, 0.4, num_users).astype(np.float32)
+    movie_bias = rng.normal(0, 0.5, num_movies).astype(np.float32)
+
+    keys = np.empty(0, dtype=np.int64)
+    # Duplicate pairs are dropped, so draw in rounds until the target is reached
+    while len(keys) < num_ratings:
+        draw = min(chunk_size, int((num_ratings - len(keys)) * 1.2) + 1000)
+        users = rng.choice(num_users, size=draw, p=user_weights)
+        movies = rng.choice(num_movies, size=draw, p=movie_weights)
+        keys = np.unique(np.concatenate([keys, users.astype(np.int64) * num_movies + movies]))
+    keys = rng.permutation(keys)[:num_ratings]
+    users, movies = keys // num_movies, keys % num_movies
+
+    ratings = np.empty(len(keys), dtype=np.float32)
+    for start in range(0, len(keys), chunk_size):
+        u, m = users[start:start + chunk_size], movies[start:start + chunk_size]
+        raw = 3.5 + user_bias[u] + movie_bias[m] + np.einsum('ij,ij->i', user_factors[u], movie_factors[m])
+        raw += rng.normal(0, 0.6, len(u)).astype(np.float32)
+        ratings[start:start + chunk_size] = np.clip(np.round(raw * 2) / 2, 0.5, 5.0)
+    return (users + 1).astype(np.int32), (movies + 1).astype(np.int32), ratings
+
+
+def load_scale(scale, data_dir, seed=0):
+    """
+    Ratings of a named scale from SCALES, generated on first use and stored in data_dir.
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale '{scale}', expected one of {tuple(SCALES)}")
+    path = os.path.join(data_dir, f'synthetic-{scale}-{seed}.npz')
+    if os.path.exists(path):
+        with np.load(path) as saved:
+            return saved['user_ids'], saved['movie_ids'], saved['ratings']
+    user_ids, movie_ids, ratings = generate_ratings(*SCALES[scale], seed=seed)
+    os.makedirs(data_dir, exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, user_ids=user_ids, movie_ids=movie_ids, ratings=ratings)
+    os.replace(tmp, path)
+    return user_ids, movie_ids, ratings
+
+
+def synthetic_movies(movie_ids, seed=0):
+    """
+    movies.csv-style DataFrame with made-up titles and genres for the explanation benchmarks.
+    """
+    import pandas as pd
+
+    genres = np.array(['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Drama', 'Fantasy', 'Horror',
+                       'Romance', 'Sci-Fi', 'Thriller'])
+    rng = np.random.default_rng(seed)
+    picks = rng.random((len(movie_ids), len(genres))) < 0.2
+    picks[np.arange(len(movie_ids)), rng.integers(len(genres), size=len(movie_ids))] = True
+    return pd.DataFrame({
+        'movieId': movie_ids,
+        'title': [f'Movie {movie_id}' for movie_id in np.asarray(movie_ids).tolist()],
+        'genres': ['|'.join(genres[row]) for row in picks],
+    })
@@ -0,0 +1,47 @@
+"""
+Shared, vectorized building blocks for the recommender assignments.
+
+Importing the package is cheap: the names below are imported from their submodules on first access, so
+numpy, scipy, pandas and sklearn are only loaded once something that needs them is used.
+"""
+import importlib
+
+_EXPORTS = {
+    'ContentIndex': 'content',
+    'GroupDisagreement': 'disagreement',
+    'GroupScores': 'aggregation',
+    'IncrementalRecommender': 'incremental',
+    'ItemSimilarityModel': 'items',
+    'LRUCache': 'cache',
+    'MatrixFactorization': 'factorization',
+    'NeighbourIndex': 'neighbours',
+    'RatingMatrix': 'matrix',
+    'RecommendationCache': 'cache',
+    'Recommender': 'api',
+    'SimilarityEngine': 'similarity',
+    'aggregate': 'aggregation',
+    'build_index': 'ann',
+    'evaluate': 'evaluation',
+    'iter_recommendations': 'scoring',
+    'map_users': 'parallel',
+    'predict_from_neighbours': 'scoring',
+    'recommend_movies': 'scoring',
+    'recommend_movies_batch': 'scoring',
+    'recommend_movies_parallel': 'parallel',
+    'top_k_indices': 'similarity',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,268 @@
+"""
+Command line interface of the recommender.
+
+    python -m recommender --data-dir assignment1/ml-latest-small recommend 1
+    python -m recommender recommend 1 --item-based
+    python -m recommender recommend 1 --recent --events new-ratings.csv
+    python -m recommender content --genre Animation --tag pixar
+    python -m recommender similarity 1 2 --metric cosine
+    python -m recommender group 1 2 3 --strategy least_misery
+    python -m recommender sequential 1 2 3 --seed 1
+    python -m recommender --profile cprofile group 1 2 3
+    python -m recommender explain atomic 2571 --group 1 2 3
+    python -m recommender evaluate --folds 5 --require mf:rmse<=0.9
+    python -m recommender serve --port 8000
+    python -m recommender snapshot snapshots/ && python -m recommender --snapshot snapshots/ serve --executor process
+"""
+import argparse
+import json
+import sys
+
+from . import instrumentation
+from .api import Recommender
+
+
+def _similarity(recommender, args):
+    if args.metric == 'cosine':
+        return recommender.cosine_similarity(args.user1, args.user2)
+    return recommender.pearson_similarity(args.user1, args.user2)
+
+
+def _similar(recommender, args):
+    return recommender.find_similar_users(args.user, args.n)
+
+
+def _recommend(recommender, args):
+    if args.events:
+        recommender.incremental.consume_file(args.events)
+    if args.recent:
+        return recommender.recommend_movies_recent(args.user, args.n, args.neighbours)
+    if args.item_based:
+        return recommender.recommend_movies_item_based(args.user, args.n)
+    if args.hybrid:
+        return recommender.recommend_movies_hybrid(args.user, args.n, args.candidates)
+    return recommender.recommend_movies(args.user, num_users=args.neighbours)[:args.n]
+
+
+def _snapshot(recommender, args):
+    return recommender.write_snapshot(args.root, item_model=args.item_model, keep=args.keep)
+
+
+def _content(recommender, args):
+    if args.similar_to is not None:
+        return recommender.similar_movies_by_content(args.similar_to, args.n)
+    return recommender.recommend_movies_by_content(args.user, args.n, genres=args.genre, tags=args.tag)
+
+
+def _item_model(recommender, args):
+    model = recommender.build_item_model(rebuild=True)
+    return f"{recommender.item_model_path()}: {model.similarities.nnz} similarities of {model.similarities.shape[0]} movies"
+
+
+def _group(recommender, args):
+    return recommender.group_recommendations(args.users, args.strategy, args.n, disagreement=args.disagreement)
+
+
+def _sequential(recommender, args):
+    if args.ranked:
+        sequences, _ = recommender.sequential_recommendations_with_info(args.users, args.n, args.sequences)
+        return sequences
+    return recommender.sequential_recommendations(args.users, args.n, args.sequences, seed=args.seed)
+
+
+def _explain(recommender, args):
+    if args.case == 'atomic':
+        return recommender.explain_atomic_case(int(args.subject), args.group)
+    if args.case == 'position':
+        return recommender.explain_position_absenteeism(int(args.subject), args.group)
+    return recommender.explain_group_case(args.subject, args.group)
+
+
+def _serve(recommender, args):
+    import logging
+
+    from .service import serve
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    serve(recommender, args.host, args.port, executor=args.executor, workers=args.workers,
+          max_batch_size=args.max_batch_size, max_delay=args.max_delay_ms / 1000)
+
+
+def _evaluate(recommender, args):
+    from .evaluation import check_requirements, evaluate, format_report, parse_requirement, summarize
+
+    for requirement in args.require:
+        parse_requirement(requirement)
+    results = evaluate({'data_dir': recommender.data_dir, 'cache_dir': recommender.cache_dir},
+                       args.algorithms.split(','), split=args.split, folds=args.folds,
+                       test_fraction=args.test_fraction, k=args.k, seed=args.seed, workers=args.workers)
+    summary = summarize(results)
+    print(json.dumps({'folds': results, 'summary': summary}) if args.json else format_report(summary, args.k))
+    failures = check_requirements(summary, args.require)
+    for failure in failures:
+        print(f"Requirement not met: {failure}", file=sys.stderr)
+    if failures:
+        raise SystemExit(1)
+
+
+def _to_python(value):
+    # numpy scalars and tuples as plain JSON values
+    if isinstance(value, (list, tuple)):
+        return [_to_python(item) for item in value]
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _backend_option(text):
+    # KEY=VALUE with a numeric VALUE, e.g. num_tables=32
+    key, sep, value = text.partition('=')
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {text!r}")
+    try:
+        return key, int(value)
+    except ValueError:
+        pass
+    try:
+        return key, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{key} must be a number, got {value!r}") from None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m recommender', description='Movie recommendations.')
+    parser.add_argument('--data-dir', help='directory of the MovieLens CSV files (default: $RECOMMENDER_DATA_DIR '
+                                           'or ./ml-latest-small)')
+    parser.add_argument('--cache-dir', help='directory of the binary data cache')
+    parser.add_argument('--half-life-days', type=float, default=180,
+                        help='age at which a rating counts half in time-aware recommendations')
+    parser.add_argument('--neighbour-backend', choices=('brute', 'lsh'),
+                        help='find similar users with this nearest-neighbour index instead of a full search')
+    parser.add_argument('--backend-option', type=_backend_option, action='append', default=[], metavar='KEY=VALUE',
+                        help='parameter of the --neighbour-backend index, e.g. num_tables=32 (repeatable)')
+    parser.add_argument('--snapshot', metavar='ROOT', help='serve from the snapshot published in ROOT')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    parser.add_argument('--profile', choices=('cprofile', 'sampling'),
+                        help='profile the command and print the report to stderr (for serve, add ?profile= to a '
+                             'request instead)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('similarity', help='similarity between two users')
+    command.add_argument('user1', type=int)
+    command.add_argument('user2', type=int)
+    command.add_argument('--metric', choices=('pearson', 'cosine'), default='pearson')
+    command.set_defaults(run=_similarity)
+
+    command = commands.add_parser('similar', help='most similar users of a user')
+    command.add_argument('user', type=int)
+    command.add_argument('-n', type=int, default=10)
+    command.set_defaults(run=_similar)
+
+    command = commands.add_parser('recommend', help='movie recommendations for a user')
+    command.add_argument('user', type=int)
+    command.add_argument('-n', type=int, default=10)
+    command.add_argument('--neighbours', type=int, default=5, help='similar users the predictions come from')
+    command.add_argument('--item-based', action='store_true', help='predict from the item similarity model')
+    command.add_argument('--hybrid', action='store_true',
+                         help='score only the movies matching the user\'s genres and tags with the item model')
+    command.add_argument('--candidates', type=int, default=200, help='candidate movies of --hybrid')
+    command.add_argument('--recent', action='store_true', help='weight recent ratings more, see --half-life-days')
+    command.add_argument('--events', metavar='CSV',
+                         help='apply the timestamped ratings of a ratings.csv-style file first, without a rebuild')
+    command.set_defaults(run=_recommend)
+
+    command = commands.add_parser('content', help='movies by genres and tags, also for new users and movies')
+    command.add_argument('--user', type=int, help='match the genres and tags of the movies the user rated')
+    command.add_argument('--genre', action='append', default=[])
+    command.add_argument('--tag', action='append', default=[])
+    command.add_argument('--similar-to', type=int, metavar='MOVIE', help='movies like this movie')
+    command.add_argument('-n', type=int, default=10)
+    command.set_defaults(run=_content)
+
+    command = commands.add_parser('snapshot', help='publish a memory-mapped snapshot for serving')
+    command.add_argument('root', help='directory of the snapshots')
+    command.add_argument('--item-model', action='store_true', help='include the item similarity model')
+    command.add_argument('--keep', type=int, default=3, help='snapshots kept in root')
+    command.set_defaults(run=_snapshot)
+
+    command = commands.add_parser('item-model', help='rebuild the item similarity model of the ratings')
+    command.set_defaults(run=_item_model)
+
+    command = commands.add_parser('group', help='movie recommendations for a group')
+    command.add_argument('users', type=int, nargs='+')
+    command.add_argument('-n', type=int, default=10)
+    command.add_argument('--strategy', default='average', help='aggregation strategy, e.g. average, least_misery')
+    command.add_argument('--disagreement', action='store_true', help='scale the scores by the group disagreement')
+    command.set_defaults(run=_group)
+
+    command = commands.add_parser('sequential', help='sequences of group recommendations')
+    command.add_argument('users', type=int, nargs='+')
+    command.add_argument('-n', type=int, default=10, help='movies per member and sequence')
+    command.add_argument('--sequences', type=int, default=3)
+    command.add_argument('--seed', type=int)
+    command.add_argument('--ranked', action='store_true', help='ranked instead of diversified sequences')
+    command.set_defaults(run=_sequential)
+
+    command = commands.add_parser('explain', help='explain the sequential recommendations of a group')
+    command.add_argument('case', choices=('atomic', 'group', 'position'))
+    command.add_argument('subject', help='movie id, or a genre for the group case')
+    command.add_argument('--group', type=int, nargs='+', required=True)
+    command.set_defaults(run=_explain)
+
+    command = commands.add_parser('evaluate', help='cross-validate the recommendation algorithms')
+    command.add_argument('--algorithms', default='baseline,user_knn,item_knn,mf',
+                         help='comma separated, from baseline, user_knn, item_knn and mf')
+    command.add_argument('--split', choices=('random', 'time'), default='random',
+                         help='random folds, or the latest ratings of every user held out')
+    command.add_argument('--folds', type=int, default=5)
+    command.add_argument('--test-fraction', type=float, default=0.2, help='held-out fraction of the time split')
+    command.add_argument('-k', type=int, default=10, help='length of the evaluated top-k lists')
+    command.add_argument('--seed', type=int, default=0)
+    command.add_argument('--workers', type=int, help='processes the folds run in (default: one per core)')
+    command.add_argument('--require', action='append', default=[], metavar='ALGORITHM:METRIC>=VALUE',
+                         help='fail with exit status 1 unless the mean over the folds meets this, e.g. '
+                              'item_knn:rmse<=0.95; may be repeated')
+    command.set_defaults(run=_evaluate)
+
+    command = commands.add_parser('serve', help='run the HTTP service')
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8000)
+    command.add_argument('--executor', choices=('thread', 'process'), default='thread',
+                         help='pool the CPU bound work runs in')
+    command.add_argument('--workers', type=int, help='pool size (default: chosen by concurrent.futures)')
+    command.add_argument('--max-batch-size', type=int, default=64, help='requests scored together at most')
+    command.add_argument('--max-delay-ms', type=float, default=2.0,
+                         help='how long a request waits for others to join its batch')
+    command.set_defaults(run=_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.snapshot:
+        recommender = Recommender.from_snapshot(args.snapshot, cache_dir=args.cache_dir,
+                                                half_life_days=args.half_life_days,
+                                                neighbour_backend=args.neighbour_backend,
+                                                neighbour_backend_options=dict(args.backend_option))
+    else:
+        recommender = Recommender(args.data_dir, args.cache_dir, half_life_days=args.half_life_days,
+                                  neighbour_backend=args.neighbour_backend,
+                                  neighbour_backend_options=dict(args.backend_option))
+    if args.profile:
+        with instrumentation.profile(args.profile) as profile:
+            result = _to_python(args.run(recommender, args))
+        print(profile.report, file=sys.stderr)
+    else:
+        result = _to_python(args.run(recommender, args))
+    if result is None:
+        return 0
+    if args.json:
+        print(json.dumps(result))
+    elif isinstance(result, list):
+        for item in result:
+            print(' '.join(str(value) for value in item) if isinstance(item, list) else item)
+    else:
+        print(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
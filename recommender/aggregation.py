@@ -0,0 +1,221 @@
+import warnings
+
+import numpy as np
+
+from . import instrumentation
+from .scoring import predict_block
+from .similarity import top_k_indices
+
+
+def _quiet(func, scores, axis=0):
+    # Movies nobody has a prediction for give all-nan columns, which stay nan without a warning
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(scores, axis=axis)
+
+
+def _handle_missing(scores, impute, min_members):
+    # Movies fewer than min_members members have a prediction for become nan; with impute, the remaining
+    # missing predictions become the member's mean prediction. Members without any prediction stay nan.
+    present = ~np.isnan(scores)
+    if impute:
+        scores = np.where(present, scores, _quiet(np.nanmean, scores, axis=1)[:, None])
+    if min_members > 1:
+        scores = np.where(present.sum(axis=0) >= min_members, scores, np.nan)
+    return scores
+
+
+def average(scores, impute=False, min_members=1):
+    """
+    Mean predicted rating over the members that have a prediction. With impute=True a member without a
+    prediction counts with their mean predicted rating instead of being skipped. Movies fewer than
+    min_members members have a prediction for are not recommended.
+    """
+    return _quiet(np.nanmean, _handle_missing(scores, impute, min_members))
+
+
+def least_misery(scores, impute=False, min_members=1):
+    """
+    Lowest predicted rating among the members that have a prediction: the group is as happy as its least
+    happy member. impute and min_members work as in average.
+    """
+    return _quiet(np.nanmin, _handle_missing(scores, impute, min_members))
+
+
+def most_pleasure(scores):
+    """
+    Highest predicted rating among the members.
+    """
+    return _quiet(np.nanmax, scores)
+
+
+def borda_count(scores):
+    """
+    Borda count: each member gives a movie as many points as the number of movies they predict lower, so
+    only the order of each member's predictions counts, not their scale. Missing predictions get no points.
+    """
+    present = ~np.isnan(scores)
+    ranked = np.where(present, scores, -np.inf)
+    # Average rank for ties, computed from how many of the member's movies score lower or equal
+    ordered = np.sort(ranked, axis=1)
+    lower = np.stack([np.searchsorted(row, values, side='left') for row, values in zip(ordered, ranked)])
+    not_higher = np.stack([np.searchsorted(row, values, side='right') for row, values in zip(ordered, ranked)])
+    missing = (~present).sum(axis=1, keepdims=True)
+    points = np.where(present, (lower + not_higher - 1) / 2 - missing, 0.0)
+    aggregated = points.sum(axis=0)
+    aggregated[~present.any(axis=0)] = np.nan
+    return aggregated
+
+
+def approval_voting(scores, threshold=4.0):
+    """
+    Number of members whose predicted rating reaches threshold.
+    """
+    present = ~np.isnan(scores)
+    aggregated = (np.where(present, scores, -np.inf) >= threshold).sum(axis=0).astype(np.float64)
+    aggregated[~present.any(axis=0)] = np.nan
+    return aggregated
+
+
+def fairness(scores, weight=1.0):
+    """
+    Mean predicted rating minus weight times its standard deviation over the members, which prefers movies
+    the whole group likes about equally over movies only part of the group loves.
+    """
+    return _quiet(np.nanmean, scores) - weight * _quiet(np.nanstd, scores)
+
+
+STRATEGIES = {
+    'average': average,
+    'least_misery': least_misery,
+    'most_pleasure': most_pleasure,
+    'borda': borda_count,
+    'approval': approval_voting,
+    'fairness': fairness,
+}
+
+
+def register_strategy(name, func):
+    """
+    Adds an aggregation strategy. func(scores, **options) receives the (members x movies) array, nan where a
+    member has no prediction, and returns one value per movie, nan for movies that cannot be recommended.
+    """
+    STRATEGIES[name] = func
+
+
+def aggregate(scores, strategy='average', **options):
+    """
+    Aggregates a (members x movies) score array with a strategy given by name or as a function.
+    """
+    func = strategy if callable(strategy) else STRATEGIES.get(strategy)
+    if func is None:
+        raise ValueError(f"Unknown aggregation strategy '{strategy}', expected one of {tuple(STRATEGIES)}")
+    return func(np.asarray(scores, dtype=np.float64), **options)
+
+
+def top_n_positions(values, n=10, tie_break=None):
+    """
+    Positions of the n largest values in descending order with a partial sort, skipping nan. Ties are broken
+    by the larger tie_break value when it is given, then by position.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.flatnonzero(np.isnan(values))
+    if tie_break is None:
+        return top_k_indices(values, n, exclude=missing)
+    values = values.copy()
+    values[missing] = -np.inf
+    n = max(0, min(n, len(values) - len(missing)))
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    kth = np.partition(-values, n - 1)[n - 1]
+    candidates = np.flatnonzero(-values <= kth)
+    tie_break = np.nan_to_num(np.asarray(tie_break, dtype=np.float64)[candidates], nan=-np.inf)
+    order = np.lexsort((candidates, -tie_break, -values[candidates]))
+    return candidates[order[:n]]
+
+
+class GroupScores:
+    """
+    Predicted ratings of the members of a group as a (members x movies) array, with the movie id of every
+    column, so aggregation works on whole arrays keyed by real movie ids. Missing predictions (movies a member
+    rated, or that none of their neighbours rated) are nan, and the strategies skip them unless asked to impute
+    them (see average). Only movies with at least one prediction get a column.
+    """
+
+    def __init__(self, user_ids, movie_ids, scores):
+        self.user_ids = list(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        self.scores = np.asarray(scores, dtype=np.float64)
+
+    @classmethod
+    def from_engine(cls, engine, user_ids, k=5):
+        """
+        Scores the members with the batched neighbourhood scorer. engine is a SimilarityEngine or a
+        NeighbourIndex and k the number of similar users per member.
+        """
+        return cls.from_engine_many(engine, [user_ids], k)[0]
+
+    @classmethod
+    def from_engine_many(cls, engine, groups, k=5):
+        """
+        GroupScores of several groups, scoring the distinct members of all of them in one batch.
+        """
+        groups = [list(user_ids) for user_ids in groups]
+        members = list(dict.fromkeys(user_id for user_ids in groups for user_id in user_ids))
+        with instrumentation.timer('group.similarity'):
+            positions, neighbours, similarities = engine.top_k_batch(members, k)
+        with instrumentation.timer('group.scoring'):
+            predictions = dict(zip(members, predict_block(engine.X, positions, neighbours, similarities)))
+        return [cls._from_predictions(engine, user_ids, [predictions[user_id] for user_id in user_ids])
+                for user_ids in groups]
+
+    @classmethod
+    def _from_predictions(cls, engine, user_ids, predictions):
+        columns = np.unique(np.concatenate([movies for movies, _ in predictions] + [np.empty(0, np.int64)]))
+        scores = np.full((len(user_ids), len(columns)), np.nan)
+        for row, (movies, predicted) in enumerate(predictions):
+            scores[row, np.searchsorted(columns, movies)] = predicted
+        return cls(user_ids, engine.movie_ids[columns], scores)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def aggregate(self, strategy='average', **options):
+        with instrumentation.timer('group.aggregation'):
+            return aggregate(self.scores, strategy, **options)
+
+    def top_movies(self, aggregated, n=10, tie_break=None):
+        """
+        Movie ids of the n best aggregated values, see top_n_positions.
+        """
+        return self.movie_ids[top_n_positions(aggregated, n, tie_break)].tolist()
+
+    def recommend(self, strategy='average', n=10, **options):
+        """
+        Top-n movie ids for the group under an aggregation strategy. Strategies that produce many ties (Borda
+        count, approval voting) are tie-broken by the average prediction.
+        """
+        aggregated = self.aggregate(strategy, **options)
+        tie_break = None if strategy == 'average' else average(self.scores)
+        return self.top_movies(aggregated, n, tie_break)
+
+    def recommend_round_robin(self, n=10):
+        """
+        Fairness-aware selection: movies are picked one at a time, each time the favourite remaining movie of
+        the member whose picks so far they like least (by summed predicted rating), so no member is left out.
+        """
+        scores = np.where(np.isnan(self.scores), -np.inf, self.scores)
+        satisfaction = np.zeros(len(self))
+        available = np.isfinite(scores).any(axis=0)
+        picked = []
+        while len(picked) < n and available.any():
+            member = int(np.argmin(satisfaction))
+            candidates = np.where(available, scores[member], -np.inf)
+            if not np.isfinite(candidates).any():
+                # The member has no predictions left, fall back to the group average
+                candidates = np.where(available, np.nan_to_num(average(self.scores), nan=-np.inf), -np.inf)
+            movie = int(top_k_indices(candidates, 1)[0])
+            picked.append(movie)
+            available[movie] = False
+            satisfaction += np.where(np.isfinite(scores[:, movie]), scores[:, movie], 0)
+        return self.movie_ids[picked].tolist()
@@ -0,0 +1,340 @@
+import numpy as np
+from scipy import sparse
+
+from .similarity import top_k_indices
+
+try:
+    import hnswlib
+except ImportError:  # Optional backend
+    hnswlib = None
+
+METRICS = ('cosine', 'inner', 'pearson')
+# hnswlib stores dense float32 vectors, so sparse rows (e.g. user rating rows) are only accepted up to this size
+HNSW_MAX_DENSE_BYTES = 256 << 20
+
+
+def _row_sums(vectors):
+    if sparse.issparse(vectors):
+        return np.asarray(vectors.sum(axis=1)).ravel(), np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel()
+    return vectors.sum(axis=1), np.einsum('ij,ij->i', vectors, vectors)
+
+
+def _as_vectors(vectors):
+    if sparse.issparse(vectors):
+        return sparse.csr_matrix(vectors, dtype=np.float64)
+    return np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+
+
+class VectorSet:
+    """
+    Rows of a dense array or sparse matrix (user rating rows, or learned user / movie factors) together with the
+    per-row statistics needed to score them against queries under one metric:
+
+    - 'cosine': cosine similarity of the rows.
+    - 'inner': plain inner product, e.g. for matrix factorization scores.
+    - 'pearson': Pearson correlation of the complete rows (missing entries counted as 0), i.e. the cosine of
+      the mean-centred rows, as used by SimilarityEngine. Rows stay sparse; the centring is applied to the
+      products instead of to the rows.
+    """
+
+    def __init__(self, vectors, metric='cosine'):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown ANN metric '{metric}', expected one of {METRICS}")
+        self.metric = metric
+        self.vectors = _as_vectors(vectors)
+        self.num_rows, self.dim = self.vectors.shape
+        self.means, self.norms = self.statistics(self.vectors)
+
+    def __len__(self):
+        return self.num_rows
+
+    def statistics(self, vectors):
+        """
+        (means, norms) of rows under the metric; means are 0 except for 'pearson'.
+        """
+        sums, sumsq = _row_sums(vectors)
+        if self.metric == 'pearson':
+            means = sums / self.dim
+            return means, np.sqrt(np.maximum(sumsq - self.dim * means ** 2, 0))
+        return np.zeros(len(sums)), np.sqrt(sumsq)
+
+    def rows(self, positions):
+        return self.vectors[positions]
+
+    def scores(self, queries, positions=None, query_stats=None):
+        """
+        Similarities between every query row and the rows at positions (all rows by default), as a dense
+        (num_queries x num_positions) array.
+        """
+        targets = self.vectors if positions is None else self.vectors[positions]
+        means = self.means if positions is None else self.means[positions]
+        norms = self.norms if positions is None else self.norms[positions]
+        products = queries @ targets.T
+        products = products.toarray() if sparse.issparse(products) else np.asarray(products)
+        if self.metric == 'inner':
+            return products
+        query_means, query_norms = query_stats if query_stats is not None else self.statistics(queries)
+        if self.metric == 'pearson':
+            products = products - self.dim * np.outer(query_means, means)
+        denominator = np.outer(query_norms, norms)
+        out = np.zeros(products.shape)
+        np.divide(products, denominator, out=out, where=denominator > 0)
+        return out
+
+
+def _collect(rows, k, num_queries):
+    indices = np.full((num_queries, k), -1, dtype=np.int64)
+    similarities = np.full((num_queries, k), np.nan)
+    for row, (best, scores) in enumerate(rows):
+        indices[row, :len(best)] = best
+        similarities[row, :len(best)] = scores
+    return indices, similarities
+
+
+class BruteForceIndex:
+    """
+    Exact search: every query is scored against every row, in blocks of block_size queries. This is the
+    reference the approximate backends are measured against.
+    """
+
+    def __init__(self, vectors, metric='cosine', block_size=256):
+        self.space = vectors if isinstance(vectors, VectorSet) else VectorSet(vectors, metric)
+        self.block_size = block_size
+
+    @property
+    def metric(self):
+        return self.space.metric
+
+    def __len__(self):
+        return len(self.space)
+
+    def query(self, queries, k=10, exclude=None):
+        """
+        The k most similar rows for each query row, as (indices, similarities) arrays of shape (num_queries, k)
+        padded with -1 / nan. exclude optionally gives one row position per query to leave out (e.g. itself).
+        """
+        queries = _as_vectors(queries)
+        stats = self.space.statistics(queries)
+        results = []
+        for start in range(0, queries.shape[0], self.block_size):
+            block = slice(start, start + self.block_size)
+            scores = self.space.scores(queries[block], query_stats=(stats[0][block], stats[1][block]))
+            for offset, row in enumerate(scores):
+                skip = None if exclude is None else exclude[start + offset]
+                best = top_k_indices(row, k, exclude=skip)
+                results.append((best, row[best]))
+        return _collect(results, k, queries.shape[0])
+
+    def query_rows(self, positions, k=10):
+        """
+        Neighbours of rows of the index itself, leaving each row out of its own result.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.query(self.space.rows(positions), k, exclude=positions)
+
+
+class RandomProjectionIndex:
+    """
+    Locality-sensitive hashing with signed random projections (SimHash). Each of num_tables tables hashes a
+    row to the signs of num_bits random projections, so rows at a small angle share a bucket with high
+    probability. A query gathers the rows in its bucket of every table, plus the buckets reached by flipping
+    its probes least certain bits, and ranks only those candidates exactly.
+
+    More tables and probes raise recall and latency; more bits make buckets smaller, which lowers both.
+    For the 'inner' metric rows are first lifted to equal norm (the usual MIPS-to-cosine reduction), and for
+    'pearson' the projections are taken of the mean-centred rows without densifying sparse input.
+    """
+
+    def __init__(self, vectors, metric='cosine', num_tables=8, num_bits=12, probes=2, seed=0):
+        if not 1 <= num_bits <= 62:
+            raise ValueError(f"num_bits must be between 1 and 62, got {num_bits}")
+        self.space = vectors if isinstance(vectors, VectorSet) else VectorSet(vectors, metric)
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.probes = probes
+        rng = np.random.default_rng(seed)
+        # One extra row for the norm-lifting coordinate of the 'inner' metric
+        self._planes = rng.standard_normal((self.space.dim + 1, num_tables * num_bits))
+        self._max_norm = float(np.sqrt(_row_sums(self.space.vectors)[1].max())) if len(self.space) else 0.0
+        self._weights = 1 << np.arange(num_bits, dtype=np.int64)
+        codes = self._codes(self._project(self.space.vectors, *self.space.statistics(self.space.vectors)))
+        self._order = np.argsort(codes, axis=0, kind='stable')
+        self._sorted_codes = np.take_along_axis(codes, self._order, axis=0)
+
+    @property
+    def metric(self):
+        return self.space.metric
+
+    def __len__(self):
+        return len(self.space)
+
+    def _project(self, vectors, means, norms, is_query=False):
+        planes, lift = self._planes[:-1], self._planes[-1]
+        projections = vectors @ planes
+        projections = np.asarray(projections.toarray() if sparse.issparse(projections) else projections)
+        if self.metric == 'pearson':
+            projections -= np.outer(means, planes.sum(axis=0))
+        elif self.metric == 'inner' and not is_query:
+            sumsq = _row_sums(vectors)[1]
+            projections += np.outer(np.sqrt(np.maximum(self._max_norm ** 2 - sumsq, 0)), lift)
+        return projections.reshape(len(projections), self.num_tables, self.num_bits)
+
+    def _codes(self, projections):
+        return (projections > 0).astype(np.int64) @ self._weights
+
+    def _probe_codes(self, projections):
+        # The bucket itself first, then the buckets one flip away in the bits closest to their hyperplane
+        codes = self._codes(projections)
+        probes = [codes]
+        if self.probes:
+            uncertain = np.argsort(np.abs(projections), axis=2)[:, :, :self.probes]
+            for bit in range(uncertain.shape[2]):
+                probes.append(codes ^ self._weights[uncertain[:, :, bit]])
+        return np.stack(probes, axis=2)
+
+    def candidates(self, queries, is_query=True):
+        """
+        Candidate row positions for every query row, as a list of arrays.
+        """
+        queries = _as_vectors(queries)
+        projections = self._project(queries, *self.space.statistics(queries), is_query=is_query)
+        probe_codes = self._probe_codes(projections)
+        lows = np.empty(probe_codes.shape, dtype=np.int64)
+        highs = np.empty(probe_codes.shape, dtype=np.int64)
+        for table in range(self.num_tables):
+            column = self._sorted_codes[:, table]
+            lows[:, table] = np.searchsorted(column, probe_codes[:, table], side='left')
+            highs[:, table] = np.searchsorted(column, probe_codes[:, table], side='right')
+        result = []
+        for row in range(len(probe_codes)):
+            found = [self._order[lo:hi, table]
+                     for table in range(self.num_tables)
+                     for lo, hi in zip(lows[row, table], highs[row, table]) if hi > lo]
+            result.append(np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64))
+        return result
+
+    def query(self, queries, k=10, exclude=None):
+        """
+        Approximate k most similar rows for each query row, in the format of BruteForceIndex.query. Queries
+        with fewer than k candidates return fewer neighbours.
+        """
+        queries = _as_vectors(queries)
+        query_means, query_norms = self.space.statistics(queries)
+        results = []
+        for row, candidates in enumerate(self.candidates(queries)):
+            if exclude is not None:
+                candidates = candidates[candidates != exclude[row]]
+            scores = self.space.scores(queries[row:row + 1], candidates,
+                                       query_stats=(query_means[row:row + 1], query_norms[row:row + 1]))[0]
+            best = top_k_indices(scores, k)
+            results.append((candidates[best], scores[best]))
+        return _collect(results, k, queries.shape[0])
+
+    def query_rows(self, positions, k=10):
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.query(self.space.rows(positions), k, exclude=positions)
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph from the optional hnswlib package, for dense vectors such as
+    learned factors. ef is the recall knob: the size of the candidate list kept during a search.
+
+    hnswlib only indexes dense vectors. Sparse input is densified block by block, but the graph keeps a dense
+    copy of every row, so sparse input whose dense copy would exceed HNSW_MAX_DENSE_BYTES (rating rows of
+    anything but a small dataset) is rejected; use the 'lsh' backend for those.
+    """
+
+    def __init__(self, vectors, metric='cosine', ef=64, m=16, ef_construction=200, seed=0):
+        if hnswlib is None:
+            raise ImportError("The 'hnsw' backend requires the hnswlib package")
+        if metric == 'pearson':
+            raise ValueError("The 'hnsw' backend supports the 'cosine' and 'inner' metrics")
+        self.space = vectors if isinstance(vectors, VectorSet) else VectorSet(vectors, metric)
+        data = self.space.vectors
+        if sparse.issparse(data) and 4 * len(self.space) * self.space.dim > HNSW_MAX_DENSE_BYTES:
+            raise ValueError(f"The 'hnsw' backend would hold a dense copy of {len(self.space)} x {self.space.dim} "
+                             f"sparse rows; use the 'lsh' backend for sparse rows of this size")
+        self._index = hnswlib.Index(space='cosine' if metric == 'cosine' else 'ip', dim=self.space.dim)
+        self._index.init_index(max_elements=len(self.space), ef_construction=ef_construction, M=m,
+                               random_seed=seed)
+        block = max(1, (64 << 20) // (8 * max(self.space.dim, 1)))
+        for start in range(0, len(self.space), block):
+            rows = data[start:start + block]
+            self._index.add_items(rows.toarray() if sparse.issparse(rows) else rows,
+                                  np.arange(start, start + rows.shape[0]))
+        self.ef = ef
+
+    @property
+    def metric(self):
+        return self.space.metric
+
+    def __len__(self):
+        return len(self.space)
+
+    @property
+    def ef(self):
+        return self._ef
+
+    @ef.setter
+    def ef(self, value):
+        self._ef = value
+        self._index.set_ef(value)
+
+    def query(self, queries, k=10, exclude=None):
+        queries = _as_vectors(queries)
+        dense = queries.toarray() if sparse.issparse(queries) else queries
+        extra = 0 if exclude is None else 1
+        n = min(k + extra, len(self))
+        self._index.set_ef(max(self.ef, n))
+        labels, _ = self._index.knn_query(dense, k=n)
+        self._index.set_ef(self.ef)
+        query_stats = self.space.statistics(queries)
+        results = []
+        for row, candidates in enumerate(labels.astype(np.int64)):
+            if exclude is not None:
+                candidates = candidates[candidates != exclude[row]][:k]
+            scores = self.space.scores(queries[row:row + 1], candidates,
+                                       query_stats=(query_stats[0][row:row + 1], query_stats[1][row:row + 1]))[0]
+            best = top_k_indices(scores, k)
+            results.append((candidates[best], scores[best]))
+        return _collect(results, k, queries.shape[0])
+
+    def query_rows(self, positions, k=10):
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.query(self.space.rows(positions), k, exclude=positions)
+
+
+BACKENDS = {
+    'brute': BruteForceIndex,
+    'lsh': RandomProjectionIndex,
+    'hnsw': HNSWIndex,
+}
+
+
+def register_backend(name, factory):
+    """
+    Makes another index class available to build_index. factory(vectors, metric=..., **options) must return
+    an object with query(queries, k, exclude=None) and query_rows(positions, k).
+    """
+    BACKENDS[name] = factory
+
+
+def build_index(vectors, backend='lsh', metric='cosine', **options):
+    """
+    Builds a nearest-neighbour index over the rows of vectors with the named backend. vectors may be a dense
+    array, a sparse matrix, a RatingMatrix (its user rows) or a VectorSet.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ANN backend '{backend}', expected one of {tuple(BACKENDS)}")
+    if hasattr(vectors, 'csr'):
+        vectors = vectors.csr
+    return BACKENDS[backend](vectors, metric=metric, **options)
+
+
+def recall_at_k(approximate, exact):
+    """
+    Mean fraction of the exact neighbours found by an approximate search, both given as index arrays from query.
+    """
+    hits = [len(np.intersect1d(a[a >= 0], e[e >= 0])) / max((e >= 0).sum(), 1) for a, e in zip(approximate, exact)]
+    return float(np.mean(hits)) if hits else 1.0
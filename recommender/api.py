@@ -0,0 +1,464 @@
+import math
+import os
+import threading
+
+DATA_DIR_ENV = 'RECOMMENDER_DATA_DIR'
+DEFAULT_DATA_DIR = 'ml-latest-small'
+
+
+class Recommender:
+    """
+    The recommendation entry points of the assignments behind one object that loads its data on first use.
+
+    Creating a Recommender reads nothing: the rating matrix, the neighbour index, the caches and the movie
+    metadata are built the first time a method needs them, once, even when several threads ask at the same
+    time. The modules those paths need are imported at the same moment, so sklearn, for example, is only
+    imported once a sequential recommendation is requested. item_k is the number of neighbours kept per movie
+    by the item-based model and half_life_days how fast ratings fade in the time-aware recommendations.
+    neighbour_backend names an approximate nearest-neighbour index of the ann module (normally 'lsh') that finds
+    similar users for the neighbour lists and the sequential recommendations instead of a brute-force search,
+    built with neighbour_backend_options (for 'lsh' on rating rows, many short hashes such as num_tables=32,
+    num_bits=6, probes=4 keep the recall near 1).
+    data_dir defaults to RECOMMENDER_DATA_DIR, then to ml-latest-small in the working directory.
+    """
+
+    def __init__(self, data_dir=None, cache_dir=None, k=10, metric='pearson', cache_size=4096,
+                 item_k=50, half_life_days=180, neighbour_backend=None, neighbour_backend_options=None):
+        self.data_dir = data_dir or os.environ.get(DATA_DIR_ENV) or DEFAULT_DATA_DIR
+        self.cache_dir = cache_dir
+        self.k = k
+        self.metric = metric
+        self.cache_size = cache_size
+        self.item_k = item_k
+        self.half_life_days = half_life_days
+        self.neighbour_backend = neighbour_backend
+        self.neighbour_backend_options = neighbour_backend_options
+        self.snapshot_root = None
+        self._lock = threading.RLock()
+        self._loaded = {}
+
+    def __repr__(self):
+        return f"Recommender(data_dir={self.data_dir!r}, loaded={sorted(self._loaded)})"
+
+    def _lazy(self, name, build):
+        # Double-checked, so loaded attributes are read without taking the lock. A snapshot swap replaces the
+        # whole dictionary under the lock, so a build never lands next to attributes of another snapshot.
+        try:
+            return self._loaded[name]
+        except KeyError:
+            pass
+        with self._lock:
+            loaded = self._loaded
+            if name not in loaded:
+                loaded[name] = build()
+            return loaded[name]
+
+    @classmethod
+    def from_snapshot(cls, root, **options):
+        """
+        Recommender serving the snapshot published in root (see snapshot.write_snapshot). The rating matrix,
+        neighbour lists, movie metadata and item similarity model are memory-mapped from the snapshot instead
+        of being loaded and computed, and refresh_snapshot() switches to a newer published snapshot.
+        """
+        from .snapshot import Snapshot, current_snapshot
+
+        path = current_snapshot(root)
+        if path is None:
+            raise ValueError(f"No snapshot has been published in {root}")
+        snapshot = Snapshot(path)
+        neighbours = snapshot.manifest['neighbours']
+        options.setdefault('data_dir', snapshot.manifest.get('data_dir'))
+        options.setdefault('k', neighbours['k'])
+        options.setdefault('metric', neighbours['metric'])
+        recommender = cls(**options)
+        recommender.snapshot_root = root
+        recommender._loaded = snapshot.load()
+        return recommender
+
+    @property
+    def snapshot(self):
+        """
+        The Snapshot being served, or None when the data was loaded from data_dir.
+        """
+        return self._loaded.get('snapshot')
+
+    def refresh_snapshot(self):
+        """
+        Switches to the snapshot currently published in snapshot_root if it is a different one. The caches
+        built from the old snapshot are dropped with it. Returns whether the snapshot changed.
+        """
+        from .snapshot import Snapshot, current_snapshot
+
+        if self.snapshot_root is None:
+            return False
+        path = current_snapshot(self.snapshot_root)
+        current = self.snapshot
+        if path is None or (current is not None and os.path.abspath(path) == current.path):
+            return False
+        loaded = Snapshot(path).load()
+        with self._lock:
+            self._loaded = loaded
+        return True
+
+    def write_snapshot(self, root, item_model=False, keep=3):
+        """
+        Publishes the data this Recommender serves from as a new snapshot in root, see snapshot.write_snapshot.
+        """
+        from .snapshot import write_snapshot
+        return write_snapshot(self, root, item_model=item_model, keep=keep)
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def warm_up(self):
+        """
+        Loads everything the recommendation methods need up front, e.g. before a service accepts requests.
+        """
+        for name in ('matrix', 'neighbour_index', 'cache', 'disagreement', 'movies_data', 'group_cache'):
+            getattr(self, name)
+        # sklearn, for the sequential recommendations
+        from . import sequential  # noqa: F401
+        return sorted(self._loaded)
+
+    @property
+    def matrix(self):
+        """
+        RatingMatrix of all ratings, built from the memory-mapped binary cache of ratings.csv.
+        """
+        def build():
+            from .data import load_rating_matrix
+            return load_rating_matrix(self.data_dir, self.cache_dir)
+        return self._lazy('matrix', build)
+
+    @property
+    def ratings(self):
+        def build():
+            from .data import load_ratings
+            return load_ratings(self.data_dir, self.cache_dir)
+        return self._lazy('ratings', build)
+
+    @property
+    def movies(self):
+        def build():
+            from .data import load_movies
+            return load_movies(self.data_dir, self.cache_dir)
+        return self._lazy('movies', build)
+
+    @property
+    def movies_data(self):
+        """
+        Movie id -> {'title', 'genres'} dictionary used by the explanations.
+        """
+        def build():
+            from .data import build_movies_data
+            return build_movies_data(self.movies)
+        return self._lazy('movies_data', build)
+
+    @property
+    def neighbour_index(self):
+        def build():
+            from .neighbours import NeighbourIndex
+            return NeighbourIndex(self.matrix, k=self.k, metric=self.metric, backend=self.neighbour_backend,
+                                  backend_options=self.neighbour_backend_options)
+        return self._lazy('neighbour_index', build)
+
+    @property
+    def cache(self):
+        """
+        RecommendationCache of neighbour lists, predictions and group scores.
+        """
+        def build():
+            from .cache import RecommendationCache
+            return RecommendationCache(self.neighbour_index, maxsize=self.cache_size)
+        return self._lazy('cache', build)
+
+    @property
+    def disagreement(self):
+        def build():
+            from .disagreement import GroupDisagreement
+            return GroupDisagreement(self.matrix)
+        return self._lazy('disagreement', build)
+
+    @property
+    def group_cache(self):
+        """
+        LRUCache of the group matrices and ranked sequences of recently requested groups.
+        """
+        def build():
+            from .cache import LRUCache
+            return LRUCache(maxsize=256)
+        return self._lazy('group_cache', build)
+
+    @property
+    def item_model(self):
+        """
+        ItemSimilarityModel of the ratings, loaded from the cache directory when it was built for the current
+        ratings.csv, else built once and saved there. The movies a user rated are read from the live matrix.
+        """
+        return self._lazy('item_model', self.build_item_model)
+
+    def item_model_path(self):
+        from .data import default_cache_dir, file_hash
+        cache_dir = self.cache_dir or default_cache_dir(self.data_dir)
+        source = file_hash(os.path.join(self.data_dir, 'ratings.csv'), cache_dir)[:16]
+        return os.path.join(cache_dir, f'item-similarity-{source}-k{self.item_k}.npz')
+
+    def build_item_model(self, rebuild=False):
+        """
+        Loads the item similarity model, or fits and saves it when it is missing or rebuild is set, e.g. from
+        a nightly job. The model of a running Recommender is replaced as well.
+        """
+        from .items import ItemSimilarityModel
+
+        path = self.item_model_path()
+        if os.path.exists(path) and not rebuild:
+            model = ItemSimilarityModel.load(path)
+        else:
+            model = ItemSimilarityModel(k=self.item_k).fit(self.matrix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written next to the target first, so readers never load a partial file
+            partial = f'{path[:-4]}.{os.getpid()}.partial.npz'
+            model.save(partial)
+            os.replace(partial, path)
+        with self._lock:
+            if 'item_model' in self._loaded:
+                self._loaded['item_model'] = model
+        return model
+
+    @property
+    def content_index(self):
+        """
+        ContentIndex of the genres and tags of the movies, for cold start and candidate generation.
+        """
+        def build():
+            from .content import build_content_index
+            return build_content_index(self.data_dir, self.cache_dir)
+        return self._lazy('content_index', build)
+
+    @property
+    def incremental(self):
+        """
+        IncrementalRecommender over the neighbour index, with the decayed statistics of the timestamped ratings.
+        """
+        def build():
+            from .data import load_columns
+            from .incremental import DAY, IncrementalRecommender
+
+            if self.snapshot is not None:
+                raise ValueError("A snapshot is read-only; publish a new snapshot with the new ratings instead")
+            columns = load_columns('ratings', self.data_dir, self.cache_dir)
+            return IncrementalRecommender(self.neighbour_index, columns['userId'], columns['movieId'],
+                                          columns['rating'], columns['timestamp'],
+                                          half_life=self.half_life_days * DAY)
+        return self._lazy('incremental', build)
+
+    def add_ratings(self, user_ids, movie_ids, ratings, timestamps=None):
+        """
+        Applies new rating events in place, stamped now unless timestamps are given, see
+        IncrementalRecommender.consume. Every recommendation method sees them from then on without a rebuild:
+        cached neighbours and predictions are recomputed for the changed users and for every user whose
+        neighbour list they entered or left, and so are the disagreement pairs and group matrices. The item
+        similarities themselves stay as fitted until build_item_model(rebuild=True).
+        Returns the ids of the users whose ratings changed.
+        """
+        import time
+
+        if timestamps is None:
+            timestamps = [int(time.time())] * len(ratings)
+        with self._lock:
+            changed = self.incremental.consume(user_ids, movie_ids, ratings, timestamps)
+            if changed and 'disagreement' in self._loaded:
+                self._loaded['disagreement'].invalidate(changed)
+            if changed and 'group_cache' in self._loaded:
+                self._loaded['group_cache'].clear()
+        return changed
+
+    def recommend_movies_recent(self, user_id, n=10, num_users=5):
+        """
+        [(movie_id, predicted_rating)] for the movies user_id has not rated, best first, from the num_users
+        most similar users with recent ratings counting more, see IncrementalRecommender.scores.
+        """
+        return self.incremental.recommend(user_id, n, num_users)
+
+    def group_matrix(self, user_group):
+        """
+        Matrix of the group members' ratings over the movies at least one of them rated, which is what the
+        sequential recommendations work on. Cached per group.
+        """
+        user_ids = tuple(sorted(set(user_group)))
+        return self.group_cache.get_or_compute(('matrix', user_ids),
+                                               lambda: self.matrix.subset(user_ids, drop_unrated=True))
+
+    def pearson_similarity(self, user1, user2):
+        return self.neighbour_index.engine.similarity(user1, user2, metric='pearson')
+
+    def cosine_similarity(self, user1, user2):
+        return self.neighbour_index.engine.similarity(user1, user2, metric='cosine')
+
+    def find_similar_users(self, user_id, num_users=5):
+        """
+        [(user_id, similarity)] of the num_users most similar users.
+        """
+        return self.cache.neighbours(user_id, num_users)
+
+    def recommend_movies(self, user_id, num_users=5, similar_users=None):
+        """
+        [(movie_id, predicted_rating)] for the movies user_id has not rated, best first, predicted from the
+        num_users most similar users or from the given [(user_id, similarity)] list.
+        """
+        if similar_users is None:
+            return self.cache.predictions(user_id, num_users)
+        from .scoring import recommend_movies
+        return recommend_movies(self.neighbour_index, user_id, similar_users=similar_users)
+
+    def recommend_movies_item_based(self, user_id, n=10):
+        """
+        [(movie_id, predicted_rating)] for the movies user_id has not rated, best first, predicted from the
+        precomputed item-item similarities instead of similar users.
+        """
+        return self.item_model.recommend(user_id, n, matrix=self.matrix)
+
+    def recommend_movies_by_content(self, user_id=None, n=10, genres=(), tags=()):
+        """
+        [(movie_id, score)] of the movies best matching the given genres and tags, or else the genres and
+        tags of the movies user_id rated. Needs no ratings for the genres and tags, so it serves new users;
+        movies nobody has rated are found through their genres and tags.
+        """
+        from .content import GENRE_PREFIX, TAG_PREFIX
+
+        if genres or tags:
+            terms = [GENRE_PREFIX + genre for genre in genres] + [TAG_PREFIX + tag.strip().lower() for tag in tags]
+            exclude = () if user_id is None or not self.matrix.has_user(user_id) else \
+                self.matrix.movie_ids[self.matrix.rated_movie_positions(user_id)].tolist()
+            return self.content_index.query(self.content_index.term_profile(terms), n, exclude=exclude)
+        if user_id is None:
+            raise ValueError("Give a user_id, genres or tags")
+        return self.content_index.recommend_for_user(self.matrix, user_id, n)
+
+    def similar_movies_by_content(self, movie_id, n=10):
+        return self.content_index.similar_movies(movie_id, n)
+
+    def recommend_movies_hybrid(self, user_id, n=10, num_candidates=200):
+        """
+        [(movie_id, predicted_rating)] for user_id from the num_candidates unrated movies matching the user's
+        genres and tags, scored by the item similarity model. Only the candidates are scored, so the cost does
+        not grow with the catalogue. Candidates the model has no prediction for, such as movies without
+        ratings, follow the predicted ones in content order with the user's mean rating.
+        """
+        candidates = self.content_index.candidates(self.matrix, user_id, num_candidates)
+        predicted = self.item_model.score_candidates(user_id, candidates, matrix=self.matrix)
+        scored = sorted((-rating, rank) for rank, rating in enumerate(predicted.tolist()) if not math.isnan(rating))
+        ranked = [(candidates[rank], -rating) for rating, rank in scored[:n]]
+        if len(ranked) < n:
+            mean_rating = float(self.matrix.row_slice(self.matrix.user_index(user_id))[1].mean())
+            ranked += [(movie_id, mean_rating) for movie_id, rating in zip(candidates, predicted.tolist())
+                       if math.isnan(rating)][:n - len(ranked)]
+        return ranked
+
+    def get_recommendations_for_user(self, user_id, num_similar_users=10, num_recommended_movies=10):
+        """
+        Ids of the similar users and of the recommended movies of user_id.
+        """
+        similar_users = [other for other, _ in self.find_similar_users(user_id, num_similar_users)]
+        movies = [movie_id for movie_id, _ in self.recommend_movies(user_id)[:num_recommended_movies]]
+        return similar_users, movies
+
+    def recommend_movies_batch(self, user_ids, k=5, top_n=10, workers=1):
+        """
+        {user_id: [(movie_id, predicted_rating)]} for many users, scored together.
+        """
+        from .scoring import recommend_movies_batch
+        return recommend_movies_batch(self.neighbour_index, user_ids, k=k, top_n=top_n, workers=workers)
+
+    def group_scores(self, user_ids):
+        return self.cache.group_scores(user_ids)
+
+    def group_recommendations(self, user_ids, strategy='average', n=10, disagreement=False, **options):
+        """
+        Top-n movie ids for a group under an aggregation strategy, given by name (see aggregation.STRATEGIES)
+        or as a function of the (members x movies) score array. With disagreement, the scores are first scaled
+        down by the mean pairwise disagreement of the members.
+        """
+        if not disagreement and not callable(strategy):
+            return self.cache.group_recommendations(user_ids, strategy, n, **options)
+        return self._recommend_for_group(self.group_scores(user_ids), strategy, n, disagreement, options)
+
+    def group_recommendations_batch(self, requests):
+        """
+        group_recommendations for a list of (user_ids, strategy, n, disagreement) requests, scoring the
+        members of all the groups together. Returns one list of movie ids per request.
+        """
+        from .aggregation import GroupScores
+
+        groups = [tuple(user_ids) for user_ids, _, _, _ in requests]
+        distinct = list(dict.fromkeys(groups))
+        scores = dict(zip(distinct, GroupScores.from_engine_many(self.neighbour_index, distinct)))
+        return [self._recommend_for_group(scores[group], strategy, n, disagreement, {})
+                for group, (_, strategy, n, disagreement) in zip(groups, requests)]
+
+    def _recommend_for_group(self, scores, strategy, n, disagreement, options):
+        from .aggregation import aggregate, average
+
+        values = scores.scores
+        if disagreement:
+            mean_disagreement = self.disagreement.mean_disagreement(scores.user_ids)
+            # nan when no two members co-rated a movie
+            if not math.isnan(mean_disagreement):
+                # Not in place, the cached group scores are shared
+                values = values * (1 - mean_disagreement)
+        # Like GroupScores.recommend, named strategies other than the average are tie-broken by the average
+        tie_break = None if callable(strategy) or strategy == 'average' else average(values)
+        return scores.top_movies(aggregate(values, strategy, **options), n, tie_break)
+
+    def sequential_recommendations(self, user_group, top_n=10, num_sequences=3, seed=None):
+        """
+        Diversified sequences of group recommendations (assignment 3).
+        """
+        from .sequential import SequentialRecommender
+        recommender = SequentialRecommender(self.group_matrix(user_group), metric='cosine', seed=seed,
+                                            backend=self.neighbour_backend,
+                                            backend_options=self.neighbour_backend_options)
+        return recommender.diversified_sequences(list(user_group), top_n=top_n, num_sequences=num_sequences)
+
+    def sequential_recommendations_with_info(self, user_group, top_n=10, num_sequences=3):
+        """
+        Ranked sequences of group recommendations and the information the explanations need (assignment 4).
+        Nothing in them is random, so they are cached per group; the returned objects are shared.
+        """
+        def compute():
+            from .sequential import SequentialRecommender
+            recommender = SequentialRecommender(self.group_matrix(user_group), metric='cosine',
+                                                backend=self.neighbour_backend,
+                                                backend_options=self.neighbour_backend_options)
+            return recommender.ranked_sequences(list(user_group), top_n=top_n, num_sequences=num_sequences)
+        return self.group_cache.get_or_compute(('ranked', tuple(user_group), top_n, num_sequences), compute)
+
+    def group_session(self, user_group, top_n=10):
+        """
+        GroupSession that produces the group's sequences one round at a time and takes feedback in between,
+        over the same group matrix as sequential_recommendations_with_info. Feedback ratings must lie within the
+        range of all ratings.
+        """
+        from .sequential import GroupSession
+
+        data = self.matrix.csr.data
+        return GroupSession(self.group_matrix(user_group), user_group, top_n=top_n,
+                            rating_range=(float(data.min()), float(data.max())))
+
+    def explain_atomic_case(self, movie_id, user_group, recommendation_info=None):
+        """
+        Why movie_id was or was not recommended to the group. recommendation_info is computed when not given.
+        """
+        from .explanations import explain_atomic_case
+        info = recommendation_info or self.sequential_recommendations_with_info(user_group)[1]
+        return explain_atomic_case(movie_id, info, self.group_matrix(user_group), self.movies_data)
+
+    def explain_group_case(self, genre, user_group, recommendation_info=None):
+        from .explanations import explain_group_case
+        info = recommendation_info or self.sequential_recommendations_with_info(user_group)[1]
+        return explain_group_case(genre, self.movies_data, info)
+
+    def explain_position_absenteeism(self, movie_id, user_group, recommendation_info=None):
+        from .explanations import explain_position_absenteeism
+        info = recommendation_info or self.sequential_recommendations_with_info(user_group)[1]
+        return explain_position_absenteeism(movie_id, info, self.group_matrix(user_group), self.movies_data)
@@ -0,0 +1,309 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from . import instrumentation
+from .matrix import RatingMatrix
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded in-process cache. It keeps at most maxsize entries and evicts the least recently used one first.
+    With ttl (seconds) set, entries older than ttl count as misses and are dropped.
+
+    With a directory, the cache writes every entry through to a pickle file there as well. A memory miss
+    falls back to the file, so entries survive restarts and can be shared between processes. Files are
+    written to a temporary name and renamed into place. hits, misses, disk_hits, evictions and expirations
+    count what happened; stats() reports them with the hit rate.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, directory=None, clock=time.monotonic):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got {maxsize}")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = self.evictions = self.expirations = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self._expired(stored_at, self.clock()):
+                    self._entries.move_to_end(key)
+                    self.hits += count
+                    return value
+                del self._entries[key]
+                self.expirations += count
+        value = self._read_disk(key)
+        if value is not _MISSING:
+            with self._lock:
+                self.hits += count
+                self.disk_hits += count
+                self._store(key, value)
+            return value
+        with self._lock:
+            self.misses += count
+        return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        self._write_disk(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (self.clock(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        The cached value for key, or compute() stored under key on a miss.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        path = self._path(key)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _path(self, key):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.pkl')
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        if not path or not os.path.exists(path):
+            return _MISSING
+        try:
+            with open(path, 'rb') as f:
+                stored_key, stored_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        # Files outlive the process, so their age is measured in wall-clock time
+        if stored_key != key or self._expired(stored_at, time.time()):
+            return _MISSING
+        return value
+
+    def _write_disk(self, key, value):
+        path = self._path(key)
+        if not path:
+            return
+        fd, tmp = tempfile.mkstemp(prefix='.entry-', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+class RecommendationCache:
+    """
+    Caches neighbour lists, per-user predictions, group scores and aggregates in an LRUCache.
+
+    source is a SimilarityEngine or NeighbourIndex, or just a RatingMatrix (only cached() and movie_mean()
+    are available then). Each entry remembers the rating versions of the users it was computed from: the
+    user and their neighbours, and the versions of the NeighbourIndex lists it read, which change as well
+    when a change elsewhere moves a user into the list. An entry is discarded and recomputed once one of those
+    users' ratings or one of those lists have changed through NeighbourIndex.update, so no manual
+    invalidation is needed. Neighbours that are not read from a list (a SimilarityEngine source, or more
+    than the index's k of them) come from a query over every user, so those entries depend on every rating,
+    like whole-matrix values such as movie means.
+
+    Versions start over in every process, so give each ratings snapshot its own directory when the disk tier
+    is used.
+    """
+
+    def __init__(self, source, maxsize=4096, ttl=None, directory=None):
+        if isinstance(source, RatingMatrix) or not hasattr(source, 'top_k'):
+            self.engine = None
+            self.matrix = RatingMatrix.from_any(source)
+        else:
+            self.engine = source
+            self.matrix = source.matrix
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl, directory=directory)
+        self.stale = 0
+
+    def _versions(self, user_ids):
+        return tuple((user_id, self.matrix.user_version(user_id)) for user_id in user_ids)
+
+    def _list_versions(self, user_ids):
+        if not hasattr(self.engine, 'list_version'):
+            return ()
+        return tuple((user_id, self.engine.list_version(user_id)) for user_id in user_ids)
+
+    def _is_current(self, versions, list_versions, matrix_version):
+        if matrix_version is not None and matrix_version != self.matrix.version:
+            return False
+        return (all(self.matrix.user_version(user_id) == version for user_id, version in versions)
+                and all(self.engine.list_version(user_id) == version for user_id, version in list_versions))
+
+    def cached(self, kind, key, compute, depends_on=(), whole_matrix=False, lists=()):
+        """
+        Returns compute() cached under (kind, key). depends_on is the list of user ids the value is computed
+        from, or a function of the computed value that returns them, and lists the users whose neighbour lists
+        it read; whole_matrix=True makes any rating change invalidate the value.
+        """
+        full_key = (kind, key)
+        entry = self.cache.get(full_key)
+        if entry is not None:
+            versions, list_versions, matrix_version, value = entry
+            if self._is_current(versions, list_versions, matrix_version):
+                instrumentation.count(f'cache.{kind}.hits')
+                return value
+            self.stale += 1
+        instrumentation.count(f'cache.{kind}.misses')
+        # Read before computing, so a change meanwhile leaves the entry outdated rather than wrong
+        list_versions = self._list_versions(lists)
+        matrix_version = self.matrix.version if whole_matrix else None
+        value = compute()
+        users = depends_on(value) if callable(depends_on) else depends_on
+        self.cache.put(full_key, (self._versions(users), list_versions, matrix_version, value))
+        return value
+
+    def _reads_lists(self, k):
+        # Up to the indexed k, neighbours come from the precomputed lists; beyond it from a query over all users
+        return hasattr(self.engine, 'list_version') and k <= self.engine.k
+
+    def _require_engine(self):
+        if self.engine is None:
+            raise ValueError("This cache was built on a rating matrix; neighbour and prediction lookups need "
+                             "a SimilarityEngine or NeighbourIndex")
+
+    def neighbours(self, user_id, k=5):
+        """
+        The k most similar users as a list of (user_id, similarity), see SimilarityEngine.top_k. The
+        similarities of the k users are recomputed pair by pair (SimilarityEngine.exact_similarities), so the
+        predictions made from them tie exactly where the original implementation's did.
+        """
+        self._require_engine()
+
+        def compute():
+            similar = self.engine.top_k(user_id, k)
+            if not similar:
+                return similar
+            others = [other for other, _ in similar]
+            exact = zip(others, self.engine.exact_similarities(user_id, others).tolist())
+            # The original sorted every user by similarity, keeping user id order among equals
+            return sorted(exact, key=lambda pair: (-pair[1], pair[0]))
+
+        return self.cached('neighbours', (user_id, k), compute,
+                           depends_on=lambda similar: [user_id] + [other for other, _ in similar], lists=[user_id],
+                           whole_matrix=not self._reads_lists(k))
+
+    def predictions(self, user_id, k=5):
+        """
+        Every predicted rating for user_id from its k most similar users, as a list of (movie_id, rating)
+        sorted by descending prediction, see scoring.recommend_movies.
+        """
+        from .scoring import recommend_movies
+
+        similar = self.neighbours(user_id, k)
+        return self.cached('predictions', (user_id, k),
+                           lambda: recommend_movies(self.engine, user_id, k, similar_users=similar),
+                           depends_on=[user_id] + [other for other, _ in similar], lists=[user_id],
+                           whole_matrix=not self._reads_lists(k))
+
+    def _group_members(self, user_ids, k):
+        # A group's scores depend on its members and on every member's neighbours
+        members = set(user_ids)
+        for user_id in user_ids:
+            members.update(other for other, _ in self.neighbours(user_id, k))
+        return sorted(members)
+
+    def group_scores(self, user_ids, k=5):
+        """
+        GroupScores of the group's members (see aggregation.GroupScores.from_engine). The returned score
+        array is shared by every caller and therefore read-only.
+        """
+        from .aggregation import GroupScores
+
+        user_ids = tuple(user_ids)
+
+        def compute():
+            scores = GroupScores.from_engine(self.engine, user_ids, k)
+            scores.scores.flags.writeable = False
+            return scores
+
+        return self.cached('group_scores', (user_ids, k), compute, depends_on=self._group_members(user_ids, k),
+                           lists=user_ids, whole_matrix=not self._reads_lists(k))
+
+    def group_recommendations(self, user_ids, strategy='average', n=10, k=5, **options):
+        """
+        Top-n movie ids for the group under an aggregation strategy, see GroupScores.recommend.
+        """
+        user_ids = tuple(user_ids)
+        key = (user_ids, k, strategy, n, tuple(sorted(options.items())))
+        return self.cached('group_recommendations', key,
+                           lambda: self.group_scores(user_ids, k).recommend(strategy, n, **options),
+                           depends_on=self._group_members(user_ids, k), lists=user_ids,
+                           whole_matrix=not self._reads_lists(k))
+
+    def movie_mean(self, movie_id, fill_missing=None):
+        """
+        RatingMatrix.movie_mean, cached until any rating changes.
+        """
+        return self.cached('movie_mean', (movie_id, fill_missing),
+                           lambda: self.matrix.movie_mean(movie_id, fill_missing), whole_matrix=True)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['stale'] = self.stale
+        return stats
@@ -0,0 +1,199 @@
+"""
+Content-based movie index over the genres of movies.csv and the tags of tags.csv.
+
+Every genre and every (lower-cased) tag is a term, 'genre:Comedy' or 'tag:dark comedy'. Movies are rows of a
+sparse TF-IDF matrix over the terms, with sublinear term frequencies (a tag given by several users counts
+1 + log(count)), smoothed inverse document frequencies and L2 normalised rows, so the dot product of two rows
+is their cosine similarity. The transpose, terms x movies in CSR layout, is the inverted index: a query only
+reads the posting lists of its own terms, so its cost depends on how many movies share those terms and not
+on the size of the catalogue.
+
+Queries need no ratings, which is what makes the index useful for cold start: a movie nobody has rated yet
+is found through its genres and tags, and a new user can be served from a few liked movies or chosen
+genres. For users with ratings it generates candidates, so the CF scorers only score a few hundred movies.
+"""
+import numpy as np
+from scipy import sparse
+
+from .similarity import top_k_indices
+
+GENRE_PREFIX = 'genre:'
+TAG_PREFIX = 'tag:'
+NO_GENRES = '(no genres listed)'
+
+
+class ContentIndex:
+    """
+    TF-IDF matrix and inverted index over movie genres and tags, see the module docstring. Build it with
+    from_frames; genre_weight and tag_weight scale the two kinds of terms before the rows are normalised, and
+    tags used on fewer than min_tag_movies movies are left out.
+    """
+
+    def __init__(self, movie_ids, terms, counts, genre_weight=1.0, tag_weight=1.0):
+        self.movie_ids = np.asarray(movie_ids)
+        self.terms = np.asarray(terms, dtype=object)
+        self._movie_index = {movie_id: position for position, movie_id in enumerate(self.movie_ids.tolist())}
+        self._term_index = {term: position for position, term in enumerate(self.terms.tolist())}
+
+        counts = sparse.csr_matrix(counts, dtype=np.float64)
+        counts.sum_duplicates()
+        num_movies = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=len(self.terms))
+        self.idf = np.log((1 + num_movies) / (1 + document_frequency)) + 1
+        is_genre = np.array([term.startswith(GENRE_PREFIX) for term in self.terms.tolist()], dtype=bool)
+        self.idf *= np.where(is_genre, genre_weight, tag_weight)
+
+        tfidf = counts.copy()
+        tfidf.data = (1 + np.log(tfidf.data)) * self.idf[tfidf.indices]
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        tfidf.data /= np.repeat(np.where(norms > 0, norms, 1), np.diff(tfidf.indptr))
+        self.matrix = tfidf.astype(np.float32)
+        self.inverted = self.matrix.T.tocsr()
+
+    @classmethod
+    def from_frames(cls, movies, tags=None, min_tag_movies=1, genre_weight=1.0, tag_weight=1.0):
+        """
+        Builds the index from the movies table (movieId, genres) and optionally the tags table (userId,
+        movieId, tag), as DataFrames or dicts of columns such as data.load_columns returns. A tag repeated by
+        the same user for the same movie counts once; tags of movies missing from movies are ignored.
+        """
+        import pandas as pd
+
+        movie_ids = np.asarray(movies['movieId'])
+        positions = pd.Series(np.arange(len(movie_ids)), index=movie_ids)
+
+        genres = pd.Series(np.asarray(movies['genres'], dtype=object), index=np.arange(len(movie_ids)))
+        genres = genres.astype(str).str.split('|').explode()
+        genres = genres[(genres != NO_GENRES) & (genres != '')]
+        rows, names = [genres.index.to_numpy(dtype=np.int64)], [GENRE_PREFIX + genres.to_numpy(dtype=object)]
+
+        if tags is not None and len(tags['movieId']):
+            frame = pd.DataFrame({
+                'userId': np.asarray(tags['userId']),
+                'movieId': np.asarray(tags['movieId']),
+                'tag': pd.Series(np.asarray(tags['tag'], dtype=object)).astype(str).str.strip().str.lower(),
+            })
+            frame = frame[(frame['tag'] != '') & frame['movieId'].isin(positions.index)].drop_duplicates()
+            if min_tag_movies > 1:
+                movies_per_tag = frame.groupby('tag')['movieId'].nunique()
+                frame = frame[frame['tag'].isin(movies_per_tag.index[movies_per_tag >= min_tag_movies])]
+            rows.append(positions.loc[frame['movieId'].to_numpy()].to_numpy(dtype=np.int64))
+            names.append(TAG_PREFIX + frame['tag'].to_numpy(dtype=object))
+
+        rows, names = np.concatenate(rows), np.concatenate(names)
+        terms, columns = np.unique(names.astype(str), return_inverse=True)
+        counts = sparse.coo_matrix((np.ones(len(rows)), (rows, columns.ravel())), shape=(len(movie_ids), len(terms)))
+        return cls(movie_ids, terms.astype(object), counts, genre_weight=genre_weight, tag_weight=tag_weight)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def has_movie(self, movie_id):
+        return movie_id in self._movie_index
+
+    def terms_of(self, movie_id):
+        """
+        [(term, weight)] of a movie, highest weight first.
+        """
+        row = self.matrix[self._movie_index[movie_id]]
+        order = np.argsort(-row.data, kind='stable')
+        return list(zip(self.terms[row.indices[order]].tolist(), row.data[order].astype(np.float64).tolist()))
+
+    def movies_with(self, term):
+        """
+        Ids of the movies that have term, read from its posting list; empty for unknown terms.
+        """
+        position = self._term_index.get(term)
+        if position is None:
+            return []
+        start, end = self.inverted.indptr[position], self.inverted.indptr[position + 1]
+        return self.movie_ids[self.inverted.indices[start:end]].tolist()
+
+    def profile(self, movie_ids, weights=None):
+        """
+        Sparse (1 x terms) profile of several movies: the weighted sum of their rows, L2 normalised. Movies
+        missing from the index are ignored.
+        """
+        movie_ids = list(movie_ids)
+        weights = np.ones(len(movie_ids)) if weights is None else np.asarray(weights, dtype=np.float64)
+        known = [(self._movie_index[movie_id], weight) for movie_id, weight in zip(movie_ids, weights)
+                 if movie_id in self._movie_index]
+        if not known:
+            return sparse.csr_matrix((1, len(self.terms)), dtype=np.float64)
+        positions, values = map(np.array, zip(*known))
+        profile = sparse.csr_matrix(values.reshape(1, -1)) @ self.matrix[positions]
+        norm = np.sqrt(profile.multiply(profile).sum())
+        return profile / norm if norm > 0 else profile
+
+    def term_profile(self, terms):
+        """
+        Profile of a list of terms such as 'genre:Comedy' or 'tag:pixar', e.g. chosen by a new user; unknown
+        terms are ignored.
+        """
+        columns = sorted({self._term_index[term] for term in terms if term in self._term_index})
+        values = self.idf[columns] if columns else np.empty(0)
+        norm = np.sqrt(np.sum(values ** 2))
+        return sparse.csr_matrix((values / norm if norm > 0 else values, columns, [0, len(columns)]),
+                                 shape=(1, len(self.terms)))
+
+    def query(self, profile, n=10, exclude=()):
+        """
+        [(movie_id, score)] of the n movies scoring highest against a profile, best first, leaving out the
+        movie ids in exclude. Only movies sharing a term with the profile are scored, and only movies with a
+        positive score are returned.
+        """
+        profile = sparse.csr_matrix(profile)
+        scores = (profile @ self.inverted).tocsr()
+        positions, values = scores.indices, scores.data.astype(np.float64)
+        excluded = [self._movie_index[movie_id] for movie_id in exclude if movie_id in self._movie_index]
+        if excluded:
+            keep = ~np.isin(positions, excluded)
+            positions, values = positions[keep], values[keep]
+        keep = values > 0
+        positions, values = positions[keep], values[keep]
+        # Ties by movie position, as elsewhere
+        order = np.argsort(positions, kind='stable')
+        positions, values = positions[order], values[order]
+        best = top_k_indices(values, n)
+        return list(zip(self.movie_ids[positions[best]].tolist(), values[best].tolist()))
+
+    def similar_movies(self, movie_id, n=10):
+        """
+        [(movie_id, cosine similarity)] of the n movies whose genres and tags are most like movie_id's.
+        """
+        return self.query(self.matrix[self._movie_index[movie_id]], n, exclude=(movie_id,))
+
+    def user_profile(self, matrix, user_id):
+        """
+        Profile of a user from their ratings in a RatingMatrix: the movies weighted by how far the rating is
+        above or below the user's mean rating, or all weighted equally when every rating is the same.
+        """
+        columns, ratings = matrix.row_slice(matrix.user_index(user_id))
+        weights = ratings.astype(np.float64) - ratings.mean() if len(ratings) else np.empty(0)
+        if not np.any(weights):
+            weights = np.ones(len(ratings))
+        return self.profile(matrix.movie_ids[columns].tolist(), weights)
+
+    def recommend_for_user(self, matrix, user_id, n=10, exclude_rated=True):
+        """
+        [(movie_id, score)] of the n movies best matching the user's profile, unrated ones only by default.
+        """
+        exclude = matrix.movie_ids[matrix.rated_movie_positions(user_id)].tolist() if exclude_rated else ()
+        return self.query(self.user_profile(matrix, user_id), n, exclude=exclude)
+
+    def candidates(self, matrix, user_id, n=200):
+        """
+        Ids of up to n unrated movies matching the user's profile, as candidates for a CF scorer.
+        """
+        return [movie_id for movie_id, _ in self.recommend_for_user(matrix, user_id, n)]
+
+
+def build_content_index(data_dir='ml-latest-small', cache_dir=None, **options):
+    """
+    ContentIndex of the movies and tags of data_dir, read from the binary cache.
+    """
+    from .data import load_columns
+
+    return ContentIndex.from_frames(load_columns('movies', data_dir, cache_dir),
+                                    load_columns('tags', data_dir, cache_dir), **options)
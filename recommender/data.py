@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .matrix import RatingMatrix
+
+# Column types of the MovieLens CSV files. 'str' columns are stored as one UTF-8 buffer plus offsets and
+# 'category' columns as integer codes plus their categories, so every column is a flat, mmap-able array.
+SCHEMAS = {
+    'ratings': {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32, 'timestamp': np.int64},
+    'movies': {'movieId': np.int32, 'title': 'str', 'genres': 'category'},
+    'tags': {'userId': np.int32, 'movieId': np.int32, 'tag': 'str', 'timestamp': np.int64},
+    'links': {'movieId': np.int32, 'imdbId': np.int64, 'tmdbId': np.float64},
+}
+
+CACHE_DIR_ENV = 'RECOMMENDER_CACHE_DIR'
+_HASH_CHUNK = 1 << 20
+
+
+def default_cache_dir(data_dir):
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(data_dir, '.cache')
+
+
+def file_hash(path, cache_dir=None):
+    """
+    SHA-1 of a file's contents. The hash is remembered next to the cache together with the file's size and
+    modification time, so an unchanged file is only read once.
+    """
+    stat = os.stat(path)
+    manifest_path = os.path.join(cache_dir, os.path.basename(path) + '.hash.json') if cache_dir else None
+    if manifest_path and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['size'] == stat.st_size and manifest['mtime_ns'] == stat.st_mtime_ns:
+            return manifest['sha1']
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK), b''):
+            sha1.update(block)
+    digest = sha1.hexdigest()
+    if manifest_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest}, f)
+    return digest
+
+
+def _encode_strings(values):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(buffer, offsets):
+    raw = bytes(buffer)
+    return np.array([raw[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+
+def _write_cache(frame, schema, directory):
+    columns = {}
+    for column, kind in schema.items():
+        values = frame[column]
+        if kind == 'str':
+            buffer, offsets = _encode_strings(values.astype(str).tolist())
+            np.save(os.path.join(directory, f'{column}.buffer.npy'), buffer)
+            np.save(os.path.join(directory, f'{column}.offsets.npy'), offsets)
+        elif kind == 'category':
+            categorical = pd.Categorical(values.astype(str))
+            codes_dtype = np.int16 if len(categorical.categories) < np.iinfo(np.int16).max else np.int32
+            np.save(os.path.join(directory, f'{column}.codes.npy'), categorical.codes.astype(codes_dtype))
+            buffer, offsets = _encode_strings(categorical.categories.tolist())
+            np.save(os.path.join(directory, f'{column}.buffer.npy'), buffer)
+            np.save(os.path.join(directory, f'{column}.offsets.npy'), offsets)
+        else:
+            np.save(os.path.join(directory, f'{column}.npy'), values.to_numpy(dtype=kind))
+        columns[column] = kind if isinstance(kind, str) else np.dtype(kind).name
+    with open(os.path.join(directory, 'columns.json'), 'w') as f:
+        json.dump({'columns': columns, 'rows': len(frame)}, f)
+
+
+def _cache_path(name, data_dir, cache_dir):
+    source = os.path.join(data_dir, f'{name}.csv')
+    cache_dir = cache_dir or default_cache_dir(data_dir)
+    return source, cache_dir, os.path.join(cache_dir, f'{name}-{file_hash(source, cache_dir)[:16]}')
+
+
+def build_cache(name, data_dir='ml-latest-small', cache_dir=None):
+    """
+    Converts data_dir/<name>.csv into the binary cache (one .npy file per column) unless a cache for the
+    current contents of the file already exists, and returns the cache directory. Caches of older versions
+    of the file are removed. The cache is written to a temporary directory and renamed into place, so a
+    concurrent reader never sees a half-written cache.
+    """
+    source, cache_dir, path = _cache_path(name, data_dir, cache_dir)
+    if os.path.exists(os.path.join(path, 'columns.json')):
+        return path
+    schema = SCHEMAS[name]
+    dtypes = {column: kind for column, kind in schema.items() if kind not in ('str', 'category')}
+    frame = pd.read_csv(source, dtype={**dtypes, **{c: str for c, k in schema.items() if k in ('str', 'category')}},
+                        keep_default_na=False, na_values={c: [''] for c in dtypes})
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f'.{name}-', dir=cache_dir)
+    try:
+        _write_cache(frame, schema, tmp)
+        os.replace(tmp, path)
+    except OSError:
+        # Another process published the same cache first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(os.path.join(path, 'columns.json')):
+            raise
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(f'{name}-') and os.path.join(cache_dir, entry) != path:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    return path
+
+
+def load_columns(name, data_dir='ml-latest-small', cache_dir=None, mmap=True):
+    """
+    Loads the columns of data_dir/<name>.csv from the binary cache, building it on first use. Numeric columns
+    are returned as (by default memory-mapped, read-only) numpy arrays, string columns as object arrays and
+    category columns as pandas Categoricals.
+    """
+    path = build_cache(name, data_dir, cache_dir)
+    with open(os.path.join(path, 'columns.json')) as f:
+        columns = json.load(f)['columns']
+    mmap_mode = 'r' if mmap else None
+    result = {}
+    for column, kind in columns.items():
+        if kind in ('str', 'category'):
+            buffer = np.load(os.path.join(path, f'{column}.buffer.npy'), mmap_mode=mmap_mode)
+            offsets = np.load(os.path.join(path, f'{column}.offsets.npy'))
+            strings = _decode_strings(buffer, offsets)
+            if kind == 'category':
+                codes = np.load(os.path.join(path, f'{column}.codes.npy'))
+                result[column] = pd.Categorical.from_codes(codes, categories=strings)
+            else:
+                result[column] = strings
+        else:
+            result[column] = np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mmap_mode)
+    return result
+
+
+def load_table(name, data_dir='ml-latest-small', cache_dir=None):
+    """
+    DataFrame with the contents of data_dir/<name>.csv, read from the binary cache.
+    """
+    columns = load_columns(name, data_dir, cache_dir, mmap=False)
+    return pd.DataFrame(columns, columns=list(SCHEMAS[name]))
+
+
+def load_ratings(data_dir='ml-latest-small', cache_dir=None):
+    return load_table('ratings', data_dir, cache_dir)
+
+
+def load_movies(data_dir='ml-latest-small', cache_dir=None):
+    return load_table('movies', data_dir, cache_dir)
+
+
+def load_tags(data_dir='ml-latest-small', cache_dir=None):
+    return load_table('tags', data_dir, cache_dir)
+
+
+def load_links(data_dir='ml-latest-small', cache_dir=None):
+    return load_table('links', data_dir, cache_dir)
+
+
+def load_rating_matrix(data_dir='ml-latest-small', cache_dir=None):
+    """
+    RatingMatrix built straight from the memory-mapped rating columns, without an intermediate DataFrame.
+    """
+    columns = load_columns('ratings', data_dir, cache_dir)
+    return RatingMatrix.from_arrays(columns['userId'], columns['movieId'], columns['rating'])
+
+
+def build_movies_data(movies):
+    """
+    Dictionary of movie id -> {'title': ..., 'genres': [...]} as used by the assignment 4 explanations,
+    built from whole columns instead of iterating over DataFrame rows.
+    """
+    genres = pd.Series(movies['genres'], dtype=str).str.split('|')
+    return {
+        movie_id: {'title': title, 'genres': movie_genres}
+        for movie_id, title, movie_genres in zip(movies['movieId'].tolist(), movies['title'].tolist(), genres.tolist())
+    }
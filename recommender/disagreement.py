@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from .matrix import RatingMatrix
+
+
+def _levels(values):
+    # |a - b| = sum_j delta_j * |[a > t_j] - [b > t_j]| over the distinct rating values t_j, which turns absolute
+    # differences into products of sparse indicator matrices
+    values = np.unique(values)
+    return list(zip(values[:-1], np.diff(values)))
+
+
+def _above(X, threshold):
+    above = X.copy()
+    above.data = (above.data > threshold).astype(np.float64)
+    above.eliminate_zeros()
+    return above
+
+
+def _key(user1, user2):
+    return (user1, user2) if user1 <= user2 else (user2, user1)
+
+
+def _rated(X):
+    rated = X.copy()
+    rated.data = np.ones_like(rated.data, dtype=np.float64)
+    return rated
+
+
+class GroupDisagreement:
+    """
+    Disagreement between the members of a group, computed from the sparse rating matrix.
+
+    The disagreement of two users is the mean absolute difference of their ratings over the movies both rated.
+    The absolute differences of all pairs of a group are sums of sparse products of rating-level indicator
+    matrices, so the whole pairwise matrix takes a handful of sparse products over the group's rows instead of
+    one pass over every movie per pair. Pair results are cached across requests; call invalidate() for users
+    whose ratings change.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = RatingMatrix.from_any(matrix)
+        self._pairs = {}
+
+    def invalidate(self, user_ids=None):
+        """
+        Forgets the cached pairs of the given users, or every cached pair.
+        """
+        if user_ids is None:
+            self._pairs.clear()
+            return
+        user_ids = set(user_ids)
+        for pair in [pair for pair in self._pairs if pair[0] in user_ids or pair[1] in user_ids]:
+            del self._pairs[pair]
+
+    def _group_rows(self, user_ids):
+        return self.matrix.csr[self.matrix.user_positions(user_ids)].astype(np.float64)
+
+    def _compute_pairs(self, left_ids, right_ids):
+        # Sums of absolute differences and co-rated counts between every left and every right user
+        left, right = self._group_rows(left_ids), self._group_rows(right_ids)
+        rated_left, rated_right = _rated(left), _rated(right)
+        counts = (rated_left @ rated_right.T).toarray()
+        totals = np.zeros(counts.shape)
+        for threshold, delta in _levels(np.concatenate([left.data, right.data])):
+            above_left, above_right = _above(left, threshold), _above(right, threshold)
+            totals += delta * (above_left @ rated_right.T + rated_left @ above_right.T
+                               - 2 * (above_left @ above_right.T)).toarray()
+        return totals, counts
+
+    def pair_statistics(self, user_ids):
+        """
+        (totals, counts) arrays of shape (len(user_ids), len(user_ids)): the summed absolute rating difference
+        and the number of co-rated movies of every pair of users.
+        """
+        user_ids = list(user_ids)
+        missing = sorted({user_id for i, user_id in enumerate(user_ids) for other in user_ids[i + 1:]
+                          if _key(user_id, other) not in self._pairs} if len(user_ids) > 1 else set())
+        if missing:
+            totals, counts = self._compute_pairs(missing, user_ids)
+            for row, user_id in enumerate(missing):
+                for col, other in enumerate(user_ids):
+                    if other != user_id:
+                        self._pairs[_key(user_id, other)] = (totals[row, col], counts[row, col])
+        size = len(user_ids)
+        totals, counts = np.zeros((size, size)), np.zeros((size, size))
+        for i, user_id in enumerate(user_ids):
+            for j in range(i + 1, size):
+                total, count = self._pairs[_key(user_id, user_ids[j])]
+                totals[i, j] = totals[j, i] = total
+                counts[i, j] = counts[j, i] = count
+        return totals, counts
+
+    def pairwise(self, user_ids):
+        """
+        Matrix of the mean absolute rating difference of every pair of users, nan for pairs without co-rated
+        movies and on the diagonal.
+        """
+        totals, counts = self.pair_statistics(user_ids)
+        scores = np.full(totals.shape, np.nan)
+        np.divide(totals, counts, out=scores, where=counts > 0)
+        np.fill_diagonal(scores, np.nan)
+        return scores
+
+    def score(self, user1, user2):
+        """
+        Mean absolute rating difference of two users over their co-rated movies, nan if there are none.
+        """
+        return self.pairwise([user1, user2])[0, 1]
+
+    def mean_disagreement(self, user_ids):
+        """
+        Average of the pair disagreements of the group over the pairs that co-rated at least one movie, nan if
+        no pair did.
+        """
+        scores = self.pairwise(user_ids)[np.triu_indices(len(user_ids), k=1)]
+        scores = scores[~np.isnan(scores)]
+        return float(scores.mean()) if len(scores) else np.nan
+
+    def item_disagreement(self, user_ids, min_raters=2):
+        """
+        Per-movie disagreement within the group, for the movies rated by at least min_raters members. Returns a
+        DataFrame indexed by movie id with the number of raters, their mean rating, the (population) variance
+        and the mean absolute difference over all pairs of raters.
+        """
+        X = self._group_rows(list(user_ids))
+        raters = np.asarray(_rated(X).sum(axis=0)).ravel()
+        sums = np.asarray(X.sum(axis=0)).ravel()
+        sumsq = np.asarray(X.multiply(X).sum(axis=0)).ravel()
+        pair_totals = np.zeros(X.shape[1])
+        for threshold, delta in _levels(X.data):
+            count_above = np.asarray(_above(X, threshold).sum(axis=0)).ravel()
+            pair_totals += delta * count_above * (raters - count_above)
+
+        columns = np.flatnonzero(raters >= max(min_raters, 1))
+        n = raters[columns]
+        mean = sums[columns] / n
+        pairs = n * (n - 1) / 2
+        mean_abs = np.full(len(columns), np.nan)
+        np.divide(pair_totals[columns], pairs, out=mean_abs, where=pairs > 0)
+        return pd.DataFrame({
+            'raters': n.astype(np.int64),
+            'mean': mean,
+            'variance': np.maximum(sumsq[columns] / n - mean ** 2, 0),
+            'mean_abs_difference': mean_abs,
+        }, index=pd.Index(self.matrix.movie_ids[columns], name='movieId'))
+
@@ -0,0 +1,351 @@
+"""
+Offline evaluation of the recommendation algorithms.
+
+The ratings are split into training and held-out ratings, either into random folds (every rating is held out
+once) or by time (the latest ratings of every user are held out). Each algorithm is fitted on the training
+ratings and every test user is scored for all movies at once, a block of users per call, which gives both the
+predictions of the held-out ratings (RMSE, MAE) and the top-k lists (precision, recall and NDCG at k, with the
+held-out ratings of at least relevance_threshold as the relevant movies, and catalogue coverage). Folds run in
+parallel worker processes. Next to the accuracy every result records how long fitting took and how many users
+and held-out ratings were scored per second.
+
+    results = evaluate(load_columns('ratings', 'ml-latest-small'), ['user_knn', 'item_knn'], folds=5)
+    print(format_report(summarize(results)))
+"""
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import numpy as np
+
+SPLITS = ('random', 'time')
+METRICS = ('rmse', 'mae', 'prediction_coverage', 'precision', 'recall', 'ndcg', 'catalogue_coverage',
+           'fit_seconds', 'users_per_second', 'predictions_per_second')
+
+
+def random_folds(num_ratings, folds=5, seed=0):
+    """
+    Fold number (0 .. folds - 1) of every rating, a random permutation cut into folds of equal size.
+    """
+    if folds < 2:
+        raise ValueError("Random splits need at least 2 folds")
+    assignment = np.empty(num_ratings, dtype=np.int64)
+    assignment[np.random.default_rng(seed).permutation(num_ratings)] = np.arange(num_ratings) % folds
+    return assignment
+
+
+def temporal_split(user_ids, timestamps, test_fraction=0.2):
+    """
+    Boolean mask of the held-out ratings: the latest test_fraction (rounded down) of every user's ratings by
+    timestamp, ties broken by position, so every user keeps their earliest rating for training.
+    """
+    if not 0 < test_fraction < 1:
+        raise ValueError("test_fraction must be between 0 and 1")
+    user_ids, timestamps = np.asarray(user_ids), np.asarray(timestamps)
+    order = np.lexsort((np.arange(len(user_ids)), timestamps, user_ids))
+    sorted_users = user_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    # Rank of every rating within its user, counted from the latest one
+    rank_from_end = np.repeat(starts + counts, counts) - 1 - np.arange(len(order))
+    test = np.zeros(len(order), dtype=bool)
+    test[order] = rank_from_end < np.repeat(np.floor(counts * test_fraction).astype(np.int64), counts)
+    return test
+
+
+def _split_masks(columns, split, folds, test_fraction, seed):
+    # One held-out mask per fold
+    if split == 'random':
+        assignment = random_folds(len(columns['rating']), folds, seed)
+        return [assignment == fold for fold in range(folds)]
+    if split == 'time':
+        return [temporal_split(columns['userId'], columns['timestamp'], test_fraction)]
+    raise ValueError(f"Unknown split '{split}', expected one of {SPLITS}")
+
+
+class _Baseline:
+    # Global mean plus damped user and movie biases, the reference every other algorithm should beat
+
+    def __init__(self, matrix, damping=10.0):
+        self.matrix = matrix
+        csr = matrix.csr.astype(np.float64)
+        self.global_mean = float(csr.data.mean()) if csr.nnz else 0.0
+        num_users, num_movies = csr.shape
+        users = np.repeat(np.arange(num_users), np.diff(csr.indptr))
+        movie_counts = np.bincount(csr.indices, minlength=num_movies)
+        self.movie_bias = np.bincount(csr.indices, csr.data - self.global_mean, num_movies) / (movie_counts + damping)
+        residuals = csr.data - self.global_mean - self.movie_bias[csr.indices]
+        self.user_bias = np.bincount(users, residuals, num_users) / (np.diff(csr.indptr) + damping)
+        self.rating_range = (float(csr.data.min()), float(csr.data.max())) if csr.nnz else (0.0, 0.0)
+
+    def scores_batch(self, user_ids):
+        positions = self.matrix.user_positions(list(user_ids))
+        scores = self.global_mean + self.user_bias[positions, None] + self.movie_bias
+        return np.clip(scores, *self.rating_range)
+
+
+class _UserKNN:
+    # The user-user neighbourhood predictions of recommend_movies, from the k most similar users
+
+    def __init__(self, matrix, k=5, metric='pearson'):
+        from .neighbours import NeighbourIndex
+
+        self.index = NeighbourIndex(matrix, k=k, metric=metric)
+        self.k = k
+
+    def scores_batch(self, user_ids):
+        from .scoring import predict_block
+
+        positions, neighbours, similarities = self.index.top_k_batch(user_ids, self.k)
+        scores = np.full((len(positions), self.index.X.shape[1]), np.nan)
+        for row, (movies, predicted) in enumerate(predict_block(self.index.X, positions, neighbours, similarities)):
+            scores[row, movies] = predicted
+        return scores
+
+
+def _baseline(matrix, **options):
+    return _Baseline(matrix, **options)
+
+
+def _user_knn(matrix, **options):
+    return _UserKNN(matrix, **options)
+
+
+def _item_knn(matrix, **options):
+    from .items import ItemSimilarityModel
+    return ItemSimilarityModel(**options).fit(matrix)
+
+
+def _factorization(matrix, **options):
+    from .factorization import MatrixFactorization
+    # Fewer factors and iterations than the class defaults by default, so a cross-validation takes seconds
+    return MatrixFactorization(**{'factors': 8, 'iterations': 10, **options}).fit(matrix)
+
+
+# Name -> function that fits the algorithm on a training RatingMatrix with keyword options and returns an
+# object with scores_batch(user_ids), the (users x movies) array of predictions with nan where there is none
+ALGORITHMS = {
+    'baseline': _baseline,
+    'user_knn': _user_knn,
+    'item_knn': _item_knn,
+    'mf': _factorization,
+}
+
+
+def _discounts(k):
+    return 1 / np.log2(np.arange(2, k + 2))
+
+
+def evaluate_model(model, train, test_users, test_movies, test_ratings, k=10, relevance_threshold=4.0,
+                   max_block_entries=1 << 22):
+    """
+    Accuracy of a fitted model on held-out ratings given as parallel arrays of user ids, movie ids and
+    ratings, as a dict of the METRICS other than fit_seconds. train is the RatingMatrix the model was fitted
+    on; its movies are the ones that can be recommended, and a user's training movies are never recommended.
+
+    Held-out ratings without a prediction are predicted as the user's mean training rating, which
+    prediction_coverage reports. Users without training ratings are skipped. Precision, recall and NDCG are
+    averaged over the users with at least one relevant held-out movie.
+    """
+    test_users, test_ratings = np.asarray(test_users), np.asarray(test_ratings, dtype=np.float64)
+    rows = train.user_positions(test_users.tolist(), missing=-1)
+    columns = train.movie_positions(np.asarray(test_movies).tolist(), missing=-1)
+    known = rows >= 0
+    rows, columns, ratings = rows[known], columns[known], test_ratings[known]
+    users = np.unique(rows)
+    num_movies = train.shape[1]
+    csr = train.csr
+    user_means = np.asarray(csr.sum(axis=1)).ravel() / np.maximum(np.diff(csr.indptr), 1)
+
+    # Held-out ratings grouped by user, in the order the users are scored
+    order = np.argsort(rows, kind='stable')
+    rows, columns, ratings = rows[order], columns[order], ratings[order]
+    bounds = np.searchsorted(rows, users), np.searchsorted(rows, users, side='right')
+    predictions = np.empty(len(rows))
+    predicted = np.zeros(len(rows), dtype=bool)
+    precision, recall, ndcg = [], [], []
+    recommended = np.zeros(num_movies, dtype=bool)
+    discounts = _discounts(k)
+
+    block = max(1, max_block_entries // max(num_movies, 1))
+    started = time.perf_counter()
+    for start in range(0, len(users), block):
+        block_users = users[start:start + block]
+        scores = np.asarray(model.scores_batch(train.user_ids[block_users].tolist()), dtype=np.float64)
+        lo, hi = bounds[0][start], bounds[1][start + len(block_users) - 1]
+        block_rows = np.searchsorted(block_users, rows[lo:hi])
+        block_columns = columns[lo:hi]
+        in_train = block_columns >= 0
+        values = np.full(hi - lo, np.nan)
+        values[in_train] = scores[block_rows[in_train], block_columns[in_train]]
+        predicted[lo:hi] = ~np.isnan(values)
+        predictions[lo:hi] = np.where(predicted[lo:hi], values, user_means[rows[lo:hi]])
+
+        # Top-k among the movies each user has not rated in training
+        scores[np.isnan(scores)] = -np.inf
+        own = csr[block_users].tocoo()
+        scores[own.row, own.col] = -np.inf
+        n = min(k, num_movies)
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n] if n < num_movies else \
+            np.tile(np.arange(num_movies), (len(block_users), 1))
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable'),
+                                 axis=1)
+        valid = np.isfinite(np.take_along_axis(scores, top, axis=1))
+        recommended[top[valid]] = True
+
+        relevant = np.zeros(scores.shape, dtype=bool)
+        is_relevant = (ratings[lo:hi] >= relevance_threshold) & in_train
+        relevant[block_rows[is_relevant], block_columns[is_relevant]] = True
+        num_relevant = np.bincount(block_rows[ratings[lo:hi] >= relevance_threshold], minlength=len(block_users))
+        hits = np.take_along_axis(relevant, top, axis=1) & valid
+        evaluated = num_relevant > 0
+        ideal = np.cumsum(discounts)[np.minimum(num_relevant, n) - 1]
+        precision.append(hits.sum(axis=1)[evaluated] / k)
+        recall.append(hits.sum(axis=1)[evaluated] / num_relevant[evaluated])
+        ndcg.append((hits * discounts[:n]).sum(axis=1)[evaluated] / ideal[evaluated])
+    seconds = time.perf_counter() - started
+
+    errors = predictions - ratings
+    return {
+        'rmse': float(np.sqrt(np.mean(errors ** 2))) if len(errors) else float('nan'),
+        'mae': float(np.mean(np.abs(errors))) if len(errors) else float('nan'),
+        'prediction_coverage': float(predicted.mean()) if len(predicted) else float('nan'),
+        'precision': _mean(precision),
+        'recall': _mean(recall),
+        'ndcg': _mean(ndcg),
+        'catalogue_coverage': float(recommended.mean()) if num_movies else float('nan'),
+        'users_per_second': len(users) / seconds if seconds > 0 else float('inf'),
+        'predictions_per_second': len(rows) / seconds if seconds > 0 else float('inf'),
+        'test_users': int(len(users)),
+        'test_ratings': int(len(rows)),
+    }
+
+
+def _mean(parts):
+    values = np.concatenate(parts) if parts else np.empty(0)
+    return float(values.mean()) if len(values) else float('nan')
+
+
+def _evaluate_fold(columns, test, algorithms, options, k, relevance_threshold):
+    # Fits and evaluates every algorithm on one fold; columns are numpy arrays, test the held-out mask
+    from .matrix import RatingMatrix
+
+    if isinstance(columns, dict) and 'data_dir' in columns:
+        from .data import load_columns
+        columns = load_columns('ratings', columns['data_dir'], columns['cache_dir'])
+    train = ~test
+    matrix = RatingMatrix.from_arrays(columns['userId'][train], columns['movieId'][train], columns['rating'][train])
+    results = []
+    for name in algorithms:
+        started = time.perf_counter()
+        model = ALGORITHMS[name](matrix, **options.get(name, {}))
+        fit_seconds = time.perf_counter() - started
+        metrics = evaluate_model(model, matrix, columns['userId'][test], columns['movieId'][test],
+                                 columns['rating'][test], k=k, relevance_threshold=relevance_threshold)
+        results.append({'algorithm': name, 'fit_seconds': fit_seconds, **metrics})
+    return results
+
+
+def evaluate(ratings, algorithms=('baseline', 'user_knn', 'item_knn', 'mf'), split='random', folds=5,
+             test_fraction=0.2, k=10, relevance_threshold=4.0, seed=0, workers=None, options=None):
+    """
+    Evaluates algorithms (names of ALGORITHMS) on the ratings, given as a DataFrame or a dict of the userId,
+    movieId, rating and timestamp columns, or as {'data_dir': ..., 'cache_dir': ...} so the worker processes
+    memory-map the cached columns themselves. options maps algorithm names to the keyword arguments of
+    their models, e.g. {'user_knn': {'k': 10}}. Returns one dict per fold and algorithm with 'fold',
+    'algorithm' and the METRICS.
+
+    split='random' holds every rating out once over folds random folds; split='time' holds out the latest
+    test_fraction of every user's ratings as a single fold. The folds run in up to workers processes (one
+    per CPU core by default) and serially when there is one worker or the process pool cannot be used.
+    """
+    from .parallel import resolve_workers
+
+    unknown = [name for name in algorithms if name not in ALGORITHMS]
+    if unknown:
+        raise ValueError(f"Unknown algorithms {unknown}, expected some of {list(ALGORITHMS)}")
+    source = ratings
+    if isinstance(ratings, dict) and 'data_dir' in ratings:
+        from .data import load_columns
+        ratings = load_columns('ratings', ratings['data_dir'], ratings.get('cache_dir'))
+        source = {'data_dir': source['data_dir'], 'cache_dir': source.get('cache_dir')}
+    else:
+        ratings = source = {name: np.asarray(ratings[name]) for name in ('userId', 'movieId', 'rating', 'timestamp')
+                            if name in ratings}
+    masks = _split_masks(ratings, split, folds, test_fraction, seed)
+    tasks = [(source, mask, list(algorithms), options or {}, k, relevance_threshold) for mask in masks]
+
+    workers = min(resolve_workers(workers), len(tasks))
+    fold_results = None
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as executor:
+                fold_results = list(executor.map(_evaluate_fold, *zip(*tasks)))
+        except (OSError, BrokenProcessPool) as error:
+            warnings.warn(f"Parallel evaluation failed ({error}), falling back to serial execution", RuntimeWarning)
+    if fold_results is None:
+        fold_results = [_evaluate_fold(*task) for task in tasks]
+    return [{'fold': fold, **result} for fold, results in enumerate(fold_results) for result in results]
+
+
+def summarize(results):
+    """
+    Mean of every metric over the folds, as {algorithm: {metric: value}}.
+    """
+    summary = {}
+    for result in results:
+        summary.setdefault(result['algorithm'], []).append(result)
+    return {
+        algorithm: {metric: float(np.mean([result[metric] for result in rows])) for metric in METRICS}
+        for algorithm, rows in summary.items()
+    }
+
+
+def format_report(summary, k=10):
+    """
+    The summary as a text table, one row per algorithm.
+    """
+    header = (f"{'algorithm':<12}{'RMSE':>8}{'MAE':>8}{'pred cov':>10}{f'P@{k}':>8}{f'R@{k}':>8}{f'NDCG@{k}':>9}"
+              f"{'cat cov':>9}{'fit s':>8}{'users/s':>10}{'pred/s':>11}")
+    lines = [header]
+    for algorithm, metrics in summary.items():
+        lines.append(
+            f"{algorithm:<12}{metrics['rmse']:>8.4f}{metrics['mae']:>8.4f}{metrics['prediction_coverage']:>10.3f}"
+            f"{metrics['precision']:>8.4f}{metrics['recall']:>8.4f}{metrics['ndcg']:>9.4f}"
+            f"{metrics['catalogue_coverage']:>9.3f}{metrics['fit_seconds']:>8.2f}{metrics['users_per_second']:>10.0f}"
+            f"{metrics['predictions_per_second']:>11.0f}"
+        )
+    return '\n'.join(lines)
+
+
+def parse_requirement(text):
+    """
+    'algorithm:metric>=value' or 'algorithm:metric<=value' as (algorithm, metric, operator, value).
+    """
+    for operator in ('>=', '<='):
+        name, found, value = text.partition(operator)
+        if found:
+            algorithm, _, metric = name.partition(':')
+            if metric not in METRICS:
+                raise ValueError(f"Unknown metric '{metric}' in requirement '{text}', expected one of {METRICS}")
+            return algorithm, metric, operator, float(value)
+    raise ValueError(f"Requirement '{text}' is not of the form algorithm:metric>=value or algorithm:metric<=value")
+
+
+def check_requirements(summary, requirements):
+    """
+    Messages for the requirements (see parse_requirement) the summary does not meet; empty when all are met.
+    """
+    failures = []
+    for text in requirements:
+        algorithm, metric, operator, bound = parse_requirement(text)
+        if algorithm not in summary:
+            failures.append(f"{text}: '{algorithm}' was not evaluated")
+            continue
+        value = summary[algorithm][metric]
+        met = value >= bound if operator == '>=' else value <= bound
+        if not met:
+            failures.append(f"{text}: {algorithm} {metric} is {value:.4f}")
+    return failures
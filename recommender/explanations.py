@@ -0,0 +1,255 @@
+"""
+Explanations of the ranked group recommendations of assignment 4.
+
+An ExplanationIndex is built once per recommendation run: the genre -> movie bitsets of the movie catalogue,
+which movies were selected and considered as bitsets over the same positions, the movie -> (sequence, rank,
+score) placements and per-movie statistics of the group's ratings. Every why / why-not question is then
+answered with dictionary lookups and bitset operations instead of scans over the considered movies. The
+module level functions take the same arguments as the original assignment 4 functions and reuse the index
+stored on the RecommendationInfo they are given.
+"""
+# Considered movies named as examples when none of a genre's movies was selected
+CONSIDERED_EXAMPLES = 5
+
+# Genre index of the most recently used movies_data, which is normally the same dictionary for every run
+_last_genre_index = None
+
+
+class RecommendationInfo(dict):
+    """
+    Information returned with ranked sequences, read like a dict:
+
+    - 'considered_movies': {movie_id: [neighbour average of every member that considered it]}
+    - 'selected_movies': {movie_id: [neighbour average of every selection]}
+    - 'placements': {movie_id: [(sequence, rank, score) of every selection]}
+
+    Unlike a plain dict it can hold the ExplanationIndex built from it, see explanation_index.
+    """
+
+
+def _bitset(positions):
+    # Bit i is set for every i in positions, built from a byte array in one pass
+    positions = list(positions)
+    if not positions:
+        return 0
+    buffer = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bytes(buffer), 'little')
+
+
+def _positions(bits):
+    # Positions of the set bits, lowest first
+    positions = []
+    while bits:
+        lowest = bits & -bits
+        positions.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return positions
+
+
+class GenreIndex:
+    """
+    Genre -> movie bitsets over a movies_data dictionary ({movie_id: {'title', 'genres'}}). Every movie has a
+    position and bit i of a genre's bitset is set when the movie at position i has that genre, so "which of
+    these movies are comedies" is one AND of two integers.
+    """
+
+    def __init__(self, movies_data):
+        self.movies_data = movies_data
+        self.movie_ids = list(movies_data)
+        self.positions = {movie_id: position for position, movie_id in enumerate(self.movie_ids)}
+        by_genre = {}
+        for position, movie_id in enumerate(self.movie_ids):
+            for genre in movies_data[movie_id]['genres']:
+                by_genre.setdefault(genre, []).append(position)
+        self.bitsets = {genre: _bitset(positions) for genre, positions in by_genre.items()}
+
+    @property
+    def genres(self):
+        return sorted(self.bitsets)
+
+    def genre(self, genre):
+        return self.bitsets.get(genre, 0)
+
+    def bitset(self, movie_ids):
+        """
+        Bitset of the given movies; movies missing from movies_data are left out.
+        """
+        return _bitset(self.positions[movie_id] for movie_id in movie_ids if movie_id in self.positions)
+
+    def movies(self, bits):
+        return [self.movie_ids[position] for position in _positions(bits)]
+
+
+def genre_index(movies_data):
+    """
+    GenreIndex of movies_data, reused while the same dictionary is passed.
+    """
+    global _last_genre_index
+    index = _last_genre_index
+    if index is None or index.movies_data is not movies_data:
+        index = _last_genre_index = GenreIndex(movies_data)
+    return index
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else 0
+
+
+class ExplanationIndex:
+    """
+    Everything needed to explain one recommendation run, see the module docstring. ratings_matrix is the
+    group's rating matrix the run was computed from; without it only the group case can be explained.
+    """
+
+    def __init__(self, recommendation_info, ratings_matrix, movies_data, genres=None):
+        self.info = recommendation_info
+        self.movies_data = movies_data
+        self.genres = genres if genres is not None else genre_index(movies_data)
+        self.matrix = ratings_matrix
+        self.version = getattr(ratings_matrix, 'version', None)
+
+        self.selected_scores = {movie_id: _mean(values)
+                                for movie_id, values in recommendation_info['selected_movies'].items()}
+        self.considered_scores = {movie_id: _mean(values)
+                                  for movie_id, values in recommendation_info['considered_movies'].items()}
+        self.selected_bits = self.genres.bitset(self.selected_scores)
+        self.considered_bits = self.genres.bitset(self.considered_scores)
+        self.placements = recommendation_info.get('placements') or {}
+        self._group_cases = {}
+
+        # Per-movie statistics of the group's ratings, from whole columns
+        self._columns, self._num_users, self._sums, self._raters = {}, 0, None, None
+        if ratings_matrix is not None:
+            import numpy as np
+
+            from .matrix import RatingMatrix
+
+            matrix = RatingMatrix.from_any(ratings_matrix)
+            self._columns = {movie_id: column for column, movie_id in enumerate(matrix.movie_ids.tolist())}
+            self._num_users = len(matrix)
+            # In the matrix dtype, like RatingMatrix.movie_mean, so comparisons come out as they always did
+            self._sums = np.asarray(matrix.csr.sum(axis=0)).ravel().astype(matrix.csr.dtype)
+            self._raters = np.diff(matrix.csc.indptr)
+
+    def is_current(self, ratings_matrix, movies_data):
+        return (ratings_matrix is self.matrix and movies_data is self.movies_data
+                and getattr(ratings_matrix, 'version', None) == self.version)
+
+    def title(self, movie_id):
+        movie = self.movies_data.get(movie_id)
+        return movie['title'] if movie is not None else f"Movie ID {movie_id}"
+
+    def _require_matrix(self):
+        if self.matrix is None:
+            raise ValueError("This ExplanationIndex was built without the group's rating matrix")
+
+    def group_average(self, movie_id):
+        """
+        Average rating of the movie over the group, unrated counted as 0; nan for movies nobody rated.
+        """
+        self._require_matrix()
+        column = self._columns.get(movie_id)
+        return float(self._sums[column] / self._num_users) if column is not None else float('nan')
+
+    def group_statistics(self, movie_id):
+        """
+        {'raters', 'mean_rating', 'group_average'} of the movie in the group's ratings.
+        """
+        self._require_matrix()
+        column = self._columns.get(movie_id)
+        if column is None:
+            return {'raters': 0, 'mean_rating': float('nan'), 'group_average': float('nan')}
+        raters = int(self._raters[column])
+        return {'raters': raters, 'mean_rating': float(self._sums[column] / raters) if raters else float('nan'),
+                'group_average': float(self._sums[column] / self._num_users)}
+
+    def placement(self, movie_id):
+        """
+        (sequence, rank, score) of the movie's best placement, or None if it was not selected.
+        """
+        placements = self.placements.get(movie_id)
+        return min(placements) if placements else None
+
+    def explain_atomic_case(self, movie_id):
+        title = self.title(movie_id)
+        if movie_id in self.selected_scores:
+            return f"'{title}' was recommended."
+        if movie_id in self.considered_scores:
+            lower = self.considered_scores[movie_id] < self.group_average(movie_id)
+            reason = "lower than group's average rating" if lower else "not aligning with group's preferences"
+            return f"'{title}' was considered but not selected due to {reason}."
+        return f"'{title}' was not considered in the recommendation process."
+
+    def explain_group_case(self, genre):
+        if genre not in self._group_cases:
+            self._group_cases[genre] = self._explain_group_case(genre)
+        return self._group_cases[genre]
+
+    def _explain_group_case(self, genre):
+        genre_bits = self.genres.genre(genre)
+        selected = self.genres.movies(genre_bits & self.selected_bits)
+        if selected:
+            selected.sort(key=lambda movie_id: self.placement(movie_id) or (float('inf'),))
+            titles = ', '.join(self.title(movie_id) for movie_id in selected)
+            return f"Movies from the genre '{genre}' like {titles} were recommended."
+        considered = self.genres.movies(genre_bits & self.considered_bits)
+        if considered:
+            considered.sort(key=lambda movie_id: -self.considered_scores[movie_id])
+            titles = ', '.join(self.title(movie_id) for movie_id in considered[:CONSIDERED_EXAMPLES])
+            return f"Movies from the genre '{genre}' like {titles} were considered but not selected."
+        return f"No movies from the genre '{genre}' were considered."
+
+    def explain_position_absenteeism(self, movie_id):
+        if movie_id not in self.selected_scores:
+            return self.explain_atomic_case(movie_id)
+        title = self.title(movie_id)
+        placement = self.placement(movie_id)
+        if placement is not None and placement[1] == 0:
+            return f"'{title}' was ranked first in sequence {placement[0] + 1}."
+        lower = self.selected_scores[movie_id] < self.group_average(movie_id)
+        reason = ("diversity considerations" if lower
+                  else "there were movies with higher average ratings or better matching the group's preferences")
+        return f"'{title}' was recommended but not ranked first due to {reason}."
+
+
+def explanation_index(recommendation_info, ratings_matrix, movies_data):
+    """
+    ExplanationIndex of a run. It is stored on a RecommendationInfo and rebuilt only when the matrix, its
+    ratings or movies_data change; a plain dict gets a new index on every call.
+    """
+    index = getattr(recommendation_info, 'explanations', None)
+    if index is None or not index.is_current(ratings_matrix, movies_data):
+        index = ExplanationIndex(recommendation_info, ratings_matrix, movies_data)
+        if isinstance(recommendation_info, RecommendationInfo):
+            recommendation_info.explanations = index
+    return index
+
+
+def explain_atomic_case(movie_id, recommendation_info, ratings_matrix, movies_data):
+    """
+    Why a movie was or was not recommended to the group: selected, considered but rated lower than the group
+    average, or not considered at all.
+    """
+    return explanation_index(recommendation_info, ratings_matrix, movies_data).explain_atomic_case(movie_id)
+
+
+def explain_group_case(genre, movies_data, recommendation_info):
+    """
+    Whether movies of a genre were recommended, or else which of them were considered (the best scored
+    ones), or that none were considered.
+    """
+    index = getattr(recommendation_info, 'explanations', None)
+    if index is None or index.movies_data is not movies_data:
+        # Genre questions do not need the group's ratings
+        index = explanation_index(recommendation_info, None, movies_data)
+    return index.explain_group_case(genre)
+
+
+def explain_position_absenteeism(movie_id, recommendation_info, ratings_matrix, movies_data):
+    """
+    Why a recommended movie was not ranked first; falls back to explain_atomic_case for movies that were not
+    recommended.
+    """
+    return explanation_index(recommendation_info, ratings_matrix, movies_data).explain_position_absenteeism(movie_id)
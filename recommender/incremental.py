@@ -0,0 +1,296 @@
+"""
+Time-aware recommendations that follow a stream of timestamped rating events without a full rebuild.
+
+Every rating counts with the weight 2 ** -(age / half_life), so a rating made one half-life ago counts half as
+much as one made now. The per-user and per-movie decayed counts, sums and sums of squares are kept as of the
+last event of that user or movie: a new event decays only its own rows up to its time and adds to them, and a
+read decays them the rest of the way. A batch of events therefore costs time in the number of events, and the
+means, being ratios of two values decayed by the same factor, are read without decaying anything.
+
+New events go through NeighbourIndex.update, and a parallel matrix of rating times is updated the same way.
+A rating that replaces a stored one is overwritten in the CSR / CSC arrays, and only the changed users'
+similarity statistics and the neighbour lists they affect are recomputed. A rating of a new (user, movie)
+pair changes the structure of the matrix: its batch is merged in one O(nnz) pass and the similarity
+statistics are recomputed, so new ratings are best consumed in batches.
+RecommendationCache entries of the changed users and of the patched neighbour lists become stale by their
+versions. Predictions weight every neighbour's rating by its age and centre it on the neighbour's decayed
+mean, so they follow what users rated recently rather than what they rated years ago.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .matrix import RatingMatrix, entry_positions
+from .similarity import top_k_indices
+
+DAY = 24 * 60 * 60
+DEFAULT_HALF_LIFE_DAYS = 180
+
+
+def iter_rating_events(path, chunksize=1_000_000, user_col='userId', movie_col='movieId', rating_col='rating',
+                       timestamp_col='timestamp'):
+    """
+    Reads a ratings.csv-style file in chunks like ingest.iter_rating_chunks, yielding (user_ids, movie_ids,
+    ratings, timestamps) arrays.
+    """
+    dtypes = {user_col: np.int64, movie_col: np.int64, rating_col: np.float32, timestamp_col: np.int64}
+    for chunk in pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize):
+        yield (chunk[user_col].to_numpy(), chunk[movie_col].to_numpy(), chunk[rating_col].to_numpy(),
+               chunk[timestamp_col].to_numpy())
+
+
+class DecayedStatistics:
+    """
+    Exponentially time-decayed per-user and per-movie rating counts, sums and sums of squares, see the module
+    docstring. half_life is in the unit of the timestamps, seconds for MovieLens. Arrays are indexed by row and
+    column position and grow with the matrix. These are statistics of rating events: when a user rates a movie
+    again, the old rating keeps fading out instead of being removed.
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE_DAYS * DAY):
+        if half_life <= 0:
+            raise ValueError(f"half_life must be positive, got {half_life}")
+        self.half_life = float(half_life)
+        self.clock = -np.inf
+        for name in ('user', 'movie'):
+            for field in ('count', 'sum', 'sumsq'):
+                setattr(self, f'{name}_{field}', np.zeros(0))
+            # Time the row's values are decayed to; -inf for rows without events
+            setattr(self, f'{name}_time', np.zeros(0))
+
+    def grow(self, num_users, num_movies):
+        for name, size in (('user', num_users), ('movie', num_movies)):
+            for field in ('count', 'sum', 'sumsq', 'time'):
+                values = getattr(self, f'{name}_{field}')
+                if len(values) < size:
+                    fill = -np.inf if field == 'time' else 0.0
+                    setattr(self, f'{name}_{field}', np.concatenate([values, np.full(size - len(values), fill)]))
+
+    def decay(self, elapsed):
+        """
+        Weight of a rating elapsed time units old.
+        """
+        return np.exp2(-np.asarray(elapsed, dtype=np.float64) / self.half_life)
+
+    def add(self, rows, cols, ratings, timestamps):
+        """
+        Adds rating events at the given row and column positions. Events may come in any order, also older
+        than ones already added; each counts with its weight relative to the latest event of its row.
+        """
+        ratings = np.asarray(ratings, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if not len(ratings):
+            return
+        self._add('user', np.asarray(rows), ratings, timestamps)
+        self._add('movie', np.asarray(cols), ratings, timestamps)
+        self.clock = max(self.clock, float(timestamps.max()))
+
+    def _add(self, name, positions, ratings, timestamps):
+        count, total, sumsq, last = (getattr(self, f'{name}_{field}') for field in ('count', 'sum', 'sumsq', 'time'))
+        touched = np.unique(positions)
+        previous = last[touched]
+        np.maximum.at(last, positions, timestamps)
+        # Rows without earlier events have nothing to decay (and -inf times would make 0 * inf)
+        factor = np.where(np.isfinite(previous), self.decay(last[touched] - previous), 0.0)
+        for values in (count, total, sumsq):
+            values[touched] *= factor
+        weights = self.decay(last[positions] - timestamps)
+        count += np.bincount(positions, weights, minlength=len(count))
+        total += np.bincount(positions, weights * ratings, minlength=len(total))
+        sumsq += np.bincount(positions, weights * ratings ** 2, minlength=len(sumsq))
+
+    def _weight(self, name, now=None):
+        now = self.clock if now is None else now
+        count, last = getattr(self, f'{name}_count'), getattr(self, f'{name}_time')
+        return count * self.decay(np.where(np.isfinite(last), now - last, np.inf))
+
+    def user_weight(self, now=None):
+        """
+        Decayed rating count of every user at time now, the latest event by default.
+        """
+        return self._weight('user', now)
+
+    def movie_weight(self, now=None):
+        """
+        Decayed rating count of every movie at time now: how much it was rated recently.
+        """
+        return self._weight('movie', now)
+
+    @staticmethod
+    def _divide(numerator, count):
+        return np.divide(numerator, count, out=np.full(len(count), np.nan), where=count > 0)
+
+    @property
+    def user_mean(self):
+        return self._divide(self.user_sum, self.user_count)
+
+    @property
+    def movie_mean(self):
+        return self._divide(self.movie_sum, self.movie_count)
+
+    @property
+    def user_variance(self):
+        return self._divide(self.user_sumsq, self.user_count) - self.user_mean ** 2
+
+    @property
+    def movie_variance(self):
+        return self._divide(self.movie_sumsq, self.movie_count) - self.movie_mean ** 2
+
+
+class IncrementalRecommender:
+    """
+    User-based recommendations over a NeighbourIndex that consume new rating events as they arrive, see the
+    module docstring. user_ids, movie_ids, ratings and timestamps are the rating events the index's matrix was
+    built from, e.g. the columns of data.load_columns('ratings'); where a user rated a movie more than once the
+    last row wins, as in RatingMatrix.from_arrays. The index is updated in place, so a Recommender or
+    RecommendationCache sharing it sees the new ratings as well.
+    """
+
+    def __init__(self, index, user_ids, movie_ids, ratings, timestamps, half_life=DEFAULT_HALF_LIFE_DAYS * DAY):
+        self.index = index
+        matrix = index.matrix
+        rows, cols = matrix.user_positions(user_ids), matrix.movie_positions(movie_ids)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        keys = rows * matrix.shape[1] + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+        times = sparse.csr_matrix((timestamps[keep], (rows[keep], cols[keep])), shape=matrix.shape)
+        if times.nnz != matrix.nnz:
+            raise ValueError(f"{times.nnz} timed ratings do not match the {matrix.nnz} ratings of the matrix")
+        # Grows by the same RatingMatrix.update calls as the ratings, so rows and columns stay aligned
+        self.times = RatingMatrix(times, matrix.user_ids, matrix.movie_ids)
+        self.statistics = DecayedStatistics(half_life)
+        self.statistics.grow(*matrix.shape)
+        self.statistics.add(rows, cols, ratings, timestamps)
+        data = matrix.csr.data
+        self.rating_range = (float(data.min()), float(data.max())) if len(data) else (0.0, 5.0)
+
+    @classmethod
+    def from_columns(cls, columns, k=20, metric='pearson', half_life=DEFAULT_HALF_LIFE_DAYS * DAY):
+        """
+        Builds the rating matrix and neighbour index from ratings columns (userId, movieId, rating, timestamp)
+        such as data.load_columns('ratings') returns.
+        """
+        from .neighbours import NeighbourIndex
+
+        matrix = RatingMatrix.from_arrays(columns['userId'], columns['movieId'], columns['rating'])
+        return cls(NeighbourIndex(matrix, k=k, metric=metric), columns['userId'], columns['movieId'],
+                   columns['rating'], columns['timestamp'], half_life=half_life)
+
+    @property
+    def matrix(self):
+        return self.index.matrix
+
+    @property
+    def clock(self):
+        """
+        Timestamp of the latest event consumed.
+        """
+        return self.statistics.clock
+
+    def consume(self, user_ids, movie_ids, ratings, timestamps):
+        """
+        Applies rating events in timestamp order: a user's latest rating of a movie replaces the stored one,
+        and events older than the stored rating only add to the decayed statistics. Returns the ids of the
+        users whose ratings changed.
+
+        Ratings that replace stored ones are written into the matrix arrays in place, and only the similarity
+        statistics and neighbour lists of their users are recomputed. Ratings of (user, movie) pairs without
+        a stored rating change the structure of the matrix, so a batch containing any is merged into the
+        rating and time matrices in one O(nnz) pass; pass new ratings in batches rather than one at a time.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        user_ids, movie_ids = np.asarray(user_ids)[order], np.asarray(movie_ids)[order]
+        ratings, timestamps = np.asarray(ratings, dtype=np.float64)[order], timestamps[order]
+        if not len(ratings):
+            return []
+
+        newer = timestamps >= self._stored_times(user_ids, movie_ids)
+        changed = []
+        if newer.any():
+            changed = self.index.update(user_ids[newer].tolist(), movie_ids[newer].tolist(), ratings[newer])
+            self.times.update(user_ids[newer].tolist(), movie_ids[newer].tolist(), timestamps[newer])
+            low, high = ratings[newer].min(), ratings[newer].max()
+            self.rating_range = (min(self.rating_range[0], float(low)), max(self.rating_range[1], float(high)))
+        matrix = self.matrix
+        self.statistics.grow(*matrix.shape)
+        self.statistics.add(matrix.user_positions(user_ids.tolist()), matrix.movie_positions(movie_ids.tolist()),
+                            ratings, timestamps)
+        return changed
+
+    def consume_file(self, path, chunksize=1_000_000):
+        """
+        Consumes the rating events of a ratings.csv-style file chunk by chunk. Returns the ids of the users
+        whose ratings changed.
+        """
+        changed = {}
+        for chunk in iter_rating_events(path, chunksize):
+            changed.update(dict.fromkeys(self.consume(*chunk)))
+        return list(changed)
+
+    def _stored_times(self, user_ids, movie_ids):
+        # Time of the stored rating of every (user, movie) pair, -inf where there is none
+        times = self.times
+        rows = times.user_positions(user_ids.tolist(), missing=-1)
+        cols = times.movie_positions(movie_ids.tolist(), missing=-1)
+        stored = np.full(len(rows), -np.inf)
+        known = np.flatnonzero((rows >= 0) & (cols >= 0))
+        positions = entry_positions(times.csr.indptr, times.csr.indices, rows[known], cols[known])
+        stored[known[positions >= 0]] = times.csr.data[positions[positions >= 0]]
+        return stored
+
+    def scores(self, user_id, num_users=5):
+        """
+        Time-decayed predictions of user_id for every movie as a dense array over the columns of the matrix,
+        nan where none of the num_users most similar users rated the movie or the user rated it already:
+
+            user_mean + sum(s_v * w_vj * (r_vj - mean_v)) / sum(|s_v| * w_vj)
+
+        over the neighbours v with similarity s_v that rated movie j, where w_vj is the decay weight of the
+        rating's age and the means are decayed means. Only the ratios of the weights matter, so they are taken
+        relative to the neighbours' latest rating, which keeps them from underflowing after many half-lives.
+        """
+        matrix, statistics = self.matrix, self.statistics
+        position = matrix.user_index(user_id)
+        predictions = np.full(matrix.shape[1], np.nan)
+        similar = [(other, similarity) for other, similarity in self.index.top_k(user_id, num_users)
+                   if not np.isnan(similarity)]
+        if not similar:
+            return predictions
+        neighbours = matrix.user_positions([other for other, _ in similar])
+        similarities = np.array([similarity for _, similarity in similar])
+        means = statistics.user_mean
+
+        ratings = matrix.csr[neighbours].astype(np.float64).tocoo()
+        times = self.times.csr[neighbours].tocoo()
+        weights = statistics.decay(times.data.max() - times.data)
+        # Both are canonical CSR rows of the same ratings, so the entries line up
+        centred = ratings.data - means[neighbours[ratings.row]]
+        numerator = np.bincount(ratings.col, similarities[ratings.row] * weights * centred, minlength=matrix.shape[1])
+        denominator = np.bincount(ratings.col, np.abs(similarities[ratings.row]) * weights,
+                                  minlength=matrix.shape[1])
+        predicted = denominator > 0
+        predicted[matrix.row_slice(position)[0]] = False
+        predictions[predicted] = means[position] + numerator[predicted] / denominator[predicted]
+        return np.clip(predictions, *self.rating_range)
+
+    def recommend(self, user_id, n=10, num_users=5):
+        """
+        [(movie_id, predicted_rating)] of the n unrated movies with the highest time-decayed predictions, see
+        scores(). Ties go to the lower column position, as elsewhere.
+        """
+        scores = self.scores(user_id, num_users)
+        candidates = np.flatnonzero(~np.isnan(scores))
+        best = candidates[top_k_indices(scores[candidates], n)]
+        return list(zip(self.matrix.movie_ids[best].tolist(), scores[best].tolist()))
+
+    def trending(self, n=10, now=None):
+        """
+        [(movie_id, decayed rating count)] of the n movies rated most in the recent past, e.g. for users
+        without ratings.
+        """
+        weights = self.statistics.movie_weight(now)
+        best = top_k_indices(weights, n)
+        best = best[weights[best] > 0]
+        return list(zip(self.matrix.movie_ids[best].tolist(), weights[best].tolist()))
@@ -0,0 +1,209 @@
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .matrix import RatingMatrix
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def iter_rating_chunks(path, chunksize=1_000_000, user_col='userId', movie_col='movieId', rating_col='rating'):
+    """
+    Reads a ratings.csv-style file in chunks of chunksize rows and yields (user_ids, movie_ids, ratings)
+    arrays, so only one chunk of the file is held in memory at a time.
+    """
+    dtypes = {user_col: np.int64, movie_col: np.int64, rating_col: np.float32}
+    for chunk in pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize):
+        yield chunk[user_col].to_numpy(), chunk[movie_col].to_numpy(), chunk[rating_col].to_numpy()
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process so far, or None where the platform does not report it.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RatingStatistics:
+    """
+    Per-user and per-movie rating counts, sums and sums of squares, from which the means and norms used by
+    the Pearson and cosine similarities follow. Arrays are indexed by insertion position until finalized.
+    """
+
+    def __init__(self):
+        self.user_count = np.zeros(0, dtype=np.int64)
+        self.user_sum = np.zeros(0)
+        self.user_sumsq = np.zeros(0)
+        self.movie_count = np.zeros(0, dtype=np.int64)
+        self.movie_sum = np.zeros(0)
+        self.movie_sumsq = np.zeros(0)
+
+    def grow(self, num_users, num_movies):
+        for name, size in (('user', num_users), ('movie', num_movies)):
+            for field in ('count', 'sum', 'sumsq'):
+                values = getattr(self, f'{name}_{field}')
+                if len(values) < size:
+                    setattr(self, f'{name}_{field}', np.concatenate([values, np.zeros(size - len(values), values.dtype)]))
+
+    def add(self, rows, cols, ratings, sign=1):
+        ratings = ratings.astype(np.float64)
+        self.user_count += sign * np.bincount(rows, minlength=len(self.user_count))
+        self.user_sum += sign * np.bincount(rows, ratings, minlength=len(self.user_sum))
+        self.user_sumsq += sign * np.bincount(rows, ratings ** 2, minlength=len(self.user_sumsq))
+        self.movie_count += sign * np.bincount(cols, minlength=len(self.movie_count))
+        self.movie_sum += sign * np.bincount(cols, ratings, minlength=len(self.movie_sum))
+        self.movie_sumsq += sign * np.bincount(cols, ratings ** 2, minlength=len(self.movie_sumsq))
+
+    def reorder(self, user_order, movie_order):
+        for field in ('count', 'sum', 'sumsq'):
+            setattr(self, f'user_{field}', getattr(self, f'user_{field}')[user_order])
+            setattr(self, f'movie_{field}', getattr(self, f'movie_{field}')[movie_order])
+
+    @staticmethod
+    def _divide(numerator, count):
+        return np.divide(numerator, count, out=np.full(len(count), np.nan), where=count > 0)
+
+    @property
+    def user_mean(self):
+        return self._divide(self.user_sum, self.user_count)
+
+    @property
+    def movie_mean(self):
+        return self._divide(self.movie_sum, self.movie_count)
+
+    @property
+    def user_norm(self):
+        return np.sqrt(self.user_sumsq)
+
+    @property
+    def movie_norm(self):
+        return np.sqrt(self.movie_sumsq)
+
+    @property
+    def user_variance(self):
+        return self._divide(self.user_sumsq, self.user_count) - self.user_mean ** 2
+
+    @property
+    def movie_variance(self):
+        return self._divide(self.movie_sumsq, self.movie_count) - self.movie_mean ** 2
+
+
+class StreamingIngestor:
+    """
+    Builds a RatingMatrix and RatingStatistics from chunks of ratings without ever holding the raw file.
+
+    Chunks are mapped to row / column positions and buffered as compact int32 / float32 arrays. Every
+    merge_every chunks the buffer is de-duplicated (the last rating of a user for a movie wins) and merged
+    into the accumulated CSR matrix, updating the aggregates for the ratings it adds or replaces. Peak memory
+    is therefore about the final CSR matrix plus one merge, independent of the size of the input file.
+    """
+
+    def __init__(self, merge_every=8):
+        self.merge_every = merge_every
+        self.statistics = RatingStatistics()
+        self._user_index = {}
+        self._movie_index = {}
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._buffer = []
+        self.rows_read = 0
+        self.chunks_read = 0
+
+    @staticmethod
+    def _positions(ids, index):
+        unique, inverse = np.unique(ids, return_inverse=True)
+        positions = np.fromiter((index.setdefault(item, len(index)) for item in unique.tolist()),
+                                dtype=np.int32, count=len(unique))
+        return positions[inverse]
+
+    def add_chunk(self, user_ids, movie_ids, ratings):
+        rows = self._positions(user_ids, self._user_index)
+        cols = self._positions(movie_ids, self._movie_index)
+        self._buffer.append((rows, cols, np.asarray(ratings, dtype=np.float32)))
+        self.rows_read += len(rows)
+        self.chunks_read += 1
+        if len(self._buffer) >= self.merge_every:
+            self._merge()
+
+    def _merge(self):
+        if not self._buffer:
+            return
+        rows = np.concatenate([chunk[0] for chunk in self._buffer])
+        cols = np.concatenate([chunk[1] for chunk in self._buffer])
+        ratings = np.concatenate([chunk[2] for chunk in self._buffer])
+        self._buffer = []
+
+        shape = (len(self._user_index), len(self._movie_index))
+        keys = rows.astype(np.int64) * shape[1] + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+        rows, cols, ratings = rows[keep], cols[keep], ratings[keep]
+        update = sparse.csr_matrix((ratings, (rows, cols)), shape=shape)
+
+        self._matrix.resize(shape)
+        mask = update.copy()
+        mask.data = np.ones_like(mask.data)
+        # Ratings the buffer replaces leave the aggregates before the new ones are added
+        replaced = sparse.csr_matrix(self._matrix.multiply(mask))
+        replaced_coo = replaced.tocoo()
+
+        self.statistics.grow(*shape)
+        self.statistics.add(replaced_coo.row, replaced_coo.col, replaced_coo.data, sign=-1)
+        self.statistics.add(rows, cols, ratings)
+        self._matrix = (self._matrix - replaced + update).tocsr()
+
+    def finalize(self):
+        """
+        Merges what is still buffered and returns the RatingMatrix, with users and movies sorted by id like
+        RatingMatrix.from_ratings. The statistics are reordered to the same positions.
+        """
+        self._merge()
+        user_ids = np.fromiter(self._user_index, dtype=np.int64, count=len(self._user_index))
+        movie_ids = np.fromiter(self._movie_index, dtype=np.int64, count=len(self._movie_index))
+        user_order = np.argsort(user_ids, kind='stable')
+        movie_order = np.argsort(movie_ids, kind='stable')
+        matrix = self._matrix[user_order][:, movie_order].astype(np.float32)
+        self.statistics.reorder(user_order, movie_order)
+        return RatingMatrix(matrix, user_ids[user_order], movie_ids[movie_order])
+
+
+def ingest_ratings(path, chunksize=1_000_000, merge_every=8, trace_memory=False):
+    """
+    Streams a ratings.csv-style file into a RatingMatrix and its per-user / per-movie statistics.
+
+    Returns (matrix, statistics, report) where report holds the number of rows and chunks read, the matrix
+    size, the elapsed time and the peak memory: the process peak RSS and, with trace_memory=True, the peak
+    of memory allocated during ingestion as seen by tracemalloc (slower, but excludes earlier allocations).
+    """
+    started = time.perf_counter()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        ingestor = StreamingIngestor(merge_every=merge_every)
+        for user_ids, movie_ids, ratings in iter_rating_chunks(path, chunksize):
+            ingestor.add_chunk(user_ids, movie_ids, ratings)
+        matrix = ingestor.finalize()
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    report = {
+        'rows': ingestor.rows_read,
+        'chunks': ingestor.chunks_read,
+        'users': matrix.shape[0],
+        'movies': matrix.shape[1],
+        'ratings': matrix.nnz,
+        'matrix_bytes': matrix.nbytes,
+        'seconds': time.perf_counter() - started,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_traced_bytes': traced_peak,
+    }
+    return matrix, ingestor.statistics, report
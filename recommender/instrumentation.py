@@ -0,0 +1,237 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+ENABLE_ENV = 'RECOMMENDER_INSTRUMENTATION'
+
+_enabled = os.environ.get(ENABLE_ENV, '').lower() in ('1', 'true', 'yes', 'on')
+_lock = threading.Lock()
+_timers = {}
+_counters = Counter()
+logger = logging.getLogger(__name__)
+
+
+class _NullTimer:
+    # Shared do-nothing context manager, so a disabled timer costs one flag check
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def enable():
+    """
+    Turns instrumentation on. It is off by default unless RECOMMENDER_INSTRUMENTATION is set to 1.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Clears every timer and counter.
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def record(name, seconds):
+    """
+    Adds one observation of seconds to the timer name.
+    """
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            _timers[name] = [1, seconds, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = min(stats[2], seconds)
+            stats[3] = max(stats[3], seconds)
+
+
+def timer(name):
+    """
+    Context manager that times its block under name, when instrumentation is enabled.
+    """
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name=None):
+    """
+    Decorator that times every call of a function, under name or the function's qualified name.
+    """
+    def decorate(func):
+        label = name or f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    """
+    Adds value to the counter name, when instrumentation is enabled.
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] += value
+
+
+def snapshot():
+    """
+    Current timers ({name: {'count', 'total_seconds', 'min_seconds', 'max_seconds', 'mean_seconds'}}) and
+    counters ({name: value}).
+    """
+    with _lock:
+        timers = {
+            name: {'count': n, 'total_seconds': total, 'min_seconds': low, 'max_seconds': high,
+                   'mean_seconds': total / n}
+            for name, (n, total, low, high) in _timers.items()
+        }
+        return {'timers': timers, 'counters': dict(_counters)}
+
+
+def _metric_name(prefix, name):
+    cleaned = ''.join(char if char.isalnum() else '_' for char in name)
+    return f'{prefix}_{cleaned}'.strip('_')
+
+
+def to_prometheus(prefix='recommender'):
+    """
+    The snapshot in the Prometheus text exposition format: a summary (count and sum) per timer and a counter
+    per counter.
+    """
+    data = snapshot()
+    lines = []
+    if data['timers']:
+        metric = f'{prefix}_duration_seconds'
+        lines.append(f'# HELP {metric} Time spent in instrumented sections.')
+        lines.append(f'# TYPE {metric} summary')
+        for name, stats in sorted(data['timers'].items()):
+            lines.append(f'{metric}_count{{section="{name}"}} {stats["count"]}')
+            lines.append(f'{metric}_sum{{section="{name}"}} {stats["total_seconds"]:.9f}')
+    for name, value in sorted(data['counters'].items()):
+        metric = _metric_name(prefix, name) + '_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def log_snapshot(log=None, level=logging.INFO, **fields):
+    """
+    Writes the snapshot as one JSON structured log record, with any extra fields (e.g. a request id).
+    """
+    (log or logger).log(level, json.dumps({**fields, **snapshot()}, sort_keys=True))
+
+
+class Profile:
+    """
+    Result of a profile() block: report is the text report, stats the pstats.Stats for cProfile, and samples
+    the Counter of collapsed stacks for the sampling profiler.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.report = ''
+        self.stats = None
+        self.samples = Counter()
+
+
+class _Sampler(threading.Thread):
+    # Records the stack of one thread every interval seconds from a background thread
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+@contextmanager
+def profile(kind='cprofile', sort='cumulative', limit=30, interval=0.001):
+    """
+    Profiles the block, independently of whether instrumentation is enabled, e.g. for one request.
+
+    kind='cprofile' uses the deterministic profiler (exact call counts, noticeable overhead). kind='sampling'
+    samples the calling thread's stack every interval seconds from a background thread (low overhead), and
+    reports the stacks in the collapsed format flame graph tools read.
+    """
+    result = Profile(kind)
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            result.stats = pstats.Stats(profiler, stream=out).sort_stats(sort)
+            result.stats.print_stats(limit)
+            result.report = out.getvalue()
+    elif kind == 'sampling':
+        sampler = _Sampler(threading.get_ident(), interval)
+        sampler.start()
+        try:
+            yield result
+        finally:
+            sampler.stopped.set()
+            sampler.join()
+            result.samples = sampler.samples
+            result.report = '\n'.join(f'{stack} {n}' for stack, n in sampler.samples.most_common(limit))
+    else:
+        raise ValueError(f"Unknown profiler '{kind}', expected 'cprofile' or 'sampling'")
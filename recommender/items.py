@@ -0,0 +1,308 @@
+import json
+
+import numpy as np
+from scipy import sparse
+
+from .instrumentation import timed
+from .matrix import RatingMatrix
+from .similarity import top_k_indices
+
+METRICS = ('cosine', 'adjusted_cosine', 'pearson')
+
+
+class ItemSimilarityModel:
+    """
+    Item-based collaborative filtering over a precomputed, truncated item-item similarity matrix.
+
+    fit() computes the similarity of every pair of movies from the sparse ratings in blocks of movies, one
+    sparse (block x users) @ (users x movies) product per block, and keeps only the k most similar movies of
+    each movie with a positive similarity. The result is a CSR matrix of about k entries per movie in float32
+    with int32 indices, small enough to save with save() and load() at start-up. Item similarities change
+    slowly, so the model can be rebuilt offline (e.g. nightly) while users keep rating.
+
+    A user is scored as a sparse vector x sparse matrix product over the movies the user rated:
+
+        prediction(u, i) = baseline(u, i) + sum_j s_ij (r_uj - baseline(u, j)) / sum_j s_ij
+
+    for the neighbours j of i rated by u. The ratings are centred by nothing for metric='cosine', by the user's
+    mean for 'adjusted_cosine' and by the movie's mean for 'pearson', the same centring the similarities are
+    computed with. shrinkage pulls the similarity of movies with few common raters n towards 0 by n / (n +
+    shrinkage), and pairs with fewer than min_support common raters are dropped.
+    """
+
+    def __init__(self, k=50, metric='adjusted_cosine', shrinkage=0.0, min_support=1, max_block_entries=1 << 24):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown item similarity metric '{metric}', expected one of {METRICS}")
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        self.k = k
+        self.metric = metric
+        self.shrinkage = shrinkage
+        self.min_support = min_support
+        self.max_block_entries = max_block_entries
+        self.matrix = None
+
+    def _centred(self, csr):
+        # Same sparsity as csr, with the stored ratings centred as the metric requires
+        centred = csr.astype(np.float64)
+        if self.metric == 'adjusted_cosine':
+            centred.data -= np.repeat(_row_means(csr), np.diff(csr.indptr))
+        elif self.metric == 'pearson':
+            centred.data -= self.movie_means[csr.indices]
+        return centred
+
+    @timed('items.fit')
+    def fit(self, matrix):
+        """
+        Computes the top-k similarity matrix of a RatingMatrix (or anything RatingMatrix.from_any accepts) and
+        returns self.
+        """
+        self.matrix = RatingMatrix.from_any(matrix)
+        csr = self.matrix.csr
+        num_movies = csr.shape[1]
+        self.movie_means = _row_means(self.matrix.csc.T.tocsr())
+        self.rating_range = (float(csr.data.min()), float(csr.data.max())) if csr.nnz else (0.0, 0.0)
+
+        centred = self._centred(csr)
+        movie_rows = centred.T.tocsr()
+        norms = np.sqrt(np.asarray(movie_rows.multiply(movie_rows).sum(axis=1)).ravel())
+        support = self.shrinkage > 0 or self.min_support > 1
+        if support:
+            rated = csr.astype(bool).astype(np.float64)
+            rated_rows = rated.T.tocsr()
+
+        k = min(self.k, max(num_movies - 1, 1))
+        block = max(1, self.max_block_entries // max(num_movies, 1))
+        indices, data, counts = [], [], []
+        for start in range(0, num_movies, block):
+            end = min(start + block, num_movies)
+            similarity = (movie_rows[start:end] @ centred).toarray()
+            denominator = norms[start:end, None] * norms[None, :]
+            np.divide(similarity, denominator, out=similarity, where=denominator > 0)
+            similarity[denominator == 0] = 0
+            if support:
+                common = (rated_rows[start:end] @ rated).toarray()
+                if self.shrinkage > 0:
+                    similarity *= common / (common + self.shrinkage)
+                similarity[common < self.min_support] = 0
+            similarity[np.arange(end - start), np.arange(start, end)] = 0
+            # The k largest per movie, unordered, then the positive ones sorted by column for the CSR layout
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k] if k < num_movies else \
+                np.broadcast_to(np.arange(num_movies), (end - start, num_movies))
+            top = np.sort(top, axis=1)
+            values = np.take_along_axis(similarity, top, axis=1)
+            keep = values > 0
+            indices.append(top[keep])
+            data.append(values[keep])
+            counts.append(keep.sum(axis=1))
+
+        indptr = np.concatenate([[0], np.cumsum(np.concatenate(counts) if counts else [])]).astype(np.int64)
+        self.similarities = sparse.csr_matrix(
+            (np.concatenate(data).astype(np.float32) if data else np.empty(0, np.float32),
+             np.concatenate(indices).astype(np.int32) if indices else np.empty(0, np.int32), indptr),
+            shape=(num_movies, num_movies))
+        self._prepare()
+        return self
+
+    def _prepare(self):
+        # Row j of the transpose lists the movies that have j as a neighbour, so a user's rated movies select
+        # the rows that contribute to their predictions
+        self._neighbour_of = self.similarities.T.tocsr()
+
+    @property
+    def neighbour_of(self):
+        """
+        Transpose of the similarity matrix in CSR layout: row j holds the movies that have j as a neighbour.
+        """
+        return self._neighbour_of
+
+    def _check_fitted(self):
+        if self.matrix is None:
+            raise RuntimeError("The model has not been fitted, call fit() or load() first")
+
+    @property
+    def movie_ids(self):
+        return self.matrix.movie_ids
+
+    def _user_ratings(self, user_id, matrix):
+        # Model positions and ratings of the movies user_id rated in matrix, which may be a newer matrix than
+        # the model was fitted on; movies the model does not know are left out
+        matrix = self.matrix if matrix is None else matrix
+        columns, ratings = matrix.row_slice(matrix.user_index(user_id))
+        if matrix is self.matrix:
+            return columns, ratings.astype(np.float64)
+        positions = self.matrix.movie_positions(matrix.movie_ids[columns].tolist(), missing=-1)
+        known = positions >= 0
+        return positions[known], ratings[known].astype(np.float64)
+
+    def _centred_rows(self, user_ids, matrix):
+        # The users' ratings as sparse (users x movies) rows, centred like the similarities, the same rows
+        # with ones, and the users' mean ratings
+        rated = [self._user_ratings(user_id, matrix) for user_id in user_ids]
+        indptr = np.concatenate([[0], np.cumsum([len(positions) for positions, _ in rated])])
+        positions = np.concatenate([positions for positions, _ in rated]) if rated else np.empty(0, np.int64)
+        ratings = np.concatenate([ratings for _, ratings in rated]) if rated else np.empty(0)
+        shape = (len(rated), self.similarities.shape[0])
+        user_means = np.array([ratings.mean() if len(ratings) else 0.0 for _, ratings in rated])
+        if self.metric == 'adjusted_cosine':
+            offsets = np.repeat(user_means, np.diff(indptr))
+        elif self.metric == 'pearson':
+            offsets = self.movie_means[positions]
+        else:
+            offsets = 0.0
+        centred = sparse.csr_matrix((ratings - offsets, positions, indptr), shape=shape)
+        ones = sparse.csr_matrix((np.ones(len(positions)), positions, indptr), shape=shape)
+        return centred, ones, user_means
+
+    @timed('items.scores')
+    def scores(self, user_id, matrix=None):
+        """
+        Predicted rating of user_id for every movie of the model, nan where none of the movie's neighbours was
+        rated. The user's ratings are read from matrix when given (e.g. the live RatingMatrix) and otherwise
+        from the ratings the model was fitted on.
+        """
+        return self.scores_batch([user_id], matrix)[0]
+
+    def scores_batch(self, user_ids, matrix=None):
+        """
+        Predictions of several users as a (users x movies) array, see scores. The users' centred ratings form
+        one sparse matrix, so the whole block is scored with two sparse matrix products.
+        """
+        self._check_fitted()
+        centred, ones, user_means = self._centred_rows(user_ids, matrix)
+        shape = centred.shape
+        numerator = (centred @ self._neighbour_of).toarray()
+        weights = (ones @ self._neighbour_of).toarray()
+        predictions = np.full(shape, np.nan)
+        known = weights > 0
+        predictions[known] = numerator[known] / weights[known]
+        if self.metric == 'adjusted_cosine':
+            predictions += user_means[:, None]
+        elif self.metric == 'pearson':
+            predictions += self.movie_means
+        return np.clip(predictions, *self.rating_range)
+
+    def score_candidates(self, user_id, movie_ids, matrix=None):
+        """
+        Predicted ratings of user_id for the given movies only, nan where there is none. Only the similarity
+        rows of those movies are read, so the cost depends on the number of candidates, not on the catalogue.
+        """
+        self._check_fitted()
+        candidates = self.matrix.movie_positions(list(movie_ids), missing=-1)
+        known = np.flatnonzero(candidates >= 0)
+        centred, ones, user_means = self._centred_rows([user_id], matrix)
+        rows = self.similarities[candidates[known]]
+        numerator = (rows @ centred.T).toarray().ravel()
+        weights = (rows @ ones.T).toarray().ravel()
+        predictions = np.full(len(candidates), np.nan)
+        scored = weights > 0
+        predictions[known[scored]] = numerator[scored] / weights[scored]
+        if self.metric == 'adjusted_cosine':
+            predictions += user_means[0]
+        elif self.metric == 'pearson':
+            predictions[known] += self.movie_means[candidates[known]]
+        return np.clip(predictions, *self.rating_range)
+
+    def predict(self, user_ids, movie_ids, matrix=None):
+        """
+        Predictions for parallel lists of user and movie ids; nan when the movie is unknown or none of its
+        neighbours was rated by the user.
+        """
+        self._check_fitted()
+        matrix = self.matrix if matrix is None else matrix
+        user_ids, movies = list(user_ids), self.matrix.movie_positions(list(movie_ids), missing=-1)
+        predictions = np.full(len(user_ids), np.nan)
+        rows_of = {}
+        for row, user_id in enumerate(user_ids):
+            if movies[row] >= 0:
+                rows_of.setdefault(user_id, []).append(row)
+        for user_id, rows in rows_of.items():
+            if matrix.has_user(user_id):
+                predictions[rows] = self.scores(user_id, matrix)[movies[rows]]
+        return predictions
+
+    def recommend(self, user_id, n=10, exclude_rated=True, matrix=None):
+        """
+        Top-n movies for user_id as a list of (movie_id, predicted_rating), like recommend_movies. Only movies
+        with a prediction are recommended.
+        """
+        scores = self.scores(user_id, matrix)
+        missing = np.isnan(scores)
+        scores[missing] = -np.inf
+        exclude = np.flatnonzero(missing)
+        if exclude_rated:
+            exclude = np.union1d(exclude, self._user_ratings(user_id, matrix)[0])
+        best = top_k_indices(scores, n, exclude=exclude)
+        return list(zip(self.movie_ids[best].tolist(), scores[best].tolist()))
+
+    def recommend_batch(self, user_ids, n=10, exclude_rated=True, matrix=None):
+        """
+        Top-n movies for several users, as {user_id: [(movie_id, predicted_rating), ...]}.
+        """
+        return {user_id: self.recommend(user_id, n, exclude_rated, matrix) for user_id in user_ids}
+
+    def similar_movies(self, movie_id, n=10):
+        """
+        [(movie_id, similarity)] of the at most n most similar movies kept for movie_id, best first.
+        """
+        self._check_fitted()
+        start, end = self.similarities.indptr[self.matrix.movie_index(movie_id) + np.arange(2)]
+        columns, values = self.similarities.indices[start:end], self.similarities.data[start:end]
+        best = top_k_indices(values, n)
+        return list(zip(self.movie_ids[columns[best]].tolist(), values[best].astype(np.float64).tolist()))
+
+    def save(self, path):
+        """
+        Saves the similarity matrix, movie means and the ratings it was fitted on to a .npz file.
+        """
+        self._check_fitted()
+        params = {
+            'k': self.k, 'metric': self.metric, 'shrinkage': self.shrinkage, 'min_support': self.min_support,
+            'max_block_entries': self.max_block_entries, 'rating_range': list(self.rating_range),
+        }
+        csr, similarities = self.matrix.csr, self.similarities
+        np.savez(
+            path, params=json.dumps(params), user_ids=self.matrix.user_ids, movie_ids=self.matrix.movie_ids,
+            data=csr.data, indices=csr.indices, indptr=csr.indptr, movie_means=self.movie_means.astype(np.float32),
+            similarity_data=similarities.data, similarity_indices=similarities.indices,
+            similarity_indptr=similarities.indptr,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a model saved with save().
+        """
+        with np.load(path, allow_pickle=False) as saved:
+            params = json.loads(str(saved['params']))
+            num_users, num_movies = len(saved['user_ids']), len(saved['movie_ids'])
+            csr = sparse.csr_matrix((saved['data'], saved['indices'], saved['indptr']), shape=(num_users, num_movies))
+            similarities = sparse.csr_matrix(
+                (saved['similarity_data'], saved['similarity_indices'], saved['similarity_indptr']),
+                shape=(num_movies, num_movies))
+            return cls.from_arrays(RatingMatrix(csr, saved['user_ids'], saved['movie_ids']), similarities,
+                                   saved['movie_means'], **params)
+
+    @classmethod
+    def from_arrays(cls, matrix, similarities, movie_means, rating_range, neighbour_of=None, **params):
+        """
+        Model over a RatingMatrix from a similarity matrix computed before, e.g. memory-mapped from a snapshot.
+        neighbour_of is the transpose of similarities in CSR layout; it is computed when not given.
+        """
+        model = cls(**params)
+        model.matrix = matrix
+        model.similarities = similarities
+        model.movie_means = np.asarray(movie_means, dtype=np.float64)
+        model.rating_range = tuple(rating_range)
+        if neighbour_of is None:
+            model._prepare()
+        else:
+            model._neighbour_of = neighbour_of
+        return model
+
+
+def _row_means(csr):
+    # Mean of the stored entries of every row, 0 for empty rows
+    counts = np.diff(csr.indptr)
+    sums = np.asarray(csr.sum(axis=1), dtype=np.float64).ravel()
+    return np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0)
@@ -0,0 +1,325 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def entry_positions(indptr, indices, majors, minors):
+    """
+    Positions in the data array of a canonical CSR (or CSC) matrix of the entries at (majors[i], minors[i]),
+    -1 where there is no stored entry. Each lookup is a binary search within one row (column).
+    """
+    positions = np.full(len(majors), -1, dtype=np.int64)
+    for i, (major, minor) in enumerate(zip(np.asarray(majors).tolist(), np.asarray(minors).tolist())):
+        start, end = indptr[major], indptr[major + 1]
+        found = start + np.searchsorted(indices[start:end], minor)
+        if found < end and indices[found] == minor:
+            positions[i] = found
+    return positions
+
+
+class RatingMatrix:
+    """
+    User-item rating matrix stored as scipy CSR (row access) with a lazily built CSC copy (column access),
+    plus userId -> row and movieId -> column maps. Only ratings that exist are stored: a movie a user has not
+    rated is missing (nan from get), never 0, so a stored rating of 0 is still a rating.
+
+    A dense pivot of ml-latest-small takes ~47 MB; this takes ~1 MB, and MovieLens 25M fits in a few hundred MB.
+    """
+
+    def __init__(self, csr, user_ids, movie_ids, csc=None):
+        csr = sparse.csr_matrix(csr)
+        if csr.shape != (len(user_ids), len(movie_ids)):
+            raise ValueError(f"Matrix shape {csr.shape} does not match {len(user_ids)} users and {len(movie_ids)} movies")
+        csr.sum_duplicates()
+        self.csr = csr
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        self._user_index = {user_id: pos for pos, user_id in enumerate(self.user_ids.tolist())}
+        self._movie_index = {movie_id: pos for pos, movie_id in enumerate(self.movie_ids.tolist())}
+        self._csc = csc
+        # Bumped by update(), so caches can tell when the matrix or one user's ratings changed
+        self.version = 0
+        self._user_versions = {}
+
+    @classmethod
+    def from_ratings(cls, ratings, user_col='userId', movie_col='movieId', rating_col='rating', dtype=np.float32):
+        """
+        Builds the matrix from a ratings.csv-style DataFrame, see from_arrays.
+        """
+        return cls.from_arrays(ratings[user_col].to_numpy(), ratings[movie_col].to_numpy(),
+                               ratings[rating_col].to_numpy(), dtype=dtype)
+
+    @classmethod
+    def from_arrays(cls, user_ids, movie_ids, ratings, dtype=np.float32):
+        """
+        Builds the matrix from parallel arrays of user ids, movie ids and ratings. Users and movies are sorted
+        by id, like ratings.pivot(...), and if a user rated a movie more than once the last rating wins.
+        """
+        user_ids, rows = np.unique(np.asarray(user_ids), return_inverse=True)
+        movie_ids, cols = np.unique(np.asarray(movie_ids), return_inverse=True)
+        keys = rows.astype(np.int64) * len(movie_ids) + cols
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+        csr = sparse.csr_matrix(
+            (np.asarray(ratings)[keep].astype(dtype), (rows[keep].astype(np.int32), cols[keep].astype(np.int32))),
+            shape=(len(user_ids), len(movie_ids)),
+        )
+        return cls(csr, user_ids, movie_ids)
+
+    @classmethod
+    def from_pivot(cls, pivot, dtype=np.float32):
+        """
+        Adapter for the pivoted DataFrames used by the assignments, where both nan and 0 mean "not rated".
+        """
+        values = pivot.to_numpy(dtype=np.float64)
+        rated = ~np.isnan(values) & (values != 0)
+        rows, cols = np.nonzero(rated)
+        csr = sparse.csr_matrix((values[rows, cols].astype(dtype), (rows, cols)), shape=values.shape)
+        return cls(csr, pivot.index.to_numpy(), pivot.columns.to_numpy())
+
+    @classmethod
+    def from_any(cls, matrix):
+        """
+        Accepts a RatingMatrix (returned as is), a pivoted DataFrame, or a dense / sparse array with
+        positional ids, so functions can take whichever form their caller already has.
+        """
+        if isinstance(matrix, cls):
+            return matrix
+        if isinstance(matrix, pd.DataFrame):
+            return cls.from_pivot(matrix)
+        if sparse.issparse(matrix):
+            matrix = sparse.csr_matrix(matrix)
+            matrix.eliminate_zeros()
+        else:
+            matrix = np.asarray(matrix, dtype=np.float64)
+            matrix = sparse.csr_matrix(np.where(np.isnan(matrix), 0, matrix))
+        return cls(matrix, np.arange(matrix.shape[0]), np.arange(matrix.shape[1]))
+
+    @property
+    def csc(self):
+        if self._csc is None:
+            self._csc = self.csr.tocsc()
+        return self._csc
+
+    @property
+    def shape(self):
+        return self.csr.shape
+
+    @property
+    def nnz(self):
+        return self.csr.nnz
+
+    @property
+    def density(self):
+        return self.nnz / max(1, self.shape[0] * self.shape[1])
+
+    @property
+    def nbytes(self):
+        return self.csr.data.nbytes + self.csr.indices.nbytes + self.csr.indptr.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"RatingMatrix({self.shape[0]} users x {self.shape[1]} movies, {self.nnz} ratings)"
+
+    def has_user(self, user_id):
+        return user_id in self._user_index
+
+    def has_movie(self, movie_id):
+        return movie_id in self._movie_index
+
+    def user_index(self, user_id):
+        return self._user_index[user_id]
+
+    def movie_index(self, movie_id):
+        return self._movie_index[movie_id]
+
+    def user_positions(self, user_ids, missing=None):
+        """
+        Row positions of several users. Unknown users raise KeyError, or map to missing when it is given.
+        """
+        return self._positions(self._user_index, user_ids, missing)
+
+    def movie_positions(self, movie_ids, missing=None):
+        """
+        Column positions of several movies. Unknown movies raise KeyError, or map to missing when it is given.
+        """
+        return self._positions(self._movie_index, movie_ids, missing)
+
+    @staticmethod
+    def _positions(index, ids, missing):
+        lookup = index.__getitem__ if missing is None else (lambda item: index.get(item, missing))
+        return np.fromiter((lookup(item) for item in ids), dtype=np.int64, count=len(ids))
+
+    def row_slice(self, pos):
+        """
+        Column positions and ratings of the movies rated by the user at row position pos, as views into the CSR arrays.
+        """
+        start, end = self.csr.indptr[pos], self.csr.indptr[pos + 1]
+        return self.csr.indices[start:end], self.csr.data[start:end]
+
+    def column_slice(self, pos):
+        """
+        Row positions and ratings of the users that rated the movie at column position pos.
+        """
+        csc = self.csc
+        start, end = csc.indptr[pos], csc.indptr[pos + 1]
+        return csc.indices[start:end], csc.data[start:end]
+
+    def get(self, user_id, movie_id, default=np.nan):
+        """
+        Rating of movie_id by user_id, or default (nan) if the user has not rated it.
+        """
+        if user_id not in self._user_index or movie_id not in self._movie_index:
+            return default
+        cols, values = self.row_slice(self._user_index[user_id])
+        col = self._movie_index[movie_id]
+        found = np.searchsorted(cols, col)
+        if found < len(cols) and cols[found] == col:
+            return values[found].item()
+        return default
+
+    def is_rated(self, user_id, movie_id):
+        return not np.isnan(self.get(user_id, movie_id))
+
+    def user_ratings(self, user_id):
+        """
+        Ratings given by user_id as a Series indexed by movie id, containing only rated movies.
+        """
+        cols, values = self.row_slice(self._user_index[user_id])
+        return pd.Series(values.astype(np.float64), index=self.movie_ids[cols], name=user_id)
+
+    def movie_ratings(self, movie_id):
+        """
+        Ratings given to movie_id as a Series indexed by user id, containing only users who rated it.
+        """
+        rows, values = self.column_slice(self._movie_index[movie_id])
+        return pd.Series(values.astype(np.float64), index=self.user_ids[rows], name=movie_id)
+
+    def rated_movie_positions(self, user_id):
+        return self.row_slice(self._user_index[user_id])[0]
+
+    def unrated_movie_positions(self, user_id):
+        mask = np.ones(self.shape[1], dtype=bool)
+        mask[self.rated_movie_positions(user_id)] = False
+        return np.flatnonzero(mask)
+
+    def movie_mean(self, movie_id, fill_missing=None):
+        """
+        Mean rating of movie_id over the users who rated it. With fill_missing set, users who did not rate
+        the movie count as that value instead (fill_missing=0 reproduces the mean of a zero-filled pivot column).
+        Returns nan for an unknown movie.
+        """
+        if movie_id not in self._movie_index:
+            return np.nan
+        _, values = self.column_slice(self._movie_index[movie_id])
+        if fill_missing is None:
+            return float(values.mean()) if len(values) else np.nan
+        return float((values.sum() + fill_missing * (self.shape[0] - len(values))) / self.shape[0])
+
+    def _add_ids(self, ids, axis):
+        # Unseen users / movies become new rows / columns at the end of the matrix
+        index = self._user_index if axis == 0 else self._movie_index
+        new_ids = [item for item in dict.fromkeys(ids) if item not in index]
+        if not new_ids:
+            return
+        for item in new_ids:
+            index[item] = len(index)
+        if axis == 0:
+            self.user_ids = np.concatenate([self.user_ids, np.asarray(new_ids, dtype=self.user_ids.dtype)])
+        else:
+            self.movie_ids = np.concatenate([self.movie_ids, np.asarray(new_ids, dtype=self.movie_ids.dtype)])
+
+    def update(self, user_ids, movie_ids, ratings):
+        """
+        Sets the given ratings in place, replacing existing ones and adding unseen users and movies as new
+        rows and columns. When every rating replaces an existing one, the values are overwritten in the CSR
+        (and CSC) data arrays, which costs a binary search per rating. Otherwise the CSR arrays are merged in
+        one vectorized pass, which is O(nnz) rather than the cost of rebuilding the matrix from a DataFrame.
+        The structure only ever grows, so an unchanged nnz means the ratings were overwritten in place.
+        Returns the row positions of the users whose ratings changed.
+        """
+        user_ids, movie_ids = list(user_ids), list(movie_ids)
+        ratings = np.asarray(ratings, dtype=self.csr.dtype)
+        self._add_ids(user_ids, 0)
+        self._add_ids(movie_ids, 1)
+        shape = (len(self.user_ids), len(self.movie_ids))
+        rows = self.user_positions(user_ids)
+        cols = self.movie_positions(movie_ids)
+
+        if shape == self.csr.shape:
+            positions = entry_positions(self.csr.indptr, self.csr.indices, rows, cols)
+            if len(positions) and positions.min() >= 0:
+                # The last value written for an entry wins, like in the merge below
+                _, last = np.unique(positions[::-1], return_index=True)
+                keep = len(positions) - 1 - last
+                self.csr.data[positions[keep]] = ratings[keep]
+                if self._csc is not None:
+                    csc = self._csc
+                    csc.data[entry_positions(csc.indptr, csc.indices, cols[keep], rows[keep])] = ratings[keep]
+                self._bump(user_ids)
+                return np.unique(rows)
+
+        old = self.csr.tocoo()
+        all_rows = np.concatenate([old.row, rows])
+        all_cols = np.concatenate([old.col, cols])
+        all_data = np.concatenate([old.data, ratings])
+        keys = all_rows.astype(np.int64) * shape[1] + all_cols
+        # Keep the last value written for every (user, movie), so updates win over existing ratings
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+        self.csr = sparse.csr_matrix((all_data[keep], (all_rows[keep], all_cols[keep])), shape=shape)
+        self.csr.sum_duplicates()
+        self._csc = None
+        self._bump(user_ids)
+        return np.unique(rows)
+
+    def _bump(self, user_ids):
+        self.version += 1
+        for user_id in dict.fromkeys(user_ids):
+            self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+
+    def user_version(self, user_id):
+        """
+        Number of update() calls that changed user_id's ratings.
+        """
+        return self._user_versions.get(user_id, 0)
+
+    def rated_mask(self):
+        """
+        Binary CSR matrix with a 1 wherever a rating exists.
+        """
+        mask = self.csr.copy()
+        mask.data = np.ones_like(mask.data)
+        return mask
+
+    def dense_rows(self, positions, fill=np.nan):
+        """
+        Dense (len(positions), num_movies) array of the given rows with unrated movies set to fill.
+        """
+        rows = self.csr[np.asarray(positions, dtype=np.int64)]
+        dense = np.full(rows.shape, fill, dtype=np.float64)
+        coo = rows.tocoo()
+        dense[coo.row, coo.col] = coo.data
+        return dense
+
+    def subset(self, user_ids, drop_unrated=False):
+        """
+        Matrix restricted to the given users (in the given order), keeping every movie column, or with
+        drop_unrated only the movies at least one of those users rated.
+        """
+        positions = self.user_positions(list(user_ids))
+        csr = self.csr[positions]
+        if not drop_unrated:
+            return RatingMatrix(csr, self.user_ids[positions], self.movie_ids)
+        columns = np.unique(csr.indices)
+        return RatingMatrix(csr[:, columns], self.user_ids[positions], self.movie_ids[columns])
+
+    def to_dataframe(self, fill=0):
+        """
+        Dense pivot-style DataFrame (userId index, movieId columns). Only meant for small matrices.
+        """
+        return pd.DataFrame(
+            self.dense_rows(np.arange(self.shape[0]), fill=fill), index=self.user_ids, columns=self.movie_ids
+        )
@@ -0,0 +1,268 @@
+import numpy as np
+
+from .similarity import SimilarityEngine, top_k_indices
+
+
+class NeighbourIndex:
+    """
+    Precomputed top-K neighbour lists for every user, so finding similar users is an O(K) lookup instead of
+    a similarity sweep over all users on every request.
+
+    Each list holds up to k + slack neighbours sorted by descending similarity and is always the exact top of
+    that user's similarities. When ratings change, only the changed users' similarity rows are recomputed,
+    and only the lists those users appear in (or now enter) are patched. A neighbour whose similarity drops
+    is removed from a list without knowing who replaces it, which is why the lists keep some slack; a list is
+    recomputed from scratch only once it holds fewer than k neighbours. Every list has a version that goes up
+    whenever the list is patched or recomputed, see list_version.
+
+    backend names an approximate nearest-neighbour index of the ann module ('lsh' or 'brute'; 'hnsw' holds
+    the rows densely and suits small matrices only) that builds the lists instead of the exact all-vs-all
+    pass, and answers top_k requests beyond the indexed k; backend_options are passed to it (e.g. num_tables
+    and probes, the recall knobs of 'lsh'). It searches the complete rating rows, so it needs co_rated=False.
+    Changed users' lists are still patched exactly.
+    """
+
+    def __init__(self, matrix, k=20, metric='pearson', co_rated=False, slack=5, block_size=1024, backend=None,
+                 backend_options=None):
+        if isinstance(matrix, SimilarityEngine):
+            self.engine = matrix
+        else:
+            self.engine = SimilarityEngine(matrix, metric=metric, co_rated=co_rated)
+        if backend is not None and self.engine.co_rated:
+            raise ValueError("An ANN backend searches complete rating rows and cannot be used with co_rated=True")
+        self.k = k
+        self.capacity = k + slack
+        self.block_size = block_size
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        self.ann = None
+        self.rebuild()
+
+    @property
+    def matrix(self):
+        return self.engine.matrix
+
+    @property
+    def X(self):
+        return self.engine.X
+
+    @property
+    def user_ids(self):
+        return self.engine.user_ids
+
+    @property
+    def movie_ids(self):
+        return self.engine.movie_ids
+
+    def position(self, user_id):
+        return self.engine.position(user_id)
+
+    def rebuild(self):
+        """
+        Recomputes every neighbour list with a blocked all-vs-all similarity pass, or with the ANN backend.
+        """
+        if self.backend is None:
+            indices, similarities = self.engine.top_k_all(self.capacity, self.block_size)
+        else:
+            from .ann import build_index
+
+            self.ann = build_index(self.engine.X, self.backend, metric=self.engine.metric, **self.backend_options)
+            self._ann_version = self.matrix.version
+            capacity = min(self.capacity, self.engine.num_users - 1)
+            blocks = [self.ann.query_rows(np.arange(start, min(start + self.block_size, self.engine.num_users)),
+                                          capacity)
+                      for start in range(0, self.engine.num_users, self.block_size)]
+            indices = np.vstack([block[0] for block in blocks])
+            similarities = np.vstack([block[1] for block in blocks])
+        self._indices = np.full((self.engine.num_users, self.capacity), -1, dtype=np.int64)
+        self._similarities = np.full((self.engine.num_users, self.capacity), np.nan)
+        self._indices[:, :indices.shape[1]] = indices
+        self._similarities[:, :indices.shape[1]] = similarities
+        self._lengths = (self._indices >= 0).sum(axis=1)
+        # Above every version handed out before, so lists read before the rebuild are all outdated
+        self._version = getattr(self, '_version', 0) + 1
+        self._list_versions = np.full(self.engine.num_users, self._version, dtype=np.int64)
+
+    def list_version(self, user_id):
+        """
+        Version of user_id's neighbour list. It changes whenever the list may have changed, including when
+        another user's new ratings move them into it, so values derived from the list can be checked for it.
+        """
+        return int(self._list_versions[self.engine.position(user_id)])
+
+    def top_k(self, user_id, k=5):
+        """
+        The k most similar users to user_id as a list of (user_id, similarity), read from the precomputed list.
+        Requests for more than the indexed k go to the ANN backend, or to a one-vs-all similarity query when there is
+        none, it is stale or it finds fewer than k users.
+        """
+        if k > self.k:
+            if self.ann is None or self.ann_is_stale():
+                return self.engine.top_k(user_id, k)
+            indices, similarities = self.ann.query_rows([self.engine.position(user_id)], k)
+            found = indices[0] >= 0
+            if found.sum() < min(k, self.engine.num_users - 1):
+                # Too few candidates shared a bucket with the user; an exact query is cheaper than a short list
+                return self.engine.top_k(user_id, k)
+            return list(zip(self.user_ids[indices[0][found]].tolist(), similarities[0][found].tolist()))
+        pos = self.engine.position(user_id)
+        n = min(k, self._lengths[pos])
+        neighbours = self._indices[pos, :n]
+        return list(zip(self.user_ids[neighbours].tolist(), self._similarities[pos, :n].tolist()))
+
+    def exact_similarities(self, user_id, other_ids, metric=None):
+        """
+        See SimilarityEngine.exact_similarities.
+        """
+        return self.engine.exact_similarities(user_id, other_ids, metric)
+
+    def top_k_batch(self, user_ids, k=5):
+        """
+        Neighbours of several users as (positions, neighbours, similarities) arrays, see SimilarityEngine.top_k_batch.
+        """
+        if k > self.k:
+            return self.engine.top_k_batch(user_ids, k)
+        positions = self.matrix.user_positions(list(user_ids))
+        return positions, self._indices[positions, :k].copy(), self._similarities[positions, :k].copy()
+
+    def ann_is_stale(self):
+        """
+        Whether the ratings changed since the ANN backend was built; rebuild() builds it again.
+        """
+        return self.ann is not None and self._ann_version != self.matrix.version
+
+    def update(self, user_ids, movie_ids, ratings):
+        """
+        Applies new or changed ratings and patches the neighbour lists they affect. Returns the ids of the
+        users whose ratings changed.
+
+        With the default full-row Pearson metric, a brand new movie column slightly shifts every user's mean;
+        those small shifts are not propagated, so call rebuild() after adding many movies.
+        """
+        matrix = self.engine.matrix
+        changed = matrix.update(user_ids, movie_ids, ratings)
+        self.engine.refresh_entries(matrix.user_positions(list(user_ids)), matrix.movie_positions(list(movie_ids)))
+        self._grow()
+        for pos in changed:
+            self._update_user(pos)
+        return self.user_ids[changed].tolist()
+
+    def update_from_ratings(self, ratings, user_col='userId', movie_col='movieId', rating_col='rating'):
+        """
+        Applies the rows of a ratings.csv-style DataFrame, see update().
+        """
+        return self.update(ratings[user_col].tolist(), ratings[movie_col].tolist(), ratings[rating_col].to_numpy())
+
+    def _grow(self):
+        missing = self.engine.num_users - len(self._indices)
+        if missing <= 0:
+            return
+        self._indices = np.vstack([self._indices, np.full((missing, self.capacity), -1, dtype=np.int64)])
+        self._similarities = np.vstack([self._similarities, np.full((missing, self.capacity), np.nan)])
+        self._lengths = np.concatenate([self._lengths, np.zeros(missing, dtype=self._lengths.dtype)])
+        self._list_versions = np.concatenate([self._list_versions, np.zeros(missing, dtype=np.int64)])
+
+    def _touch(self, pos):
+        self._version += 1
+        self._list_versions[pos] = self._version
+
+    def _set_row(self, pos, scores):
+        best = top_k_indices(scores, self.capacity, exclude=pos)
+        self._touch(pos)
+        self._indices[pos] = -1
+        self._similarities[pos] = np.nan
+        self._indices[pos, :len(best)] = best
+        self._similarities[pos, :len(best)] = scores[best]
+        self._lengths[pos] = len(best)
+
+    def _update_user(self, user):
+        scores = self.engine.rows_vs_all([user])[0]
+        self._set_row(user, scores)
+
+        # Only lists that contain the user, or that the user now enters, can change
+        num_users = len(self._lengths)
+        contains = (self._indices == user).any(axis=1)
+        last = np.where(self._lengths > 0, self._similarities[np.arange(num_users), np.maximum(self._lengths - 1, 0)], -np.inf)
+        not_full = self._lengths < np.minimum(self.capacity, num_users - 1)
+        # Ties with the last entry can still enter on the user id, see _patch_row
+        affected = contains | (scores >= last) | not_full
+        affected[user] = False
+        for pos in np.flatnonzero(affected):
+            self._patch_row(pos, user, scores[pos])
+
+    def _patch_row(self, pos, user, similarity):
+        n = self._lengths[pos]
+        indices = self._indices[pos, :n]
+        similarities = self._similarities[pos, :n]
+        keep = indices != user
+        indices, similarities = indices[keep], similarities[keep]
+
+        # Without the user the list is still the exact top of everyone else. The user goes back in only if it
+        # ranks above the last entry, or if there is nobody outside the list it could be confused with.
+        outsiders = len(self._lengths) - 2 - len(indices)
+        beats_last = len(indices) == 0 or similarity > similarities[-1] or (
+            similarity == similarities[-1] and user < indices[-1])
+        if beats_last or outsiders == 0:
+            indices = np.append(indices, user)
+            similarities = np.append(similarities, similarity)
+            order = np.lexsort((indices, -similarities))
+            indices, similarities = indices[order][:self.capacity], similarities[order][:self.capacity]
+
+        if len(indices) < min(self.k, len(self._lengths) - 1):
+            self._set_row(pos, self.engine.rows_vs_all([pos])[0])
+            return
+        if len(indices) == n and np.array_equal(indices, self._indices[pos, :n]) and np.array_equal(
+                similarities, self._similarities[pos, :n]):
+            return
+        self._touch(pos)
+        self._indices[pos] = -1
+        self._similarities[pos] = np.nan
+        self._indices[pos, :len(indices)] = indices
+        self._similarities[pos, :len(indices)] = similarities
+        self._lengths[pos] = len(indices)
+
+    def arrays(self):
+        """
+        The neighbour lists as (indices, similarities, lengths) arrays, as accepted by from_arrays.
+        """
+        return self._indices, self._similarities, self._lengths
+
+    def save(self, path):
+        """
+        Saves the neighbour lists to a .npz file so the index can be reused without recomputing it.
+        """
+        np.savez(
+            path, user_ids=self.user_ids, indices=self._indices, similarities=self._similarities,
+            lengths=self._lengths, k=self.k, metric=self.engine.metric, co_rated=self.engine.co_rated,
+        )
+
+    @classmethod
+    def from_arrays(cls, engine, k, indices, similarities, lengths, block_size=1024):
+        """
+        Index over a SimilarityEngine from neighbour lists computed before, without recomputing them. The
+        arrays are used as they are, so read-only (e.g. memory-mapped) arrays make a read-only index.
+        """
+        index = cls.__new__(cls)
+        index.engine = engine
+        index.k = k
+        index.capacity = indices.shape[1]
+        index.block_size = block_size
+        index.backend, index.backend_options, index.ann = None, {}, None
+        index._indices = indices
+        index._similarities = similarities
+        index._lengths = lengths
+        index._version = 1
+        index._list_versions = np.ones(len(lengths), dtype=np.int64)
+        return index
+
+    @classmethod
+    def load(cls, path, matrix):
+        """
+        Loads neighbour lists saved with save() for the same rating matrix.
+        """
+        with np.load(path, allow_pickle=False) as saved:
+            engine = SimilarityEngine(matrix, metric=str(saved['metric']), co_rated=bool(saved['co_rated']))
+            if not np.array_equal(saved['user_ids'], engine.user_ids):
+                raise ValueError(f"Neighbour index {path} was built for different users than the given matrix")
+            index = cls.from_arrays(engine, int(saved['k']), saved['indices'], saved['similarities'], saved['lengths'])
+        return index
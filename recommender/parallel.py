@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import ContextVar
+
+import numpy as np
+from scipy import sparse
+
+from .matrix import RatingMatrix
+from .similarity import SimilarityEngine
+
+_SHARED_ARRAYS = ('data', 'indices', 'indptr', 'csc_data', 'csc_indices', 'csc_indptr', 'user_ids', 'movie_ids')
+
+# Matrix attached by each worker process, see _init_worker
+_worker_matrix = None
+_worker_engines = {}
+# (matrix, engines) of the serial map_users call running in this context, see _map_serial
+_serial_engines = ContextVar('serial_engines', default=None)
+
+
+def share_matrix(matrix, directory):
+    """
+    Writes the CSR and CSC arrays and id maps of a rating matrix as .npy files in directory and returns a small,
+    picklable descriptor. Workers open the files memory-mapped and read-only, so the operating system shares one
+    copy of the matrix through the page cache instead of every task receiving a pickled copy.
+    """
+    matrix = RatingMatrix.from_any(matrix)
+    csr = matrix.csr.astype(np.float64)
+    csc = matrix.csc.astype(np.float64)
+    arrays = {
+        'data': csr.data, 'indices': csr.indices, 'indptr': csr.indptr,
+        'csc_data': csc.data, 'csc_indices': csc.indices, 'csc_indptr': csc.indptr,
+        'user_ids': matrix.user_ids, 'movie_ids': matrix.movie_ids,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(array))
+    return {'directory': directory, 'shape': matrix.shape}
+
+
+def attach_matrix(descriptor):
+    """
+    Opens a matrix written by share_matrix without copying its arrays.
+    """
+    arrays = {
+        name: np.load(os.path.join(descriptor['directory'], f'{name}.npy'), mmap_mode='r')
+        for name in _SHARED_ARRAYS
+    }
+    shape = tuple(descriptor['shape'])
+    csr = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=shape, copy=False)
+    csc = sparse.csc_matrix((arrays['csc_data'], arrays['csc_indices'], arrays['csc_indptr']), shape=shape, copy=False)
+    return RatingMatrix(csr, np.asarray(arrays['user_ids']), np.asarray(arrays['movie_ids']), csc=csc)
+
+
+def _init_worker(descriptor):
+    global _worker_matrix
+    _worker_matrix = attach_matrix(descriptor)
+    _worker_engines.clear()
+
+
+def _run_chunk(func, chunk, kwargs):
+    return func(_worker_matrix, chunk, **kwargs)
+
+
+def _chunks(user_ids, chunk_size):
+    return [user_ids[start:start + chunk_size] for start in range(0, len(user_ids), chunk_size)]
+
+
+def resolve_workers(workers):
+    """
+    Number of worker processes to use: workers itself, or one per CPU core when it is None or 0.
+    """
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def map_users(func, matrix, user_ids, workers=None, chunk_size=256, **kwargs):
+    """
+    Runs func(matrix, chunk_of_user_ids, **kwargs) over user_ids split into chunks and returns the concatenated
+    results in the order of user_ids. func must be a module-level function returning one result per user.
+
+    With more than one worker the chunks are spread over a ProcessPoolExecutor whose workers attach the matrix
+    from memory-mapped files (see share_matrix). With one worker, a single chunk, or when the process pool cannot
+    be used, the chunks run serially in this process.
+    """
+    user_ids = list(user_ids)
+    chunks = _chunks(user_ids, chunk_size)
+    workers = min(resolve_workers(workers), len(chunks))
+    if workers <= 1:
+        return _map_serial(func, matrix, chunks, kwargs)
+
+    directory = tempfile.mkdtemp(prefix='recommender-shared-')
+    try:
+        descriptor = share_matrix(matrix, directory)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(descriptor,)) as executor:
+            results = executor.map(_run_chunk, [func] * len(chunks), chunks, [kwargs] * len(chunks))
+            return [result for chunk_results in results for result in chunk_results]
+    except (OSError, BrokenProcessPool) as error:
+        warnings.warn(f"Parallel execution failed ({error}), falling back to serial execution", RuntimeWarning)
+        return _map_serial(func, matrix, chunks, kwargs)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _map_serial(func, matrix, chunks, kwargs):
+    # The chunks of one call share its similarity engines, as the chunks a worker runs do
+    matrix = RatingMatrix.from_any(matrix)
+    token = _serial_engines.set((matrix, {}))
+    try:
+        return [result for chunk in chunks for result in func(matrix, chunk, **kwargs)]
+    finally:
+        _serial_engines.reset(token)
+
+
+def _engine_for(matrix, metric, co_rated):
+    # Workers keep one similarity engine per metric for the matrix they attached, a serial call for its matrix
+    serial = _serial_engines.get()
+    if matrix is _worker_matrix:
+        engines = _worker_engines
+    elif serial is not None and matrix is serial[0]:
+        engines = serial[1]
+    else:
+        return SimilarityEngine(matrix, metric=metric, co_rated=co_rated)
+    key = (metric, co_rated)
+    if key not in engines:
+        engines[key] = SimilarityEngine(matrix, metric=metric, co_rated=co_rated)
+    return engines[key]
+
+
+def _recommend_chunk(matrix, user_ids, k, top_n, metric, co_rated):
+    from .scoring import iter_recommendations
+
+    engine = _engine_for(matrix, metric, co_rated)
+    return [recommendations for _, recommendations in iter_recommendations(engine, user_ids, k=k, top_n=top_n)]
+
+
+def recommend_movies_parallel(matrix, user_ids=None, k=5, top_n=10, workers=None, chunk_size=256,
+                              metric='pearson', co_rated=False):
+    """
+    Recommends movies for many users (all users by default) with the batched scorer, sharding the users over
+    worker processes. Returns {user_id: [(movie_id, predicted_rating), ...]} in the order of user_ids, identical
+    to recommend_movies_batch.
+    """
+    matrix = RatingMatrix.from_any(matrix)
+    if user_ids is None:
+        user_ids = matrix.user_ids.tolist()
+    user_ids = list(user_ids)
+    results = map_users(_recommend_chunk, matrix, user_ids, workers=workers, chunk_size=chunk_size,
+                        k=k, top_n=top_n, metric=metric, co_rated=co_rated)
+    return dict(zip(user_ids, results))
@@ -0,0 +1,124 @@
+import numpy as np
+
+from . import instrumentation
+
+
+def _rank_predictions(movies, predicted, first_neighbour, top_n=None):
+    # Order by descending prediction, then by the rank of the first neighbour that rated the movie and its
+    # column, which is the order the original per-movie loop discovered the movies in. The loop's stable sort
+    # kept that order among equal predictions; the predictions are summed in the loop's order (see
+    # predict_block), so they are compared as they are.
+    if top_n is not None and top_n < len(movies):
+        kth = np.partition(-predicted, top_n - 1)[top_n - 1]
+        keep = np.flatnonzero(-predicted <= kth)
+        movies, predicted, first_neighbour = movies[keep], predicted[keep], first_neighbour[keep]
+    order = np.lexsort((movies, first_neighbour, -predicted))[:top_n]
+    return movies[order], predicted[order]
+
+
+def predict_block(X, user_positions, neighbours, similarities, top_n=None):
+    """
+    Predicts ratings for a block of users at once. neighbours and similarities are (num_users, k) arrays
+    of neighbour row positions (-1 for padding) and their similarities. The weighted ratings and the summed
+    similarities of the neighbours that rated each movie are accumulated over the k neighbour ranks, each
+    rank adding the rating rows of one neighbour per user; movies the user has rated are masked out.
+
+    Each prediction equals the original per-movie loop: the similarity-weighted average over the neighbours
+    that rated the movie, skipping movies whose summed similarity is 0. Returns a list with one
+    (movie_positions, predicted_ratings) pair per user, sorted by descending prediction and cut to top_n.
+    """
+    neighbours = np.asarray(neighbours, dtype=np.int64)
+    similarities = np.nan_to_num(np.asarray(similarities, dtype=np.float64))
+    num_users, k = neighbours.shape
+    valid = neighbours >= 0
+
+    # One neighbour rank at a time, so every sum adds its terms in the order of the original loop and
+    # predictions come out the same to the last bit, ties included. Each rank adds one sparse row per user.
+    weighted = np.zeros((num_users, X.shape[1]))
+    total_similarity = np.zeros((num_users, X.shape[1]))
+    # Rank of the first neighbour that rated each movie; movies no neighbour rated stay undiscovered
+    first_neighbour = np.full(weighted.shape, k, dtype=np.int64)
+    for rank in range(k):
+        present = np.flatnonzero(valid[:, rank])
+        by_rank = X[neighbours[present, rank]].tocoo()
+        rows = present[by_rank.row]
+        weights = similarities[present, rank][by_rank.row]
+        weighted[rows, by_rank.col] += weights * by_rank.data
+        total_similarity[rows, by_rank.col] += weights
+        first_neighbour[rows, by_rank.col] = np.minimum(first_neighbour[rows, by_rank.col], rank)
+
+    own = X[np.asarray(user_positions, dtype=np.int64)].tocoo()
+    candidates = (first_neighbour < k) & (total_similarity != 0)
+    candidates[own.row, own.col] = False
+    if instrumentation.is_enabled():
+        instrumentation.count('neighbours_evaluated', int(valid.sum()))
+        instrumentation.count('candidates_considered', int(candidates.sum()))
+
+    results = []
+    for row in range(num_users):
+        movies = np.flatnonzero(candidates[row])
+        predicted = weighted[row, movies] / total_similarity[row, movies]
+        results.append(_rank_predictions(movies, predicted, first_neighbour[row, movies], top_n))
+    return results
+
+
+def predict_from_neighbours(X, user_pos, neighbours, similarities):
+    """
+    Predicts ratings for the movies a user has not rated from the ratings of their neighbours, see
+    predict_block. Returns (movie_positions, predicted_ratings) sorted by descending prediction.
+    """
+    neighbours = np.asarray(neighbours, dtype=np.int64).reshape(1, -1)
+    similarities = np.asarray(similarities, dtype=np.float64).reshape(1, -1)
+    return predict_block(X, [user_pos], neighbours, similarities)[0]
+
+
+def recommend_movies(engine, user_id, num_users=5, similar_users=None):
+    """
+    Recommends movies for user_id from its num_users most similar users, as a list of
+    (movie_id, predicted_rating) sorted by descending predicted rating. engine is a SimilarityEngine
+    or a NeighbourIndex; pass similar_users to reuse a neighbour list the caller already has.
+    """
+    if similar_users is None:
+        with instrumentation.timer('recommend_movies.similarity'):
+            similar_users = engine.top_k(user_id, num_users)
+    similar_users = similar_users[:num_users]
+    neighbours = [engine.position(similar_user) for similar_user, _ in similar_users]
+    similarities = [similarity for _, similarity in similar_users]
+    with instrumentation.timer('recommend_movies.scoring'):
+        movies, predicted = predict_from_neighbours(engine.X, engine.position(user_id), neighbours, similarities)
+    return list(zip(engine.movie_ids[movies].tolist(), predicted.tolist()))
+
+
+def iter_recommendations(engine, user_ids=None, k=5, top_n=10, block_size=64):
+    """
+    Yields (user_id, [(movie_id, predicted_rating), ...]) for every requested user (all users by default),
+    scoring block_size users per sparse matrix product. Memory stays at a few block_size x num_movies arrays,
+    so this is what a nightly precompute over every user should use.
+    """
+    if user_ids is None:
+        user_ids = engine.user_ids.tolist()
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), block_size):
+        block = user_ids[start:start + block_size]
+        with instrumentation.timer('recommend_batch.similarity'):
+            positions, neighbours, similarities = engine.top_k_batch(block, k)
+        with instrumentation.timer('recommend_batch.scoring'):
+            predictions = predict_block(engine.X, positions, neighbours, similarities, top_n)
+        for user_id, (movies, predicted) in zip(block, predictions):
+            yield user_id, list(zip(engine.movie_ids[movies].tolist(), predicted.tolist()))
+
+
+def recommend_movies_batch(engine, user_ids, k=5, top_n=10, block_size=64, workers=1):
+    """
+    Recommends movies for several users in one pass. Returns {user_id: [(movie_id, predicted_rating), ...]}
+    in the order of user_ids, with the same predictions recommend_movies gives for each user on its own.
+    top_n=None keeps every candidate movie. With workers other than 1 the users are sharded over worker
+    processes (None uses every core), see parallel.recommend_movies_parallel.
+    """
+    if workers != 1:
+        from .parallel import recommend_movies_parallel
+
+        similarity = getattr(engine, 'engine', engine)
+        return recommend_movies_parallel(engine.matrix, user_ids, k=k, top_n=top_n, workers=workers,
+                                         metric=similarity.metric, co_rated=similarity.co_rated)
+    return dict(iter_recommendations(engine, user_ids, k, top_n, block_size))
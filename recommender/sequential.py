@@ -0,0 +1,306 @@
+import math
+import random
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors
+
+from . import instrumentation
+from .explanations import RecommendationInfo
+from .matrix import RatingMatrix
+from .similarity import top_k_indices
+
+
+class SequentialRecommender:
+    """
+    Generates sequences of group recommendations from one kNN model.
+
+    The model is fitted once on the rating matrix. The nearest neighbours of all group members are found with
+    one batched kneighbors call and cached. So are the average ratings of a user's neighbours for the movies
+    that user has not rated. Generating more sequences therefore costs only the sampling of each sequence.
+    The random choices of the diversified sequences come from a random.Random seeded with seed, so a seed
+    makes the sequences reproducible.
+
+    backend replaces the brute-force kNN model with an index of the ann module ('lsh' or 'brute', with
+    backend_options; 'hnsw' holds the rows densely and suits small groups only), for the 'cosine' and
+    'pearson' metrics. Lookups then return the same (distances,
+    indices) rows, with distances 1 - similarity and the user itself first.
+    """
+
+    def __init__(self, matrix, metric='cosine', seed=None, backend=None, backend_options=None):
+        self.matrix = RatingMatrix.from_any(matrix)
+        if backend is None:
+            self.model, self.index = NearestNeighbors(metric=metric, algorithm='brute').fit(self.matrix.csr), None
+        else:
+            from .ann import build_index
+            self.model, self.index = None, build_index(self.matrix.csr, backend, metric=metric,
+                                                       **(backend_options or {}))
+        self.rng = random.Random(seed)
+        self._neighbours = {}
+        self._averages = {}
+
+    def neighbours(self, user_ids, n_neighbors):
+        """
+        (distances, indices) rows of kneighbors for every user in user_ids. Users not queried before with
+        n_neighbors are queried together in a single kneighbors call.
+        """
+        n_neighbors = min(n_neighbors, len(self.matrix))
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if (user_id, n_neighbors) not in self._neighbours]
+        if missing:
+            positions = self.matrix.user_positions(missing)
+            with instrumentation.timer('sequential.kneighbors'):
+                if self.index is None:
+                    distances, indices = self.model.kneighbors(self.matrix.csr[positions], n_neighbors=n_neighbors)
+                else:
+                    distances, indices = self._query_index(positions, n_neighbors)
+            instrumentation.count('neighbours_evaluated', len(missing) * n_neighbors)
+            for user_id, row_distances, row_indices in zip(missing, distances, indices):
+                self._neighbours[(user_id, n_neighbors)] = (row_distances, row_indices)
+        return [self._neighbours[(user_id, n_neighbors)] for user_id in user_ids]
+
+    def _query_index(self, positions, n_neighbors):
+        # In the layout of kneighbors: the user itself at distance 0, then the others by increasing distance
+        indices, similarities = self.index.query_rows(positions, n_neighbors - 1)
+        rows = []
+        for position, row_indices, row_similarities in zip(positions.tolist(), indices, similarities):
+            found = row_indices >= 0
+            rows.append((np.concatenate([[0.0], 1 - row_similarities[found]]),
+                         np.concatenate([[position], row_indices[found]])))
+        return [distances for distances, _ in rows], [indices for _, indices in rows]
+
+    def unrated_averages(self, user_id, neighbour_positions):
+        """
+        Average rating of the given neighbours (unrated movies counted as 0) for every movie user_id has not
+        rated, as a Series indexed by movie id. Results are cached per user and set of neighbours.
+        """
+        neighbour_positions = np.asarray(neighbour_positions, dtype=np.int64)
+        key = (user_id, tuple(np.sort(neighbour_positions).tolist()))
+        if key not in self._averages:
+            instrumentation.count('sequential.average_misses')
+            if len(neighbour_positions):
+                averages = np.asarray(self.matrix.csr[neighbour_positions].mean(axis=0)).ravel()
+            else:
+                # No neighbours (a group of two in ranked_sequences), so nothing can be recommended
+                averages = np.full(self.matrix.shape[1], np.nan)
+            unrated = self.matrix.unrated_movie_positions(user_id)
+            self._averages[key] = pd.Series(averages[unrated], index=self.matrix.movie_ids[unrated])
+        return self._averages[key]
+
+    def diversified_sequences(self, user_group, top_n=10, num_sequences=3, num_neighbours=10):
+        """
+        Sequences in which each member contributes top_n movies sampled at random from the movies they have not
+        rated. The averages are taken over up to num_neighbours nearest neighbours, themselves sampled at random
+        from the member's nearest users. The self match is skipped.
+        """
+        k = min(num_neighbours, len(user_group) - 1)
+        neighbours = dict(zip(user_group, self.neighbours(user_group, k + 1)))
+        sequences = []
+        for _ in range(num_sequences):
+            sequence = []
+            for user_id in user_group:
+                indices = neighbours[user_id][1]
+                sampled = indices[self.rng.sample(range(1, len(indices)), min(k, len(indices) - 1))]
+                averages = self.unrated_averages(user_id, sampled)
+                sequence.extend(self.rng.sample(averages.index.tolist(), top_n))
+            sequences.append(sequence)
+        return sequences
+
+    def ranked_sequences(self, user_group, top_n=10, num_sequences=3):
+        """
+        Sequences in which each member contributes the top_n movies with the highest neighbour average. The
+        neighbours are the closest top_n other users; like the original implementation, this takes
+        len(matrix) - 1 neighbours and drops the first, which caps it at len(matrix) - 2. Also returns the
+        information the explanations need as a RecommendationInfo: the neighbour averages of the considered
+        and of the selected movies, and the (sequence, rank, score) placements of the selected ones, all
+        keyed by movie id.
+        """
+        info = RecommendationInfo(considered_movies={}, selected_movies={}, placements={})
+        considered = info['considered_movies']
+        neighbours = dict(zip(user_group, self.neighbours(user_group, len(self.matrix) - 1)))
+        per_user = {}
+        for user_id in user_group:
+            distances, indices = neighbours[user_id]
+            ranked = sorted(zip(distances[1:], indices[1:]))
+            averages = self.unrated_averages(user_id, [idx for _, idx in ranked[:top_n]])
+            per_user[user_id] = (averages, averages.nlargest(top_n).index.tolist())
+            for movie, average in zip(averages.index.tolist(), averages.tolist()):
+                considered.setdefault(movie, []).append(average)
+
+        # Nothing is random here, so every sequence repeats the same choices
+        sequences = []
+        for sequence_number in range(num_sequences):
+            sequence = []
+            for user_id in user_group:
+                averages, top_movies = per_user[user_id]
+                for movie in top_movies:
+                    info['placements'].setdefault(movie, []).append((sequence_number, len(sequence), averages[movie]))
+                    info['selected_movies'].setdefault(movie, []).append(averages[movie])
+                    sequence.append(movie)
+            sequences.append(sequence)
+        return sequences, info
+
+
+# Status of every movie in a GroupSession
+NEW, SHOWN, WATCHED, SKIPPED = 0, 1, 2, 3
+
+
+class GroupSession:
+    """
+    Rounds of sequential recommendations for one group, e.g. one per evening of a watch party, that remember
+    what was shown and how the group responded.
+
+    The members' neighbours are found once, like in ranked_sequences: the num_neighbours (default top_n)
+    closest other users. Their averages for every movie form a (members x movies) score array, with nan where
+    the member rated the movie. A round asks the members in order of their satisfaction so far, least satisfied
+    first, for their top_n movies not shown, watched or skipped before and not yet picked in the round. A
+    member's satisfaction with a round is the sum of their scores over the round's movies divided by the sum
+    of their own best scores, and the satisfaction of a member is the mean over the rounds.
+
+    feedback() marks movies watched or skipped and takes new ratings of the members. A new rating only changes
+    one column: the scores of the members that have the rater as a neighbour move by the weight of the rater
+    in their average, so no neighbours or averages are recomputed. The neighbour sets stay those of the first
+    round. Movies are tracked by column position, with one status byte per movie and one array of positions,
+    members and scores per round, which is what info() turns into the RecommendationInfo the explanations use.
+    """
+
+    def __init__(self, matrix, user_group, top_n=10, num_neighbours=None, metric='cosine', rating_range=None):
+        self.matrix = RatingMatrix.from_any(matrix)
+        data = self.matrix.csr.data
+        self.rating_range = tuple(rating_range) if rating_range is not None else (float(data.min()), float(data.max()))
+        self.members = list(dict.fromkeys(user_group))
+        self.top_n = top_n
+        num_neighbours = top_n if num_neighbours is None else num_neighbours
+        self._member_index = {member: position for position, member in enumerate(self.members)}
+        member_positions = self.matrix.user_positions(self.members)
+        num_members, (num_users, num_movies) = len(self.members), self.matrix.shape
+
+        rows, columns, weights = [], [], []
+        recommender = SequentialRecommender(self.matrix, metric=metric)
+        for member, (distances, indices) in enumerate(recommender.neighbours(self.members, num_users - 1)):
+            ranked = [position for _, position in sorted(zip(distances[1:], indices[1:]))[:num_neighbours]]
+            if not ranked:
+                continue
+            rows += [member] * len(ranked)
+            columns += ranked
+            weights += [1 / len(ranked)] * len(ranked)
+        self._weights = sparse.csr_matrix((weights, (rows, columns)), shape=(num_members, num_users))
+        # How much a member's rating moves every member's average
+        self._member_weights = self._weights[:, member_positions].toarray()
+
+        csr = self.matrix.csr[member_positions].tocoo()
+        self._ratings = np.zeros((num_members, num_movies))
+        self._ratings[csr.row, csr.col] = csr.data
+        rated = np.zeros((num_members, num_movies), dtype=bool)
+        rated[csr.row, csr.col] = True
+        self.scores = (self._weights @ self.matrix.csr.astype(np.float64)).toarray()
+        # Members without neighbours (a group of two) have no scores and so nothing to recommend; ranked_sequences
+        # lists unrated movies with nan averages for them instead
+        self.scores[np.diff(self._weights.indptr) == 0] = np.nan
+        self.scores[rated] = np.nan
+
+        self.status = np.zeros(num_movies, dtype=np.int8)
+        self._rounds = []
+        self._satisfaction_sums = np.zeros(num_members)
+        self._satisfaction_counts = np.zeros(num_members, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    @property
+    def rounds(self):
+        return len(self._rounds)
+
+    @property
+    def satisfaction(self):
+        """
+        {member: mean satisfaction over the rounds so far}, 0 before the first round.
+        """
+        means = np.divide(self._satisfaction_sums, self._satisfaction_counts,
+                          out=np.zeros(len(self.members)), where=self._satisfaction_counts > 0)
+        return dict(zip(self.members, means.tolist()))
+
+    def _best(self, member, available, n):
+        scores = self.scores[member]
+        candidates = np.flatnonzero(available & ~np.isnan(scores))
+        return candidates[top_k_indices(scores[candidates], n)]
+
+    def next_round(self, top_n=None):
+        """
+        Movie ids of the next round, see the class docstring. Every member contributes up to top_n movies, so
+        the round is shorter once the members run out of movies.
+        """
+        top_n = self.top_n if top_n is None else top_n
+        with self._lock:
+            available = self.status == NEW
+            means = self._satisfaction_sums / np.maximum(self._satisfaction_counts, 1)
+            free = available.copy()
+            positions, members = [], []
+            for member in np.argsort(means, kind='stable').tolist():
+                best = self._best(member, free, top_n)
+                free[best] = False
+                positions.append(best)
+                members.append(np.full(len(best), member, dtype=np.int64))
+            positions, members = np.concatenate(positions), np.concatenate(members)
+            scores = self.scores[members, positions]
+
+            for member in range(len(self.members)):
+                ideal = self.scores[member, self._best(member, available, len(positions))].sum()
+                if ideal > 0:
+                    self._satisfaction_sums[member] += np.nansum(self.scores[member, positions]) / ideal
+                    self._satisfaction_counts[member] += 1
+            self.status[positions] = SHOWN
+            self._rounds.append((positions, members, scores))
+            instrumentation.count('sequential.session_rounds')
+            return self.matrix.movie_ids[positions].tolist()
+
+    def feedback(self, watched=(), skipped=(), ratings=()):
+        """
+        Records what the group did with the movies shown: watched and skipped movie ids are not recommended
+        again, and ratings are (user_id, movie_id, rating) triples of members, within rating_range (by default
+        that of the group's matrix). Movies outside the group's matrix cannot be rated here.
+        """
+        ratings = list(ratings)
+        low, high = self.rating_range
+        # Checked up front, so invalid feedback changes nothing
+        for user_id, movie_id, rating in ratings:
+            if not (math.isfinite(rating) and low <= rating <= high):
+                raise ValueError(f"Rating {rating} of movie {movie_id} is outside the rating range {low}-{high}")
+            if user_id not in self._member_index:
+                raise ValueError(f"User {user_id} is not a member of this group")
+            if not self.matrix.has_movie(movie_id):
+                raise ValueError(f"Movie {movie_id} is not in the group's rating matrix")
+        with self._lock:
+            for movie_ids, status in ((skipped, SKIPPED), (watched, WATCHED)):
+                positions = self.matrix.movie_positions(list(movie_ids), missing=-1)
+                self.status[positions[positions >= 0]] = status
+            for user_id, movie_id, rating in ratings:
+                member, column = self._member_index[user_id], self.matrix.movie_index(movie_id)
+                self.scores[:, column] += self._member_weights[:, member] * (rating - self._ratings[member, column])
+                self._ratings[member, column] = rating
+                self.scores[member, column] = np.nan
+
+    def history(self):
+        """
+        [{'round', 'movies', 'members', 'scores'}] of every round: the movies in order, the member who
+        contributed each and that member's score for it.
+        """
+        return [{'round': number, 'movies': self.matrix.movie_ids[positions].tolist(),
+                 'members': [self.members[member] for member in members.tolist()], 'scores': scores.tolist()}
+                for number, (positions, members, scores) in enumerate(self._rounds)]
+
+    def info(self):
+        """
+        RecommendationInfo of the session so far, as ranked_sequences returns it: the current scores of the
+        movies each member can be recommended, and the score and (round, rank, score) placement of every
+        selection.
+        """
+        info = RecommendationInfo(considered_movies={}, selected_movies={}, placements={})
+        considered = ~np.isnan(self.scores)
+        for column in np.flatnonzero(considered.any(axis=0)).tolist():
+            info['considered_movies'][self.matrix.movie_ids[column].item()] = \
+                self.scores[considered[:, column], column].tolist()
+        for number, (positions, _, scores) in enumerate(self._rounds):
+            for rank, (movie_id, score) in enumerate(zip(self.matrix.movie_ids[positions].tolist(), scores.tolist())):
+                info['selected_movies'].setdefault(movie_id, []).append(score)
+                info['placements'].setdefault(movie_id, []).append((number, rank, score))
+        return info
@@ -0,0 +1,672 @@
+"""
+Asynchronous HTTP service for the recommendation entry points, built on asyncio streams only.
+
+    GET  /health
+    GET  /metrics                        latency percentiles, batch sizes and instrumentation counters
+    GET  /metrics?format=prometheus
+    GET  /users/<id>/recommendations?n=10&neighbours=5
+    GET  /users/<id>/similar?n=10
+    POST /groups/recommendations         {"users": [1, 2, 3], "strategy": "average", "n": 10, "disagreement": false}
+    POST /groups/sequential              {"users": [1, 2, 3], "n": 10, "sequences": 3, "seed": 1, "ranked": false}
+    POST /groups/explanations            {"users": [1, 2, 3], "case": "atomic", "movie": 2571}
+                                         {"users": [1, 2, 3], "case": "group", "genre": "Action"}
+    POST /groups/sessions                {"users": [1, 2, 3], "n": 10}
+    POST /groups/sessions/<id>/next      the next round of the session
+    POST /groups/sessions/<id>/feedback  {"watched": [2571], "skipped": [1], "ratings": [{"user": 1, "movie": 2571,
+                                          "rating": 4.5}]}
+
+Any request accepts ?profile=cprofile or ?profile=sampling (see instrumentation.profile): the recommender calls
+it makes then run unbatched and under that profiler, and the reports are logged and returned in the 'profile'
+field of a JSON response.
+
+Concurrent individual and group recommendation requests are coalesced into micro-batches that are scored
+together with the batched sparse products, see MicroBatcher. Everything CPU bound runs in a thread pool, or
+with executor='process' in a process pool whose workers each load their own Recommender, so the event loop
+only parses requests and writes responses. A Recommender opened with Recommender.from_snapshot is served from
+memory-mapped snapshot arrays that all workers share, and every process switches to a newly published snapshot
+within SNAPSHOT_CHECK_INTERVAL seconds. Group sessions (sequential.GroupSession) keep state between requests,
+so they live in the service process and their rounds, which take about a millisecond, run in threads.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import math
+import re
+import signal
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlsplit
+
+from . import instrumentation
+from .api import Recommender
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20
+# Seconds between checks for a newly published snapshot
+SNAPSHOT_CHECK_INTERVAL = 1.0
+EXPLANATION_CASES = ('atomic', 'group', 'position')
+PROFILERS = ('cprofile', 'sampling')
+# Group sessions kept at most, and seconds a session is kept after its last request
+MAX_SESSIONS = 10000
+SESSION_TTL = 7 * 24 * 60 * 60
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile q (0-100) of an ascending list, nan when it is empty.
+    """
+    if not sorted_values:
+        return math.nan
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyTracker:
+    """
+    Request latencies per endpoint over the last window requests, with their p50 / p90 / p99.
+    """
+
+    def __init__(self, window=10000):
+        self.window = window
+        self._samples = {}
+        self._counts = Counter()
+        self._errors = Counter()
+
+    def record(self, endpoint, seconds, error=False):
+        self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+        self._counts[endpoint] += 1
+        if error:
+            self._errors[endpoint] += 1
+
+    def summary(self):
+        result = {}
+        for endpoint, samples in sorted(self._samples.items()):
+            ordered = sorted(samples)
+            result[endpoint] = {
+                'count': self._counts[endpoint],
+                'errors': self._errors[endpoint],
+                'p50_ms': 1000 * percentile(ordered, 50),
+                'p90_ms': 1000 * percentile(ordered, 90),
+                'p99_ms': 1000 * percentile(ordered, 99),
+                'max_ms': 1000 * ordered[-1],
+            }
+        return result
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batches. submit(item) waits until max_batch_size items are pending or
+    max_delay seconds passed since the first of them, then run_batch(items) is awaited once for all of them
+    and must return one result per item. If a batch fails, its items are retried one by one, so a bad request
+    only fails itself.
+    """
+
+    def __init__(self, run_batch, max_batch_size=64, max_delay=0.002):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._run(pending))
+
+    async def _run(self, pending):
+        self.batches += 1
+        self.items += len(pending)
+        try:
+            results = await self.run_batch([item for item, _ in pending])
+        except Exception as exc:
+            if len(pending) == 1:
+                _resolve(pending[0][1], exception=exc)
+                return
+            await asyncio.gather(*(self._run([entry]) for entry in pending))
+            return
+        for (_, future), result in zip(pending, results):
+            _resolve(future, result)
+
+    def stats(self):
+        return {'batches': self.batches, 'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0}
+
+
+def _resolve(future, result=None, exception=None):
+    # The client may have gone away and cancelled the future
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+# (profiler kind, reports) of the request being handled, None when it is not profiled
+_profiling = contextvars.ContextVar('profiling', default=None)
+
+
+def _profiled(kind, function, args, kwargs):
+    # Runs in the thread (or worker process) that does the work, as the profilers only see their own thread
+    with instrumentation.profile(kind) as profile:
+        result = function(*args, **kwargs)
+    return result, profile.report
+
+
+# Recommender of a process pool worker
+_worker_recommender = None
+_worker_snapshot_checked = 0.0
+
+
+def _init_worker(options):
+    global _worker_recommender
+    options = dict(options)
+    snapshot_root = options.pop('snapshot_root', None)
+    if snapshot_root is not None:
+        _worker_recommender = Recommender.from_snapshot(snapshot_root, **options)
+    else:
+        _worker_recommender = Recommender(**options)
+    _worker_recommender.warm_up()
+
+
+def _call_worker(method, args, kwargs):
+    global _worker_snapshot_checked
+    # Workers of a snapshot-backed service switch to a newly published snapshot on their own
+    if _worker_recommender.snapshot_root is not None:
+        now = time.monotonic()
+        if now - _worker_snapshot_checked > SNAPSHOT_CHECK_INTERVAL:
+            _worker_snapshot_checked = now
+            _worker_recommender.refresh_snapshot()
+    return getattr(_worker_recommender, method)(*args, **kwargs)
+
+
+def _call_worker_profiled(kind, method, args, kwargs):
+    return _profiled(kind, _call_worker, (method, args, kwargs), {})
+
+
+def _to_json(value):
+    # numpy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Request:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        return self.headers.get('connection', '').lower() != 'close'
+
+    def json(self):
+        try:
+            payload = json.loads(self.body or b'{}')
+        except ValueError as exc:
+            raise HTTPError(400, f"Invalid JSON body: {exc}")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "The JSON body must be an object")
+        return payload
+
+    def int_param(self, name, default):
+        values = self.query.get(name)
+        if not values:
+            return default
+        try:
+            return int(values[-1])
+        except ValueError:
+            raise HTTPError(400, f"Query parameter '{name}' must be an integer")
+
+
+async def read_request(reader):
+    """
+    Reads one HTTP/1.1 request, or returns None when the client closed the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HTTPError(400, "Content-Length must be a non-negative integer")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+    url = urlsplit(target)
+    return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+
+def encode_response(status, body, content_type='application/json', keep_alive=True):
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+def _positive(value, name):
+    # A count such as n taken from the query or the JSON body
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise HTTPError(400, f"'{name}' must be a positive integer")
+    return value
+
+
+def _user_ids(payload, field='users'):
+    users = payload.get(field)
+    if not isinstance(users, list) or not users or not all(isinstance(user, int) for user in users):
+        raise HTTPError(400, f"'{field}' must be a non-empty list of user ids")
+    return users
+
+
+class RecommendationService:
+    """
+    The HTTP service. recommender is the Recommender to serve (by default one reading RECOMMENDER_DATA_DIR).
+    executor is 'thread' or 'process' and workers the size of its pool. Individual and group recommendation
+    requests are batched with max_batch_size and max_delay, see MicroBatcher.
+    """
+
+    def __init__(self, recommender=None, executor='thread', workers=None, max_batch_size=64, max_delay=0.002):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor '{executor}', expected 'thread' or 'process'")
+        self.recommender = recommender or Recommender()
+        self.executor_kind = executor
+        self.workers = workers
+        self.latency = LatencyTracker()
+        self.user_batcher = MicroBatcher(self._recommend_users, max_batch_size, max_delay)
+        self.group_batcher = MicroBatcher(self._recommend_groups, max_batch_size, max_delay)
+        self.executor = None
+        self.server = None
+        self._snapshot_watcher = None
+        self.sessions = LRUCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL)
+        self.routes = [
+            ('GET', re.compile(r'/health'), 'health', self.health),
+            ('GET', re.compile(r'/metrics'), 'metrics', self.metrics),
+            ('GET', re.compile(r'/users/(-?\d+)/recommendations'), 'user_recommendations', self.user_recommendations),
+            ('GET', re.compile(r'/users/(-?\d+)/similar'), 'similar_users', self.similar_users),
+            ('POST', re.compile(r'/groups/recommendations'), 'group_recommendations', self.group_recommendations),
+            ('POST', re.compile(r'/groups/sequential'), 'sequential_recommendations', self.sequential_recommendations),
+            ('POST', re.compile(r'/groups/explanations'), 'explanations', self.explanations),
+            ('POST', re.compile(r'/groups/sessions'), 'create_session', self.create_session),
+            ('POST', re.compile(r'/groups/sessions/([0-9a-f]+)/next'), 'session_round', self.session_round),
+            ('POST', re.compile(r'/groups/sessions/([0-9a-f]+)/feedback'), 'session_feedback', self.session_feedback),
+        ]
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Runs a Recommender method in the pool.
+        """
+        loop = asyncio.get_running_loop()
+        profiling = _profiling.get()
+        if profiling is not None:
+            kind, reports = profiling
+            if self.executor_kind == 'process':
+                result, report = await loop.run_in_executor(self.executor, _call_worker_profiled, kind, method, args,
+                                                            kwargs)
+            else:
+                result, report = await loop.run_in_executor(
+                    self.executor, _profiled, kind, getattr(self.recommender, method), args, kwargs)
+            reports.append({'call': method, 'report': report})
+            return result
+        if self.executor_kind == 'process':
+            return await loop.run_in_executor(self.executor, _call_worker, method, args, kwargs)
+        return await loop.run_in_executor(self.executor, functools.partial(getattr(self.recommender, method), *args,
+                                                                           **kwargs))
+
+    async def call_local(self, function, *args, **kwargs):
+        """
+        Runs a function on objects of this process in a thread, the pool's when it is a thread pool.
+        """
+        executor = self.executor if self.executor_kind == 'thread' else None
+        loop = asyncio.get_running_loop()
+        profiling = _profiling.get()
+        if profiling is not None:
+            kind, reports = profiling
+            result, report = await loop.run_in_executor(executor, _profiled, kind, function, args, kwargs)
+            reports.append({'call': getattr(function, '__name__', repr(function)), 'report': report})
+            return result
+        return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+    async def _batched(self, batcher, item):
+        # A profiled request runs alone, so its profile holds only its own work
+        if _profiling.get() is not None:
+            return (await batcher.run_batch([item]))[0]
+        return await batcher.submit(item)
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """
+        Loads the data, then starts listening. Returns the asyncio server.
+        """
+        if self.executor_kind == 'process':
+            recommender = self.recommender
+            options = {'data_dir': recommender.data_dir, 'cache_dir': recommender.cache_dir, 'k': recommender.k,
+                       'metric': recommender.metric, 'cache_size': recommender.cache_size,
+                       'item_k': recommender.item_k, 'half_life_days': recommender.half_life_days,
+                       'neighbour_backend': recommender.neighbour_backend,
+                       'neighbour_backend_options': recommender.neighbour_backend_options,
+                       'snapshot_root': recommender.snapshot_root}
+            # Spawned rather than forked: forking a process that already runs threads can deadlock the children
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'),
+                                                initializer=_init_worker, initargs=(options,))
+            # The user and group ids are validated against the matrix in this process
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(loop.run_in_executor(None, lambda: self.recommender.matrix),
+                                 self.call('is_loaded', 'matrix'))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='recommender')
+            await self.call('warm_up')
+        if self.recommender.snapshot_root is not None:
+            self._snapshot_watcher = asyncio.ensure_future(self._watch_snapshot())
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    async def serve_forever(self, host='127.0.0.1', port=8000):
+        server = await self.start(host, port)
+        try:
+            # Shut down like on Ctrl-C, so the pool's workers are stopped too
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+        addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+        logger.info("Serving recommendations on %s", addresses)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    async def _watch_snapshot(self):
+        # The recommender of this process (all of it with the thread pool) follows the published snapshot;
+        # process workers check for themselves, see _call_worker
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(SNAPSHOT_CHECK_INTERVAL)
+            try:
+                if await loop.run_in_executor(None, self.recommender.refresh_snapshot):
+                    logger.info("Switched to snapshot %s", self.recommender.snapshot.path)
+            except Exception:
+                logger.exception("Could not open the published snapshot")
+
+    def close(self):
+        if self._snapshot_watcher is not None:
+            self._snapshot_watcher.cancel()
+        if self.server is not None:
+            self.server.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as exc:
+                    writer.write(encode_response(exc.status, json.dumps({'error': exc.message}), keep_alive=False))
+                    break
+                if request is None:
+                    break
+                status, body, content_type = await self.dispatch(request)
+                writer.write(encode_response(status, body, content_type, request.keep_alive))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request):
+        """
+        Routes a request and returns (status, body, content_type). Latencies are recorded per endpoint.
+        """
+        started = time.perf_counter()
+        endpoint, status = 'unknown', 200
+        token = _profiling.set(None)
+        try:
+            kind = request.query.get('profile', [None])[-1]
+            if kind is not None and kind not in PROFILERS:
+                raise HTTPError(400, f"'profile' must be one of {PROFILERS}")
+            for method, pattern, name, handler in self.routes:
+                match = pattern.fullmatch(request.path)
+                if match is None:
+                    continue
+                endpoint = name
+                if request.method != method:
+                    raise HTTPError(405, f"{request.path} only accepts {method}")
+                if kind is not None:
+                    reports = []
+                    _profiling.set((kind, reports))
+                result = await handler(request, *match.groups())
+                if kind is not None:
+                    for report in reports:
+                        logger.info("Profile of %s %s, %s:\n%s", request.method, request.path, report['call'],
+                                    report['report'])
+                    if isinstance(result, dict):
+                        result = dict(result, profile=reports)
+                if isinstance(result, str):
+                    return status, result, 'text/plain; version=0.0.4'
+                return status, json.dumps(result, default=_to_json), 'application/json'
+            raise HTTPError(404, f"No endpoint at {request.path}")
+        except HTTPError as exc:
+            status = exc.status
+            return status, json.dumps({'error': exc.message}), 'application/json'
+        except KeyError as exc:
+            status = 404
+            return status, json.dumps({'error': f"Unknown id {exc.args[0] if exc.args else ''}"}), 'application/json'
+        except ValueError as exc:
+            status = 400
+            return status, json.dumps({'error': str(exc)}), 'application/json'
+        except Exception:
+            logger.exception("Request %s %s failed", request.method, request.path)
+            status = 500
+            return status, json.dumps({'error': 'Internal error'}), 'application/json'
+        finally:
+            _profiling.reset(token)
+            self.latency.record(endpoint, time.perf_counter() - started, error=status >= 400)
+
+    def _check_users(self, user_ids):
+        matrix = self.recommender.matrix
+        for user_id in user_ids:
+            if not matrix.has_user(user_id):
+                raise HTTPError(404, f"Unknown user {user_id}")
+
+    async def _recommend_users(self, items):
+        # items are (user_id, neighbours, n); one batched call per number of neighbours
+        results = [None] * len(items)
+        by_k = {}
+        for position, (user_id, k, n) in enumerate(items):
+            by_k.setdefault(k, []).append(position)
+        for k, positions in by_k.items():
+            user_ids = list(dict.fromkeys(items[position][0] for position in positions))
+            top_n = max(items[position][2] for position in positions)
+            batch = await self.call('recommend_movies_batch', user_ids, k=k, top_n=top_n)
+            for position in positions:
+                user_id, _, n = items[position]
+                results[position] = batch[user_id][:n]
+        return results
+
+    async def _recommend_groups(self, items):
+        return await self.call('group_recommendations_batch', items)
+
+    async def health(self, request):
+        snapshot = self.recommender.snapshot
+        return {'status': 'ok'} if snapshot is None else {'status': 'ok', 'snapshot': snapshot.version}
+
+    async def metrics(self, request):
+        if request.query.get('format', [''])[-1] == 'prometheus':
+            lines = [instrumentation.to_prometheus().rstrip('\n')]
+            lines.append('# TYPE recommender_request_latency_seconds summary')
+            for endpoint, stats in self.latency.summary().items():
+                for quantile in ('50', '90', '99'):
+                    lines.append(f'recommender_request_latency_seconds{{endpoint="{endpoint}",'
+                                 f'quantile="0.{quantile}"}} {stats[f"p{quantile}_ms"] / 1000:.6f}')
+                lines.append(f'recommender_request_latency_seconds_count{{endpoint="{endpoint}"}} {stats["count"]}')
+            return '\n'.join(line for line in lines if line) + '\n'
+        return {
+            'latency': self.latency.summary(),
+            'batching': {'users': self.user_batcher.stats(), 'groups': self.group_batcher.stats()},
+            'instrumentation': instrumentation.snapshot(),
+        }
+
+    async def user_recommendations(self, request, user_id):
+        user_id = int(user_id)
+        self._check_users([user_id])
+        n, k = request.int_param('n', 10), request.int_param('neighbours', 5)
+        if n < 1 or k < 1:
+            raise HTTPError(400, "'n' and 'neighbours' must be positive")
+        recommended = await self._batched(self.user_batcher, (user_id, k, n))
+        return {'user': user_id,
+                'recommendations': [{'movie': movie_id, 'rating': rating} for movie_id, rating in recommended]}
+
+    async def similar_users(self, request, user_id):
+        user_id = int(user_id)
+        self._check_users([user_id])
+        n = _positive(request.int_param('n', 10), 'n')
+        similar = await self.call('find_similar_users', user_id, n)
+        return {'user': user_id, 'similar': [{'user': other, 'similarity': sim} for other, sim in similar]}
+
+    async def group_recommendations(self, request):
+        from .aggregation import STRATEGIES
+
+        payload = request.json()
+        users = _user_ids(payload)
+        self._check_users(users)
+        strategy = payload.get('strategy', 'average')
+        if strategy not in STRATEGIES:
+            raise HTTPError(400, f"Unknown strategy '{strategy}', expected one of {sorted(STRATEGIES)}")
+        n = _positive(payload.get('n', 10), 'n')
+        disagreement = bool(payload.get('disagreement', False))
+        movies = await self._batched(self.group_batcher, (users, strategy, n, disagreement))
+        return {'users': users, 'strategy': strategy, 'movies': movies}
+
+    async def sequential_recommendations(self, request):
+        payload = request.json()
+        users = _user_ids(payload)
+        self._check_users(users)
+        n, sequences = _positive(payload.get('n', 10), 'n'), _positive(payload.get('sequences', 3), 'sequences')
+        if payload.get('ranked'):
+            result, _ = await self.call('sequential_recommendations_with_info', users, n, sequences)
+        else:
+            result = await self.call('sequential_recommendations', users, n, sequences, seed=payload.get('seed'))
+        return {'users': users, 'sequences': result}
+
+    async def explanations(self, request):
+        payload = request.json()
+        users = _user_ids(payload)
+        self._check_users(users)
+        case = payload.get('case')
+        if case not in EXPLANATION_CASES:
+            raise HTTPError(400, f"'case' must be one of {EXPLANATION_CASES}")
+        if case == 'group':
+            if not isinstance(payload.get('genre'), str):
+                raise HTTPError(400, "The group case needs a 'genre'")
+            explanation = await self.call('explain_group_case', payload['genre'], users)
+        else:
+            if not isinstance(payload.get('movie'), int):
+                raise HTTPError(400, f"The {case} case needs a 'movie' id")
+            method = 'explain_atomic_case' if case == 'atomic' else 'explain_position_absenteeism'
+            explanation = await self.call(method, payload['movie'], users)
+        return {'users': users, 'case': case, 'explanation': explanation}
+
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"Unknown or expired session {session_id}")
+        # Refreshes the entry, so the TTL counts from the last request
+        self.sessions.put(session_id, session)
+        return session
+
+    async def create_session(self, request):
+        payload = request.json()
+        users = _user_ids(payload)
+        self._check_users(users)
+        n = _positive(payload.get('n', 10), 'n')
+        session = await self.call_local(self.recommender.group_session, users, n)
+        session_id = uuid.uuid4().hex
+        self.sessions.put(session_id, session)
+        return {'session': session_id, 'users': session.members}
+
+    async def session_round(self, request, session_id):
+        session = self._session(session_id)
+        movies = await self.call_local(session.next_round)
+        return {'session': session_id, 'round': session.rounds - 1, 'movies': movies,
+                'satisfaction': [{'user': user, 'satisfaction': value} for user, value in session.satisfaction.items()]}
+
+    async def session_feedback(self, request, session_id):
+        session = self._session(session_id)
+        payload = request.json()
+        watched, skipped = payload.get('watched', []), payload.get('skipped', [])
+        for field, movies in (('watched', watched), ('skipped', skipped)):
+            if not isinstance(movies, list) or not all(isinstance(movie, int) for movie in movies):
+                raise HTTPError(400, f"'{field}' must be a list of movie ids")
+        ratings = payload.get('ratings', [])
+        try:
+            ratings = [(int(item['user']), int(item['movie']), float(item['rating'])) for item in ratings]
+        except (TypeError, KeyError, ValueError):
+            raise HTTPError(400, "'ratings' must be a list of {\"user\", \"movie\", \"rating\"} objects")
+        await self.call_local(session.feedback, watched, skipped, ratings)
+        return {'session': session_id, 'rounds': session.rounds}
+
+
+def serve(recommender=None, host='127.0.0.1', port=8000, **options):
+    """
+    Runs a RecommendationService until interrupted. options are passed to RecommendationService.
+    """
+    service = RecommendationService(recommender, **options)
+    try:
+        asyncio.run(service.serve_forever(host, port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
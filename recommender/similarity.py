@@ -0,0 +1,265 @@
+import numpy as np
+from scipy import sparse
+
+from .matrix import RatingMatrix, entry_positions
+
+METRICS = ('pearson', 'cosine')
+
+
+def _safe_divide(numerator, denominator):
+    # Similarity is defined as 0 when one of the users has no variance / no ratings
+    out = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def top_k_indices(scores, k, exclude=None):
+    """
+    Returns the positions of the k largest scores in descending order, using a partial sort
+    instead of sorting every score. Ties are broken by position so the result is identical to
+    a stable descending sort.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if exclude is not None:
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+    valid = len(scores) if exclude is None else len(scores) - np.size(exclude)
+    k = max(0, min(k, valid))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        # Keep everything tied with the k-th score so the tie-break below stays stable
+        kth = np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(-scores <= kth)
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+class SimilarityEngine:
+    """
+    Computes Pearson and cosine similarities between users with sparse matrix products instead of
+    one scipy call per pair of users. Per-user sums, sums of squares and norms are precomputed once,
+    so a one-vs-all query is a single sparse row-times-matrix product and an all-vs-all pass is done
+    in row blocks that never hold more than block_size x num_users similarities in memory.
+
+    The matrix can be a RatingMatrix or anything RatingMatrix.from_any accepts. With co_rated=False the similarities match the original implementation, which correlates the
+    complete rating rows (unrated movies counted as 0). With co_rated=True only the movies rated by
+    both users are used, which is the usual definition in user-based collaborative filtering.
+    """
+
+    def __init__(self, matrix, metric='pearson', co_rated=False, statistics=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown similarity metric '{metric}', expected one of {METRICS}")
+        self.metric = metric
+        self.co_rated = co_rated
+        self.matrix = RatingMatrix.from_any(matrix)
+        self.refresh(statistics)
+
+    @property
+    def user_ids(self):
+        return self.matrix.user_ids
+
+    @property
+    def movie_ids(self):
+        return self.matrix.movie_ids
+
+    def refresh(self, statistics=None):
+        """
+        Recomputes the per-user statistics from the rating matrix, e.g. after RatingMatrix.update.
+        statistics can give the per-user (sums, sums of squares) when they are already known, e.g. from a
+        snapshot, so they are not computed again.
+        """
+        # float64 matrices are used as they are, so the engine shares the CSR / CSC arrays of the matrix
+        csr, csc = self.matrix.csr, self.matrix.csc
+        self._shares_matrix = csr.dtype == np.float64
+        self.X = X = csr if self._shares_matrix else csr.astype(np.float64)
+        self._XT = (csc if csc.dtype == np.float64 else csc.astype(np.float64)).T
+        self.num_users, self.num_items = X.shape
+        if statistics is not None:
+            self._sums, self._sumsq = statistics
+        else:
+            self._sums = np.asarray(X.sum(axis=1)).ravel()
+            self._sumsq = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        self._norms = np.sqrt(self._sumsq)
+        # Full-row statistics: pearsonr over all columns is a cosine of the mean-centred rows
+        self._means = self._sums / self.num_items
+        self._centred_norms = np.sqrt(np.maximum(self._sumsq - self.num_items * self._means ** 2, 0))
+        if self.co_rated:
+            self._B = X.copy()
+            self._B.data = np.ones_like(self._B.data)
+            self._BT = self._B.T.tocsr()
+            self._X2T = X.multiply(X).T.tocsr()
+
+    def refresh_entries(self, rows, cols):
+        """
+        Brings the engine up to date after RatingMatrix.update overwrote the ratings at the given row and
+        column positions in place: the new values are copied into the engine's float64 arrays and only the
+        statistics of those rows are recomputed. Falls back to refresh() when the update added ratings.
+        """
+        matrix = self.matrix
+        if matrix.shape != self.X.shape or matrix.nnz != self.X.nnz:
+            self.refresh()
+            return
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        # The engine's CSR copy has the same structure as the matrix's
+        positions = entry_positions(self.X.indptr, self.X.indices, rows, cols)
+        if not self._shares_matrix:
+            self.X.data[positions] = matrix.csr.data[positions]
+        values = self.X.data[positions]
+        transposed = [self._XT] + ([self._X2T] if self.co_rated else [])
+        for target, squared in zip(transposed, (False, True)):
+            positions = entry_positions(target.indptr, target.indices, cols, rows)
+            target.data[positions] = values ** 2 if squared else values
+
+        changed = np.unique(rows)
+        indptr, data = self.X.indptr, self.X.data
+        for row in changed.tolist():
+            row_values = data[indptr[row]:indptr[row + 1]]
+            self._sums[row] = row_values.sum()
+            self._sumsq[row] = row_values @ row_values
+        self._norms[changed] = np.sqrt(self._sumsq[changed])
+        self._means[changed] = self._sums[changed] / self.num_items
+        self._centred_norms[changed] = np.sqrt(np.maximum(
+            self._sumsq[changed] - self.num_items * self._means[changed] ** 2, 0))
+
+    @property
+    def statistics(self):
+        """
+        Per-user (sums, sums of squares) of the ratings, as accepted by the constructor.
+        """
+        return self._sums, self._sumsq
+
+    def position(self, user_id):
+        return self.matrix.user_index(user_id)
+
+    def _metric(self, metric):
+        metric = metric or self.metric
+        if metric not in METRICS:
+            raise ValueError(f"Unknown similarity metric '{metric}', expected one of {METRICS}")
+        return metric
+
+    def rows_vs_all(self, rows, metric=None):
+        """
+        Similarities between the users at the given row positions and every user, as a dense
+        (len(rows), num_users) array.
+        """
+        metric = self._metric(metric)
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        Xr = self.X[rows]
+        dot = (Xr @ self._XT).toarray()
+        if self.co_rated:
+            return self._co_rated_similarity(rows, Xr, dot, metric)
+        if metric == 'cosine':
+            return _safe_divide(dot, self._norms[rows, None] * self._norms[None, :])
+        # Multiplying the means first keeps sim(a, b) == sim(b, a) to the last bit, so a list patched from the
+        # other user's row orders ties like a rebuilt one
+        covariance = dot - self.num_items * (self._means[rows, None] * self._means[None, :])
+        return _safe_divide(covariance, self._centred_norms[rows, None] * self._centred_norms[None, :])
+
+    def _co_rated_similarity(self, rows, Xr, dot, metric):
+        Br = self._B[rows]
+        # Sums over the movies rated by both users of each pair
+        n = (Br @ self._BT).toarray()
+        sum_x = (Xr @ self._BT).toarray()
+        sum_y = (Br @ self._XT).toarray()
+        sumsq_x = (Xr.multiply(Xr) @ self._BT).toarray()
+        sumsq_y = (Br @ self._X2T).toarray()
+        if metric == 'cosine':
+            return _safe_divide(dot, np.sqrt(sumsq_x * sumsq_y))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = dot - sum_x * sum_y / n
+            var_x = sumsq_x - sum_x ** 2 / n
+            var_y = sumsq_y - sum_y ** 2 / n
+        # Pearson needs at least two co-rated movies
+        covariance[n < 2] = 0
+        denominator = np.sqrt(np.maximum(var_x, 0) * np.maximum(var_y, 0))
+        denominator[n < 2] = 0
+        return _safe_divide(np.nan_to_num(covariance), np.nan_to_num(denominator))
+
+    def one_vs_all(self, user_id, metric=None):
+        return self.rows_vs_all([self.position(user_id)], metric)[0]
+
+    def similarity(self, user1, user2, metric=None):
+        return float(self.exact_similarities(user1, [user2], metric)[0])
+
+    def exact_similarities(self, user_id, other_ids, metric=None):
+        """
+        Similarities of user_id to each of other_ids, computed pair by pair on the dense rating rows the way
+        the original implementation did (scipy.stats.pearsonr, or a dot product over the two norms), so they
+        agree with it to the last bit. The sparse products agree only up to rounding, which is enough to
+        rank users but can decide between predictions that tie. Each pair costs O(num_movies), so this is
+        for the few neighbours of a single user; with co_rated=True the sparse values are returned.
+        """
+        metric = self._metric(metric)
+        others = self.matrix.user_positions(list(other_ids))
+        if self.co_rated or not len(others):
+            return self.one_vs_all(user_id, metric)[others]
+        x = self.X[self.position(user_id)].toarray().astype(np.float64).ravel()
+        rows = self.X[others].toarray().astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric == 'cosine':
+                norm = np.linalg.norm(x)
+                values = np.array([np.dot(x, row) / (norm * np.linalg.norm(row)) for row in rows])
+            else:
+                import warnings
+
+                from scipy.stats import pearsonr
+
+                with warnings.catch_warnings():
+                    # Constant rows have no correlation; like the sparse products they get 0 below
+                    warnings.simplefilter('ignore')
+                    values = pearsonr(np.broadcast_to(x, rows.shape), rows, axis=1)[0]
+        return np.where(np.isfinite(values), values, 0.0)
+
+    def iter_blocks(self, block_size=1024, metric=None):
+        """
+        Yields (start, block) pairs covering the all-vs-all similarity matrix, where block holds the
+        similarities of users start..start + len(block) against every user.
+        """
+        for start in range(0, self.num_users, block_size):
+            rows = np.arange(start, min(start + block_size, self.num_users))
+            yield start, self.rows_vs_all(rows, metric)
+
+    def top_k(self, user_id, k=5, metric=None):
+        """
+        Finds the k users most similar to user_id, returned as a list of (user_id, similarity)
+        sorted by descending similarity.
+        """
+        pos = self.position(user_id)
+        scores = self.one_vs_all(user_id, metric)
+        best = top_k_indices(scores, k, exclude=pos)
+        return [(self.user_ids[i].item(), scores[i].item()) for i in best]
+
+    def top_k_batch(self, user_ids, k=5, metric=None):
+        """
+        Neighbours of several users from one block similarity product. Returns (positions, neighbours,
+        similarities) where neighbours holds row positions, padded with -1 / nan past the available users.
+        """
+        positions = self.matrix.user_positions(list(user_ids))
+        k = min(k, self.num_users - 1)
+        neighbours = np.full((len(positions), k), -1, dtype=np.int64)
+        similarities = np.full((len(positions), k), np.nan)
+        for row, (pos, scores) in enumerate(zip(positions, self.rows_vs_all(positions, metric))):
+            best = top_k_indices(scores, k, exclude=pos)
+            neighbours[row, :len(best)] = best
+            similarities[row, :len(best)] = scores[best]
+        return positions, neighbours, similarities
+
+    def top_k_all(self, k=5, block_size=1024, metric=None):
+        """
+        Computes the k nearest neighbours of every user. Returns (indices, similarities), both of shape
+        (num_users, k), where indices are row positions. Rows with fewer than k other users are padded
+        with -1 / nan.
+        """
+        k = min(k, self.num_users - 1)
+        indices = np.full((self.num_users, k), -1, dtype=np.int64)
+        similarities = np.full((self.num_users, k), np.nan)
+        for start, block in self.iter_blocks(block_size, metric):
+            for offset, scores in enumerate(block):
+                row = start + offset
+                best = top_k_indices(scores, k, exclude=row)
+                indices[row, :len(best)] = best
+                similarities[row, :len(best)] = scores[best]
+        return indices, similarities
@@ -0,0 +1,281 @@
+"""
+Versioned snapshots of what a Recommender serves from, opened memory-mapped by every worker process.
+
+A snapshot is a directory of flat .npy arrays plus a manifest.json:
+
+- the rating matrix as float64 CSR and CSC arrays with the user and movie ids, and the per-user sums and sums
+  of squares of the similarity engine,
+- the precomputed neighbour lists of the NeighbourIndex,
+- the movie titles and genres as UTF-8 buffers with offsets,
+- optionally the item similarity model, its similarity matrix and the transpose.
+
+Snapshots live in a root directory next to a CURRENT file naming the published one:
+
+    root/CURRENT
+    root/00000001/manifest.json, csr_data.npy, ...
+    root/00000002/...
+
+write_snapshot writes a new version into a temporary directory, renames it into place and then replaces
+CURRENT, both atomic renames, so a reader sees either the old or the new snapshot and never a partial one.
+Every array is opened with mmap_mode='r', so the workers of a host share one copy through the page cache and
+opening a snapshot does not read, parse or compute anything proportional to the number of ratings. The arrays
+are read-only; new ratings go into the next snapshot.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+CURRENT = 'CURRENT'
+MANIFEST = 'manifest.json'
+FORMAT = 1
+
+
+def _encode(values):
+    from .data import _encode_strings
+    return _encode_strings([str(value) for value in values])
+
+
+class MoviesData(Mapping):
+    """
+    Read-only movie id -> {'title', 'genres'} mapping over the arrays of a snapshot, the same as the
+    dictionary data.build_movies_data returns. Entries are decoded on access, so opening it costs nothing
+    however many movies there are.
+    """
+
+    def __init__(self, movie_ids, order, titles, title_offsets, genres, genre_offsets):
+        self.movie_ids = movie_ids
+        self._order = order
+        self._sorted_ids = movie_ids[order]
+        self._titles, self._title_offsets = titles, title_offsets
+        self._genres, self._genre_offsets = genres, genre_offsets
+
+    def _position(self, movie_id):
+        found = np.searchsorted(self._sorted_ids, movie_id)
+        if found < len(self._sorted_ids) and self._sorted_ids[found] == movie_id:
+            return int(self._order[found])
+        raise KeyError(movie_id)
+
+    @staticmethod
+    def _decode(buffer, offsets, position):
+        return bytes(buffer[offsets[position]:offsets[position + 1]]).decode('utf-8')
+
+    def __getitem__(self, movie_id):
+        position = self._position(movie_id)
+        return {'title': self._decode(self._titles, self._title_offsets, position),
+                'genres': self._decode(self._genres, self._genre_offsets, position).split('|')}
+
+    def __contains__(self, movie_id):
+        try:
+            self._position(movie_id)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.movie_ids.tolist())
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+
+def current_snapshot(root):
+    """
+    Directory of the snapshot published in root, or None when nothing was published yet.
+    """
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, name) if name else None
+
+
+def publish(root, name):
+    """
+    Makes root/name the current snapshot, replacing CURRENT atomically.
+    """
+    fd, tmp = tempfile.mkstemp(prefix='.current-', dir=root)
+    with os.fdopen(fd, 'w') as f:
+        f.write(name + '\n')
+    os.replace(tmp, os.path.join(root, CURRENT))
+
+
+def _next_name(root):
+    versions = [int(entry) for entry in os.listdir(root) if entry.isdigit()]
+    return f'{max(versions, default=0) + 1:08d}'
+
+
+def _prune(root, keep, current):
+    # Workers that still map an older snapshot keep their pages after the files are removed
+    versions = sorted(entry for entry in os.listdir(root) if entry.isdigit())
+    for entry in versions[:-keep] if keep else []:
+        if entry != current:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+def write_snapshot(recommender, root, item_model=False, keep=3):
+    """
+    Writes the rating matrix, neighbour lists and movie metadata of a Recommender (and its item similarity
+    model with item_model=True) as a new snapshot in root, publishes it and returns its directory. Only the
+    keep most recent snapshots are kept.
+    """
+    matrix = recommender.matrix
+    index = recommender.neighbour_index
+    engine = index.engine
+    csr = matrix.csr.astype(np.float64)
+    csc = matrix.csc.astype(np.float64)
+    sums, sumsq = engine.statistics
+    indices, similarities, lengths = index.arrays()
+    arrays = {
+        'csr_data': csr.data, 'csr_indices': csr.indices, 'csr_indptr': csr.indptr,
+        'csc_data': csc.data, 'csc_indices': csc.indices, 'csc_indptr': csc.indptr,
+        'user_ids': matrix.user_ids, 'movie_ids': matrix.movie_ids,
+        'user_sums': sums, 'user_sumsq': sumsq,
+        'neighbour_indices': indices, 'neighbour_similarities': similarities, 'neighbour_lengths': lengths,
+    }
+
+    movies_data = recommender.movies_data
+    movie_ids = np.fromiter(movies_data, dtype=np.int64, count=len(movies_data))
+    arrays['movies_movie_ids'] = movie_ids
+    arrays['movies_order'] = np.argsort(movie_ids, kind='stable')
+    arrays['titles'], arrays['title_offsets'] = _encode(movies_data[movie_id]['title'] for movie_id in movie_ids)
+    arrays['genres'], arrays['genre_offsets'] = _encode('|'.join(movies_data[movie_id]['genres'])
+                                                        for movie_id in movie_ids)
+
+    manifest = {
+        'format': FORMAT,
+        'created': time.time(),
+        'data_dir': os.path.abspath(recommender.data_dir) if recommender.data_dir else None,
+        'shape': list(matrix.shape),
+        'neighbours': {'k': index.k, 'metric': engine.metric, 'co_rated': engine.co_rated},
+        'item_model': None,
+    }
+    if item_model:
+        model = recommender.item_model
+        if not np.array_equal(model.movie_ids, matrix.movie_ids):
+            raise ValueError("The item similarity model was fitted on different movies than the rating matrix")
+        arrays.update({
+            'item_similarity_data': model.similarities.data, 'item_similarity_indices': model.similarities.indices,
+            'item_similarity_indptr': model.similarities.indptr,
+            'item_neighbour_of_data': model.neighbour_of.data, 'item_neighbour_of_indices': model.neighbour_of.indices,
+            'item_neighbour_of_indptr': model.neighbour_of.indptr,
+            'item_movie_means': model.movie_means,
+        })
+        manifest['item_model'] = {
+            'k': model.k, 'metric': model.metric, 'shrinkage': model.shrinkage, 'min_support': model.min_support,
+            'max_block_entries': model.max_block_entries, 'rating_range': list(model.rating_range),
+        }
+
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.snapshot-', dir=root)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), np.ascontiguousarray(array))
+        manifest['arrays'] = {name: {'dtype': np.asarray(array).dtype.str, 'shape': list(np.shape(array))}
+                              for name, array in arrays.items()}
+        with open(os.path.join(tmp, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        while True:
+            name = _next_name(root)
+            try:
+                os.rename(tmp, os.path.join(root, name))
+                break
+            except OSError:
+                # Another writer took this version first
+                if not os.path.exists(os.path.join(root, name)):
+                    raise
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    publish(root, name)
+    _prune(root, keep, name)
+    return os.path.join(root, name)
+
+
+class Snapshot:
+    """
+    A snapshot directory opened read-only. The objects it builds share the memory-mapped arrays.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(os.path.join(self.path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT:
+            raise ValueError(f"Snapshot {path} has format {self.manifest.get('format')}, expected {FORMAT}")
+        self._arrays = {}
+
+    @property
+    def version(self):
+        return os.path.basename(self.path)
+
+    def __repr__(self):
+        return f"Snapshot({self.path!r})"
+
+    def array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def matrix(self):
+        from scipy import sparse
+
+        from .matrix import RatingMatrix
+
+        shape = tuple(self.manifest['shape'])
+        csr = sparse.csr_matrix((self.array('csr_data'), self.array('csr_indices'), self.array('csr_indptr')),
+                                shape=shape, copy=False)
+        # Canonical by construction, which saves RatingMatrix a pass over the indices
+        csr.has_canonical_format = True
+        csc = sparse.csc_matrix((self.array('csc_data'), self.array('csc_indices'), self.array('csc_indptr')),
+                                shape=shape, copy=False)
+        return RatingMatrix(csr, self.array('user_ids'), self.array('movie_ids'), csc=csc)
+
+    def neighbour_index(self, matrix):
+        from .neighbours import NeighbourIndex
+        from .similarity import SimilarityEngine
+
+        options = self.manifest['neighbours']
+        engine = SimilarityEngine(matrix, metric=options['metric'], co_rated=options['co_rated'],
+                                  statistics=(self.array('user_sums'), self.array('user_sumsq')))
+        return NeighbourIndex.from_arrays(engine, options['k'], self.array('neighbour_indices'),
+                                          self.array('neighbour_similarities'), self.array('neighbour_lengths'))
+
+    def movies_data(self):
+        return MoviesData(self.array('movies_movie_ids'), self.array('movies_order'), self.array('titles'),
+                          self.array('title_offsets'), self.array('genres'), self.array('genre_offsets'))
+
+    @property
+    def has_item_model(self):
+        return self.manifest.get('item_model') is not None
+
+    def item_model(self, matrix):
+        from scipy import sparse
+
+        from .items import ItemSimilarityModel
+
+        if not self.has_item_model:
+            raise ValueError(f"Snapshot {self.path} has no item similarity model")
+        num_movies = matrix.shape[1]
+        similarities, neighbour_of = (
+            sparse.csr_matrix((self.array(f'item_{name}_data'), self.array(f'item_{name}_indices'),
+                               self.array(f'item_{name}_indptr')), shape=(num_movies, num_movies), copy=False)
+            for name in ('similarity', 'neighbour_of'))
+        return ItemSimilarityModel.from_arrays(matrix, similarities, self.array('item_movie_means'),
+                                               neighbour_of=neighbour_of, **self.manifest['item_model'])
+
+    def load(self):
+        """
+        {name: object} of everything in the snapshot, keyed like the lazily loaded attributes of Recommender.
+        """
+        matrix = self.matrix()
+        loaded = {'snapshot': self, 'matrix': matrix, 'neighbour_index': self.neighbour_index(matrix),
+                  'movies_data': self.movies_data()}
+        if self.has_item_model:
+            loaded['item_model'] = self.item_model(matrix)
+        return loaded
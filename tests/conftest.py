@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The shared recommender package lives in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def make_ratings(num_users=60, num_movies=80, density=0.3, seed=0, copies=4):
+    """
+    Random whole-star ratings as a ratings.csv-style DataFrame. The last copies users repeat the ratings of
+    earlier users, so many similarities tie exactly.
+    """
+    rng = np.random.default_rng(seed)
+    rated = rng.random((num_users, num_movies)) < density
+    values = rng.integers(1, 6, size=(num_users, num_movies)).astype(np.float64)
+    for user in range(num_users - copies, num_users):
+        rated[user], values[user] = rated[user - copies], values[user - copies]
+    users, movies = np.nonzero(rated)
+    return pd.DataFrame({'userId': users + 1, 'movieId': (movies + 1) * 10, 'rating': values[users, movies],
+                         'timestamp': 1_000_000_000 + np.arange(len(users))})
+
+
+def rating_changes(ratings):
+    """
+    Batches of rating updates for ratings, applied in order: overwritten ratings, new ratings of existing
+    movies, user 5 overwriting its ratings and taking over user 1's, and a new user. No movie is new, so
+    full-row Pearson similarities stay exact under incremental updates.
+    """
+    overwritten = ratings.sample(30, random_state=1).assign(rating=lambda frame: 6 - frame['rating'])
+    rated = set(zip(ratings['userId'], ratings['movieId']))
+    movies = np.unique(ratings['movieId'])
+    added = pd.DataFrame([(user_id, movie_id, 5.0) for user_id in (3, 7, 11) for movie_id in movies[:12]
+                          if (user_id, movie_id) not in rated], columns=['userId', 'movieId', 'rating'])
+    copied = ratings[ratings['userId'] == 1].assign(userId=5)
+    cleared = ratings[ratings['userId'] == 5].assign(rating=0.5)
+    new_user = ratings[ratings['userId'] == 2].assign(userId=1000, rating=lambda frame: frame['rating'] - 0.5)
+    return [frame[['userId', 'movieId', 'rating']] for frame in (overwritten, added, cleared, copied, new_user)]
+
+
+@pytest.fixture
+def ratings():
+    return make_ratings()
+
+
+@pytest.fixture
+def data_dir(tmp_path, ratings):
+    ratings.to_csv(tmp_path / 'ratings.csv', index=False)
+    movie_ids = np.unique(ratings['movieId'])
+    pd.DataFrame({'movieId': movie_ids, 'title': [f'Movie {movie_id}' for movie_id in movie_ids],
+                  'genres': 'Drama'}).to_csv(tmp_path / 'movies.csv', index=False)
+    return str(tmp_path)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from recommender.aggregation import average, least_misery
+
+NAN = np.nan
+SCORES = np.array([[4.0, NAN, 3.0],
+                   [NAN, NAN, NAN],
+                   [2.0, 5.0, NAN]])
+
+
+def test_missing_predictions_are_skipped_by_default():
+    np.testing.assert_allclose(average(SCORES), [3.0, 5.0, 3.0])
+    np.testing.assert_allclose(least_misery(SCORES), [2.0, 5.0, 3.0])
+
+
+def test_impute_counts_missing_members_with_their_mean_prediction():
+    np.testing.assert_allclose(average(SCORES, impute=True), [3.0, 4.25, 3.25])
+    np.testing.assert_allclose(least_misery(SCORES, impute=True), [2.0, 3.5, 3.0])
+
+
+def test_min_members_drops_movies_with_too_few_predictions():
+    np.testing.assert_allclose(average(SCORES, min_members=2), [3.0, NAN, NAN])
+    np.testing.assert_allclose(least_misery(SCORES, min_members=2), [2.0, NAN, NAN])
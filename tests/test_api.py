@@ -0,0 +1,23 @@
+from recommender import Recommender
+
+
+def _ids(similar):
+    return [user_id for user_id, _ in similar]
+
+
+def test_add_ratings_reaches_cached_recommendations(data_dir, tmp_path):
+    recommender = Recommender(data_dir, str(tmp_path / 'cache'), k=10)
+    similar = recommender.find_similar_users(1, 5)
+    recommended = recommender.recommend_movies(1)
+    assert 2 not in [user_id for user_id, _ in similar]
+
+    # User 2 takes over user 1's ratings and so becomes its most similar user
+    matrix = recommender.matrix
+    row = matrix.csr[matrix.user_index(1)]
+    movies = matrix.movie_ids[row.indices].tolist()
+    recommender.add_ratings([2] * len(movies), movies, row.data.tolist())
+
+    similar_after = recommender.find_similar_users(1, 5)
+    assert similar_after[0][0] == 2
+    assert _ids(similar_after) == _ids(recommender.neighbour_index.top_k(1, 5))
+    assert recommender.recommend_movies(1) != recommended
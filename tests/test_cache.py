@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from conftest import rating_changes
+
+from recommender.cache import RecommendationCache
+from recommender.matrix import RatingMatrix
+from recommender.neighbours import NeighbourIndex
+from recommender.similarity import SimilarityEngine
+
+
+def _ids(similar):
+    return [user_id for user_id, _ in similar]
+
+
+def _copy_user(matrix, source, target):
+    # The ratings that make target a copy of source
+    row = matrix.csr[matrix.user_index(source)]
+    movies = matrix.movie_ids[row.indices].tolist()
+    return [target] * len(movies), movies, row.data.tolist()
+
+
+@pytest.fixture
+def matrix(ratings):
+    return RatingMatrix.from_ratings(ratings)
+
+
+def test_cached_neighbours_follow_a_user_entering_the_list(matrix):
+    index = NeighbourIndex(matrix, k=5, metric='cosine')
+    cache = RecommendationCache(index)
+    predictions = cache.predictions(1, 5)
+    outsider = _outsider(matrix, cache.neighbours(1, 5))
+
+    # Only the outsider's ratings change, and the outsider is not in user 1's list yet
+    index.update(*_copy_user(matrix, 1, outsider))
+    assert _ids(cache.neighbours(1, 5)) == _ids(index.top_k(1, 5))
+    assert cache.neighbours(1, 5)[0][0] == outsider
+    assert cache.predictions(1, 5) != predictions
+
+
+def _outsider(matrix, similar):
+    # A user other than 1 that is not among the similar users
+    listed = set(_ids(similar))
+    return next(user_id for user_id in matrix.user_ids.tolist()[1:] if user_id not in listed)
+
+
+def test_cached_neighbours_beyond_the_indexed_k_depend_on_every_rating(matrix):
+    index = NeighbourIndex(matrix, k=3, metric='cosine')
+    cache = RecommendationCache(index)
+    outsider = _outsider(matrix, cache.neighbours(1, 8))
+    index.update(*_copy_user(matrix, 1, outsider))
+    assert _ids(cache.neighbours(1, 8)) == _ids(index.engine.top_k(1, 8))
+    assert cache.neighbours(1, 8)[0][0] == outsider
+
+
+def test_cached_neighbours_of_an_engine_depend_on_every_rating(matrix):
+    engine = SimilarityEngine(matrix, metric='cosine')
+    cache = RecommendationCache(engine)
+    outsider = _outsider(matrix, cache.neighbours(1, 5))
+    matrix.update(*_copy_user(matrix, 1, outsider))
+    engine.refresh()
+    assert cache.neighbours(1, 5)[0][0] == outsider
+
+
+def test_unchanged_entries_are_hits(matrix):
+    index = NeighbourIndex(matrix, k=5, metric='cosine')
+    cache = RecommendationCache(index)
+    first = cache.neighbours(1, 5)
+    assert cache.neighbours(1, 5) is first
+    assert cache.stats()['stale'] == 0
+
+
+def _assert_same_entries(cache, expected):
+    for user_id in expected.engine.user_ids.tolist():
+        for k in (5, 8):
+            assert cache.neighbours(user_id, k) == expected.neighbours(user_id, k), (user_id, k)
+            assert cache.predictions(user_id, k) == expected.predictions(user_id, k), (user_id, k)
+    for group in [(1, 2, 3), (5, 54, 58)]:
+        assert cache.group_recommendations(group) == expected.group_recommendations(group), group
+
+
+@pytest.mark.parametrize('metric', ['pearson', 'cosine'])
+def test_cached_entries_after_updates_equal_a_rebuild(ratings, metric):
+    index = NeighbourIndex(RatingMatrix.from_ratings(ratings), k=5, metric=metric)
+    cache = RecommendationCache(index)
+    _assert_same_entries(cache, RecommendationCache(NeighbourIndex(index.matrix, k=5, metric=metric)))
+    applied = ratings[['userId', 'movieId', 'rating']]
+    for changes in rating_changes(ratings):
+        index.update_from_ratings(changes)
+        applied = pd.concat([applied, changes], ignore_index=True)
+        rebuilt = NeighbourIndex(RatingMatrix.from_ratings(applied), k=5, metric=metric)
+        _assert_same_entries(cache, RecommendationCache(rebuilt))
+    assert cache.stats()['stale'] > 0
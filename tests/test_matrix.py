@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from conftest import make_ratings
+from recommender.matrix import RatingMatrix
+
+
+def _entries(matrix, stored):
+    stored = stored.tocoo()
+    return sorted(zip(matrix.user_ids[stored.row].tolist(), matrix.movie_ids[stored.col].tolist(),
+                      stored.data.tolist()))
+
+
+def _assert_same(matrix, expected):
+    # New users and movies are appended rather than sorted in, so the ratings are compared by id
+    assert _entries(matrix, matrix.csr) == _entries(expected, expected.csr)
+    assert _entries(matrix, matrix.csc) == _entries(expected, expected.csr)
+    for user_id in expected.user_ids.tolist():
+        pd.testing.assert_series_equal(matrix.user_ratings(user_id).sort_index(), expected.user_ratings(user_id))
+
+
+def _updated(ratings, changes):
+    matrix = RatingMatrix.from_ratings(ratings)
+    matrix.csc  # so the in-place path has a CSC copy to keep up to date
+    matrix.update(changes['userId'].tolist(), changes['movieId'].tolist(), changes['rating'].to_numpy())
+    return matrix, RatingMatrix.from_ratings(pd.concat([ratings, changes], ignore_index=True))
+
+
+def test_overwritten_ratings_equal_a_rebuild(ratings):
+    # Existing pairs only, rated twice within the update so the last value has to win
+    changes = ratings.sample(40, random_state=0).assign(rating=lambda frame: 6 - frame['rating'])
+    changes = pd.concat([changes, changes.head(5).assign(rating=0.5)], ignore_index=True)
+    matrix, expected = _updated(ratings, changes)
+    _assert_same(matrix, expected)
+
+
+def test_new_ratings_users_and_movies_equal_a_rebuild(ratings):
+    changes = make_ratings(num_users=70, num_movies=90, density=0.05, seed=1, copies=0)
+    matrix, expected = _updated(ratings, changes)
+    _assert_same(matrix, expected)
+    assert matrix.version == 1
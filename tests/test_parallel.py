@@ -0,0 +1,23 @@
+from recommender import parallel
+from recommender.matrix import RatingMatrix
+from recommender.scoring import recommend_movies_batch
+from recommender.similarity import SimilarityEngine
+
+
+def test_serial_map_builds_one_engine_for_every_chunk(ratings, monkeypatch):
+    matrix = RatingMatrix.from_ratings(ratings)
+    built = []
+
+    class CountingEngine(SimilarityEngine):
+        def __init__(self, *args, **kwargs):
+            built.append(args)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(parallel, 'SimilarityEngine', CountingEngine)
+    user_ids = matrix.user_ids.tolist()
+    results = parallel.recommend_movies_parallel(matrix, user_ids, workers=1, chunk_size=7)
+    assert len(built) == 1
+    assert results == recommend_movies_batch(SimilarityEngine(matrix), user_ids)
+
+    parallel.recommend_movies_parallel(matrix, user_ids, workers=1, chunk_size=7)
+    assert len(built) == 2
@@ -0,0 +1,25 @@
+import numpy as np
+from scipy import sparse
+
+from recommender.scoring import predict_block
+
+
+def test_equal_predictions_keep_the_order_the_neighbours_found_them_in():
+    # The first neighbour rated movie 2 only, the second movie 0; both are predicted 4.0
+    X = sparse.csr_matrix(np.array([
+        [0.0, 5.0, 0.0],
+        [0.0, 0.0, 4.0],
+        [4.0, 0.0, 0.0],
+    ]))
+    (movies, predicted), = predict_block(X, [0], [[1, 2]], [[0.5, 0.5]])
+    assert movies.tolist() == [2, 0]
+    assert predicted.tolist() == [4.0, 4.0]
+
+
+def test_predictions_are_ranked_unrounded():
+    X = sparse.csr_matrix(np.array([
+        [0.0, 0.0, 0.0],
+        [0.0, 4.0, 4.0 + 1e-12],
+    ]))
+    (movies, predicted), = predict_block(X, [0], [[1]], [[1.0]], top_n=1)
+    assert movies.tolist() == [2]